@@ -0,0 +1,150 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""Asynchronous HTTP server using an ASGI event loop.
+"""
+
+import asyncio
+import logging
+
+from detection.broadcaster import SlowSubscriberError, sse_event
+from detection.controllers.detectionscontroller import KEEPALIVE_INTERVAL
+from detection.server import Server
+
+logger = logging.getLogger("detection")
+
+STREAM_PATH = "/detections/stream"
+
+
+class AsyncServer(Server):
+    """
+    ASGI server running the Flask controllers and streaming the live
+    detections natively over SSE and WebSocket.
+
+    The live detections subscribers are served from the event loop
+    without a thread per client, while the controllers requests run in
+    the ASGI thread pool. Requires the uvicorn and asgiref packages.
+    """
+
+    def __init__(self, controllers: list, host: str = '127.0.0.1', port: int = 8550,
+                 broadcaster=None):
+        """Create an ASGI server
+
+        Args:
+            controllers (list): A list of controllers
+            host (str, optional): Server address. Defaults to 127.0.0.1.
+            port (int, optional): Server port. Defaults to 8550.
+            broadcaster (Broadcaster, optional): live detections source served at
+            /detections/stream. Defaults to None.
+        """
+        super().__init__(controllers, host, port)
+        self._broadcaster = broadcaster
+        self._wsgi = None
+
+    async def __call__(self, scope, receive, send):
+        if self._broadcaster and scope["type"] in ("http", "websocket") \
+                and scope["path"] == STREAM_PATH:
+            if scope["type"] == "websocket":
+                await self._websocket(receive, send)
+            else:
+                await self._sse(receive, send)
+            return
+
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _until_disconnect(self, receive, disconnect_type):
+        while (await receive())["type"] != disconnect_type:
+            pass
+
+    async def _forward(self, write):
+        subscription = self._broadcaster.subscribe()
+        try:
+            while True:
+                messages = await subscription.get_async(timeout=KEEPALIVE_INTERVAL)
+                await write(messages)
+        except SlowSubscriberError as e:
+            logger.warning(f"Live detections client dropped: {e}")
+        finally:
+            subscription.close()
+
+    async def _serve(self, receive, disconnect_type, write):
+        """
+        Forward the live detections until the client disconnects
+
+        Returns:
+            bool: True if the client disconnected, False if it was dropped
+        """
+        forward = asyncio.ensure_future(self._forward(write))
+        disconnect = asyncio.ensure_future(
+            self._until_disconnect(receive, disconnect_type))
+        done, pending = await asyncio.wait([forward, disconnect],
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(forward, disconnect, return_exceptions=True)
+
+        return disconnect in done
+
+    async def _sse(self, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream"),
+                                (b"cache-control", b"no-cache"),
+                                (b"access-control-allow-origin", b"*")]})
+
+        async def write(messages):
+            if not messages:
+                body = ": keepalive\n\n"
+            else:
+                body = "".join(sse_event(message, sequence)
+                               for sequence, message in messages)
+            await send({"type": "http.response.body", "body": body.encode(),
+                        "more_body": True})
+
+        await self._serve(receive, "http.disconnect", write)
+
+    async def _websocket(self, receive, send):
+        if (await receive())["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+
+        async def write(messages):
+            for _, message in messages:
+                await send({"type": "websocket.send", "text": message})
+
+        if not await self._serve(receive, "websocket.disconnect", write):
+            await send({"type": "websocket.close"})
+
+    def start(self):
+        """
+        Run the server with given port.
+        """
+        try:
+            import uvicorn
+            from asgiref.wsgi import WsgiToAsgi
+        except ImportError as e:
+            raise RuntimeError(
+                "The async server requires the uvicorn and asgiref packages, "
+                "install them with: pip install .[async]") from e
+
+        self._wsgi = WsgiToAsgi(self._app)
+        uvicorn.run(self, host=self._host, port=self._port, log_level="warning")
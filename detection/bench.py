@@ -0,0 +1,610 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Offline pipeline benchmark
+
+Drives the detection pipeline from synthetic frames or a video file,
+with a stub model of configurable latency or a real model running on
+CPU, and an in-memory redis replacement, so the throughput can be
+measured without a Jetson, VST or redis.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import time
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+from detection.detection import Detection
+from detection.metrics import Metrics
+from detection.pipeline import PipelineConfig, import_cv2
+from detection.predictions import Predictions
+from detection.publisher import Publisher
+from detection.slicing import get_slice_rois
+
+logger = logging.getLogger("detection")
+
+PROMPTS = ["a person", "a car", "a box", "a ball", "a forklift", "a dog",
+           "a bicycle", "a truck", "a chair", "a backpack", "a bottle",
+           "a helmet", "a pallet", "a door", "a cat", "a phone"]
+
+
+class SyntheticSource:
+    """
+    videoSource replacement generating frames with a moving square
+    """
+
+    def __init__(self, width: int = 1920, height: int = 1080, fps: float = 0.0):
+        """
+        Args:
+            width (int, optional): frame width. Defaults to 1920.
+            height (int, optional): frame height. Defaults to 1080.
+            fps (float, optional): frame rate, 0 to generate frames as fast as
+            possible. Defaults to 0.
+        """
+        self._width = width
+        self._height = height
+        self._period = 1.0 / fps if fps > 0 else 0.0
+        self._next = time.perf_counter()
+        self._count = 0
+        rng = np.random.default_rng(0)
+        self._background = rng.integers(
+            0, 64, (height, width, 3), dtype=np.uint8)
+
+    def Capture(self):  # pylint: disable=invalid-name
+        """
+        Generate the next frame
+
+        Returns:
+            np.ndarray: HWC RGB frame
+        """
+        if self._period:
+            delay = self._next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next += self._period
+
+        size = min(self._width, self._height) // 8
+        x = (self._count * 8) % (self._width - size)
+        y = (self._count * 4) % (self._height - size)
+        self._count += 1
+
+        frame = self._background.copy()
+        frame[y:y + size, x:x + size] = 255
+        return frame
+
+    def GetWidth(self):  # pylint: disable=invalid-name
+        """ Frame width """
+        return self._width
+
+    def GetHeight(self):  # pylint: disable=invalid-name
+        """ Frame height """
+        return self._height
+
+
+class VideoFileSource:
+    """
+    videoSource replacement reading frames from a video file in a loop
+    """
+
+    def __init__(self, path: str, fps: float = 0.0):
+        """
+        Args:
+            path (str): video file path
+            fps (float, optional): frame rate, 0 to read frames as fast as
+            possible. Defaults to 0.
+        """
+        cv2 = import_cv2()
+
+        self._cv2 = cv2
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Unable to open video {path}")
+
+        self._period = 1.0 / fps if fps > 0 else 0.0
+        self._next = time.perf_counter()
+
+    def Capture(self):  # pylint: disable=invalid-name
+        """
+        Read the next frame, rewinding at the end of the file
+
+        Returns:
+            np.ndarray: HWC RGB frame or None if the frame can not be read
+        """
+        if self._period:
+            delay = self._next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next += self._period
+
+        ok, frame = self._capture.read()
+        if not ok:
+            self._capture.set(self._cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._capture.read()
+            if not ok:
+                return None
+
+        return self._cv2.cvtColor(frame, self._cv2.COLOR_BGR2RGB)
+
+    def GetWidth(self):  # pylint: disable=invalid-name
+        """ Frame width """
+        return int(self._capture.get(self._cv2.CAP_PROP_FRAME_WIDTH))
+
+    def GetHeight(self):  # pylint: disable=invalid-name
+        """ Frame height """
+        return int(self._capture.get(self._cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+class StubModel:
+    """
+    NanoOwlModel replacement that sleeps for a configurable latency
+    and returns random detections
+    """
+
+    def __init__(self, latency: float = 0.05, image_latency: float = 0.01,
+                 detections: int = 5, prompt_latency: float = 0.001):
+        """
+        Args:
+            latency (float, optional): seconds per image encoder pass. Defaults to 0.05.
+            image_latency (float, optional): additional seconds per extra image or
+            slice in the same pass. Defaults to 0.01.
+            detections (int, optional): detections returned per image. Defaults to 5.
+            prompt_latency (float, optional): decoder seconds per prompt object and
+            image or slice. Defaults to 0.001.
+        """
+        self._latency = latency
+        self._image_latency = image_latency
+        self._prompt_latency = prompt_latency
+        self._detections = detections
+        self._rng = np.random.default_rng(0)
+        self.objects = None
+        self.objects_threshold = None
+
+    def set_detection_objects(self, objects, thresholds):
+        """
+        Set detection objects and thresholds.
+
+        Args:
+          objects: array of objects to detect
+          threshold: score threshold's array corresponding to the objects
+        """
+        self.objects = objects
+        self.objects_threshold = thresholds
+
+    def _infer(self, amount):
+        time.sleep(self._latency + self._image_latency * (amount - 1)
+                   + self._prompt_latency * len(self.objects) * amount)
+
+    def _random_predictions(self, image, inputs=0):
+        height, width = np.asarray(image).shape[:2]
+        top_left = self._rng.uniform(
+            0, 0.9, (self._detections, 2)) * [width, height]
+        size = self._rng.uniform(
+            0.02, 0.1, (self._detections, 2)) * [width, height]
+        boxes = np.concatenate([top_left, top_left + size], axis=1)
+
+        return Predictions(
+            boxes=boxes.astype(np.float32),
+            scores=self._rng.uniform(
+                0.2, 1, self._detections).astype(np.float32),
+            labels=self._rng.integers(
+                0, len(self.objects), self._detections),
+            inputs=np.full(self._detections, inputs, dtype=np.int64))
+
+    def perform_batch_inference(self, images):
+        """
+        Simulate a batched detection over several images
+
+        Args:
+            images (List[np.ndarray]): The images to be predicted.
+
+        Returns:
+            List[Predictions]: Random detections for each image
+        """
+        self._infer(len(images))
+        return [self._random_predictions(image) for image in images]
+
+    def perform_sliced_inference(self, image, slice_size, overlap_ratio=0.2, **kwargs):
+        """
+        Simulate a batched detection over the slices of an image
+
+        Args:
+            image (np.ndarray): The image to be predicted.
+            slice_size (Tuple[int, int]): slice width and height
+            overlap_ratio (float, optional): fraction of the slice overlapping
+            with the neighbour slices. Defaults to 0.2.
+
+        Returns:
+            Predictions: Random merged detections
+        """
+        height, width = np.asarray(image).shape[:2]
+        rois = get_slice_rois([width, height], slice_size, overlap_ratio)
+        self._infer(len(rois) + 1)
+        predictions = Predictions.concatenate(
+            [self._random_predictions(image, i) for i in range(len(rois) + 1)])
+        return predictions.nms(kwargs.get("iou_threshold", 0.5))
+
+    def perform_region_inference(self, image, regions, slice_size=None, overlap_ratio=0.2,
+                                 **kwargs):
+        """
+        Simulate a batched detection over regions of an image, the regions
+        bigger than a slice are split in slices plus the whole region
+
+        Args:
+            image (np.ndarray): The image to be predicted.
+            regions (List[List[int]]): x0, y0, x1, y1 of each region
+            slice_size (Tuple[int, int], optional): slice width and height.
+            Defaults to None to detect on each whole region.
+            overlap_ratio (float, optional): fraction of the slice overlapping
+            with the neighbour slices. Defaults to 0.2.
+
+        Returns:
+            Predictions: Random merged detections
+        """
+        crops = 0
+        for x0, y0, x1, y1 in regions:
+            slices = 1
+            if slice_size:
+                slices = len(get_slice_rois([x1 - x0, y1 - y0], slice_size, overlap_ratio))
+            crops += slices + 1 if slices > 1 else 1
+
+        self._infer(crops)
+        predictions = Predictions.concatenate(
+            [self._random_predictions(image, i) for i in range(crops)])
+        return predictions.nms(kwargs.get("iou_threshold", 0.5))
+
+
+class MemoryRedis:
+    """
+    In-memory redis client replacement that keeps the stream entries
+    and measures the latency from capture to publish of each one. Clearing
+    available simulates a redis outage until it is set again.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.latencies = []
+        self.available = True
+
+    def ping(self):
+        """
+        Nothing to connect to, reachable unless in a simulated outage
+        """
+        if not self.available:
+            raise ConnectionError("In-memory redis unavailable")
+        return True
+
+    def pipeline(self, transaction=False):  # pylint: disable=unused-argument
+        """
+        Create a pipeline to add entries
+
+        Returns:
+            MemoryPipeline: The new pipeline
+        """
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """
+    Pipeline of the in-memory redis client
+    """
+
+    def __init__(self, client: MemoryRedis):
+        self._client = client
+        self._pending = []
+
+    def xadd(self, stream, fields):
+        """
+        Queue an entry to be added to the stream
+        """
+        self._pending.append((stream, fields))
+
+    def execute(self):
+        """
+        Add the queued entries
+        """
+        if not self._client.available:
+            self._pending = []
+            raise ConnectionError("In-memory redis unavailable")
+
+        now = time.time()
+        for stream, fields in self._pending:
+            self._client.entries.append((stream, fields))
+            if "timestamp" in fields:
+                self._client.latencies.append(now - fields["timestamp"])
+        self._pending = []
+
+
+class BenchSchemaGenerator:
+    """
+    SchemaGenerator replacement serializing the detections as JSON
+    """
+
+    def __init__(self, sensor_id, image_size):
+        self.sensor_id = sensor_id
+        self.image_size = image_size
+        self._frame_id = 0
+
+    def __call__(self, labels, bboxes):
+        self._frame_id += 1
+        return json.dumps({"id": self._frame_id, "sensorId": self.sensor_id,
+                           "objects": [f"{label}|{bbox}" for label, bbox in zip(labels, bboxes)]})
+
+
+class BenchDetection(Detection):
+    """
+    Detection pipeline using benchmark sources, model and sink
+    """
+
+    def __init__(self, source_factory, model, sink, **kwargs):
+        """
+        Args:
+            source_factory (Callable[[], videoSource]): creates the video source
+            model (NanoOwlModel): loaded model or StubModel
+            sink (MemoryRedis): in-memory redis replacement
+            kwargs: Detection arguments
+        """
+        super().__init__(Queue(), Queue(), **kwargs)
+        self._source_factory = source_factory
+        self._model = model
+        self._sink = sink
+
+    def create_video_stream(self, stream_name=None):
+        return self._source_factory(), "bench", stream_name or "bench"
+
+    def create_schema_generator(self, sensor_id, image_size):
+        return BenchSchemaGenerator(sensor_id, image_size)
+
+    def create_model(self, model=None):
+        self._model.metrics = self._metrics
+        return self._model
+
+    def create_publisher(self):
+        return Publisher(client=self._sink, policy="block",
+                         batch_size=self._publish.batch_size,
+                         metrics=self._metrics)
+
+
+def _memory_mb():
+    with open("/proc/self/statm", encoding="utf-8") as statm:
+        rss_pages = int(statm.read().split()[1])
+    rss = rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, peak
+
+
+def run_config(name, grid, prompts, args, model):
+    """
+    Run the pipeline with a configuration for the benchmark duration
+
+    Args:
+        name (str): configuration name
+        grid (Tuple[int, int]): horizontal and vertical slices
+        prompts (int): amount of prompt objects
+        args (argparse.Namespace): benchmark arguments
+        model (Union[NanoOwlModel, StubModel]): model to use
+
+    Returns:
+        dict: The configuration results
+    """
+    if args.video:
+        def source_factory():
+            return VideoFileSource(args.video, args.fps)
+    else:
+        def source_factory():
+            return SyntheticSource(args.width, args.height, args.fps)
+
+    objects = [PROMPTS[i % len(PROMPTS)] + ("" if i < len(PROMPTS) else f" {i}")
+               for i in range(prompts)]
+    sink = MemoryRedis()
+    metrics = Metrics()
+    detection = BenchDetection(source_factory, model, sink, objects=objects,
+                               horizontal_slices=grid[0], vertical_slices=grid[1],
+                               pipeline=PipelineConfig(pipelined=args.pipelined), metrics=metrics)
+
+    logger.info(f"Running {name} for {args.duration} seconds")
+    thread = Thread(target=detection.loop, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    time.sleep(args.duration)
+    detection.stop()
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    inferred = metrics.frames.value(step="inferred")
+    latencies = np.array(sink.latencies) * 1000
+    rss, peak = _memory_mb()
+    stages = {key[0]: total / count * 1000
+              for key, (count, total) in metrics.stage_seconds.totals().items() if count}
+
+    result = {"name": name,
+              "grid": f"{grid[0]}x{grid[1]}",
+              "prompts": prompts,
+              "frames": inferred,
+              "dropped": metrics.frames.value(step="dropped"),
+              "fps": inferred / elapsed,
+              "latency_ms": {},
+              "stage_mean_ms": stages,
+              "rss_mb": rss,
+              "peak_rss_mb": peak}
+    if len(latencies):
+        result["latency_ms"] = {"p50": float(np.percentile(latencies, 50)),
+                                "p90": float(np.percentile(latencies, 90)),
+                                "p99": float(np.percentile(latencies, 99)),
+                                "max": float(latencies.max())}
+
+    logger.info(f"{name}: {result['fps']:.2f} fps, latency {result['latency_ms']}")
+    return result
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def check_publisher():
+    """
+    Check the publisher queue policies and its recovery from a redis outage
+    against the in-memory redis
+
+    Raises:
+        RuntimeError: If the publisher does not behave as expected
+    """
+    def expect(condition, message):
+        if not condition:
+            raise RuntimeError(f"Publisher check failed: {message}")
+
+    schema_gen = BenchSchemaGenerator("check", [1920, 1080])
+
+    # Drop oldest keeps the newest messages without blocking the caller
+    sink = MemoryRedis()
+    metrics = Metrics()
+    publisher = Publisher(client=sink, queue_size=2, policy="drop-oldest", metrics=metrics)
+    for frame in range(5):
+        publisher.publish(schema_gen, [], [], frame=frame)
+    expect(publisher.queue_depth == 2, "drop-oldest did not bound the queue")
+    expect(metrics.publish_queue_depth.snapshot()["values"][()] == 2,
+           "the queue depth is not reported while the queue fills")
+    publisher.start()
+    publisher.stop()
+    expect([fields["frame"] for _, fields in sink.entries] == [3, 4],
+           "drop-oldest did not keep the newest messages")
+    expect(metrics.publish_messages.value(result="dropped") == 3,
+           "drop-oldest did not count the dropped messages")
+
+    # Block waits for room in the queue and loses nothing
+    sink = MemoryRedis()
+    publisher = Publisher(client=sink, queue_size=2, policy="block")
+
+    def produce():
+        for frame in range(5):
+            publisher.publish(schema_gen, [], [], frame=frame)
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+    expect(not _wait_for(lambda: not producer.is_alive(), 0.2),
+           "block did not wait for room in the queue")
+    publisher.start()
+    producer.join(2.0)
+    publisher.stop()
+    expect([fields["frame"] for _, fields in sink.entries] == list(range(5)),
+           "block lost or reordered messages")
+
+    # The messages sent during an outage are dropped and publishing resumes after it
+    sink = MemoryRedis()
+    metrics = Metrics()
+    publisher = Publisher(client=sink, metrics=metrics)
+    publisher.start()
+    sink.available = False
+    publisher.publish(schema_gen, [], [], frame=0)
+    expect(_wait_for(lambda: metrics.publish_messages.value(result="dropped") == 1),
+           "the messages sent during the outage were not dropped")
+    sink.available = True
+    publisher.publish(schema_gen, [], [], frame=1)
+    publisher.stop()
+    expect([fields["frame"] for _, fields in sink.entries] == [1],
+           "publishing did not resume after the outage")
+
+    logger.info("Publisher check passed")
+
+
+def list_of_grids(arg):
+    """ Define a custom argument type for a list of slice grids """
+    return [tuple(int(x) for x in grid.split("x")) for grid in arg.split(",")]
+
+
+def list_of_ints(arg):
+    """ Define a custom argument type for a list of integers """
+    return list(map(int, arg.split(',')))
+
+
+def parse_args():
+    """ Parse arguments """
+    parser = argparse.ArgumentParser(description="Detection pipeline benchmark")
+    parser.add_argument("--video", type=str, default=None,
+                        help="Video file to read frames from, synthetic frames are used if not given")
+    parser.add_argument("--width", type=int, default=1920,
+                        help="Synthetic frames width")
+    parser.add_argument("--height", type=int, default=1080,
+                        help="Synthetic frames height")
+    parser.add_argument("--fps", type=float, default=0.0,
+                        help="Source frame rate, 0 to produce frames as fast as possible")
+    parser.add_argument("--model", type=str, default="stub", choices=["stub", "cpu"],
+                        help="Use a stub model or the real model running on CPU")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Stub model seconds per image encoder pass")
+    parser.add_argument("--image-latency", type=float, default=0.01,
+                        help="Stub model additional seconds per extra image or slice in a pass")
+    parser.add_argument("--prompt-latency", type=float, default=0.001,
+                        help="Stub model decoder seconds per prompt object and image or slice")
+    parser.add_argument("--detections", type=int, default=5,
+                        help="Stub model detections per image")
+    parser.add_argument("--grids", type=list_of_grids, default=[(2, 2), (3, 3)],
+                        help="Slice grids to benchmark, example: 2x2,3x3")
+    parser.add_argument("--prompts", type=list_of_ints, default=[4, 16],
+                        help="Amount of prompt objects to benchmark, example: 4,16")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Seconds to run each configuration")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Run the pipeline in pipelined mode")
+    parser.add_argument("--output", type=str, default="bench.json",
+                        help="File to save the results as JSON")
+    parser.add_argument("--check-publisher", action="store_true",
+                        help="Check the publisher queue policies and outage recovery, then exit")
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Benchmark application
+    """
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.check_publisher:
+        check_publisher()
+        return
+
+    if args.model == "cpu":
+        from detection.nanoowlmodel import NanoOwlModel
+
+        model = NanoOwlModel(model_name="google/owlvit-base-patch32",
+                             model_device="cpu", load_at_init=False)
+        model.load_model()
+    else:
+        model = StubModel(args.latency, args.image_latency, args.detections,
+                          args.prompt_latency)
+
+    configs = [("plain", (1, 1), 1)]
+    configs += [(f"sahi-{h}x{v}", (h, v), 1)
+                for h, v in args.grids if (h, v) != (1, 1)]
+    configs += [(f"prompts-{n}", (1, 1), n) for n in args.prompts if n != 1]
+
+    results = [run_config(name, grid, prompts, args, model)
+               for name, grid, prompts in configs]
+
+    report = {"timestamp": time.time(), "args": vars(args), "results": results}
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+
+    logger.info(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Fan out of live detections to many subscribers
+"""
+
+import asyncio
+import logging
+from collections import deque
+from threading import Condition
+
+logger = logging.getLogger("detection")
+
+SLOW_CLIENT_POLICIES = ["coalesce", "drop"]
+
+
+class SlowSubscriberError(Exception):
+    """
+    Raised to a subscriber that fell behind the shared buffer with the drop policy
+    """
+
+
+def sse_event(message: str, event_id: int = None):
+    """
+    Format a message as a server sent event
+
+    Args:
+        message (str): the event data
+        event_id (int, optional): the event id. Defaults to None.
+
+    Returns:
+        str: The event in text/event-stream format
+    """
+    event = f"id: {event_id}\n" if event_id is not None else ""
+    return event + f"data: {message}\n\n"
+
+
+class Subscription:
+    """
+    Reader of the broadcaster shared buffer with its own position
+    """
+
+    def __init__(self, broadcaster, cursor: int):
+        """
+        Args:
+            broadcaster (Broadcaster): broadcaster to read from
+            cursor (int): sequence number of the last message read
+        """
+        self._broadcaster = broadcaster
+        self.cursor = cursor
+        self.skipped = 0
+
+    def get(self, timeout: float = None):
+        """
+        Wait for the messages published after the last read
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to None to wait forever.
+
+        Returns:
+            List[Tuple[int, str]]: The sequence numbers and messages, empty if the
+            timeout expired
+        """
+        return self._broadcaster.wait(self, timeout)
+
+    async def get_async(self, timeout: float = None):
+        """
+        Wait for the messages published after the last read without blocking
+        the event loop
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to None to wait forever.
+
+        Returns:
+            List[Tuple[int, str]]: The sequence numbers and messages, empty if the
+            timeout expired
+        """
+        return await self._broadcaster.wait_async(self, timeout)
+
+    def close(self):
+        """
+        Stop receiving messages
+        """
+        self._broadcaster.unsubscribe(self)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Broadcaster:
+    """
+    Share each frame detections with many subscribers.
+
+    Messages are written once into a bounded buffer that every subscriber
+    reads at its own pace, so publishing never waits for the subscribers. A
+    subscriber that falls behind the buffer either skips to the oldest
+    message still available (coalesce) or is disconnected (drop).
+    """
+
+    def __init__(self, capacity: int = 32, policy: str = "coalesce", metrics=None):
+        """
+        Args:
+            capacity (int, optional): Amount of recent messages kept. Defaults to 32.
+            policy (str, optional): What to do with slow subscribers, coalesce or
+            drop. Defaults to coalesce.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+        """
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(
+                f"Invalid slow client policy {policy}, use one of {SLOW_CLIENT_POLICIES}")
+
+        self._messages = deque(maxlen=capacity)
+        self._sequence = 0
+        self._policy = policy
+        self._condition = Condition()
+        self._waiters = set()
+        self._subscribers = 0
+        self._metrics = metrics
+        self._subscribers_gauge = None
+        self._skipped_counter = None
+        if metrics:
+            self._subscribers_gauge = metrics.gauge(
+                "detection_stream_subscribers", "Clients receiving the live detections")
+            self._skipped_counter = metrics.counter(
+                "detection_stream_skipped_total",
+                "Messages skipped by live detections clients that fell behind")
+
+    @property
+    def subscribers(self):
+        """
+        Amount of active subscribers
+        """
+        return self._subscribers
+
+    def subscribe(self):
+        """
+        Start receiving the messages published from now on
+
+        Returns:
+            Subscription: The new subscription
+        """
+        with self._condition:
+            self._subscribers += 1
+            subscription = Subscription(self, self._sequence)
+        self._update_gauge()
+        logger.info(f"Live detections subscriber added, {self._subscribers} active")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop sending messages to a subscriber
+
+        Args:
+            subscription (Subscription): the subscription to close
+        """
+        with self._condition:
+            self._subscribers -= 1
+        self._update_gauge()
+        logger.info(
+            f"Live detections subscriber removed after skipping {subscription.skipped} "
+            f"messages, {self._subscribers} active")
+
+    def _update_gauge(self):
+        if self._subscribers_gauge:
+            self._subscribers_gauge.set(self._subscribers)
+
+    def publish(self, message: str):
+        """
+        Add a message for every subscriber
+
+        Args:
+            message (str): the serialized message
+        """
+        with self._condition:
+            self._sequence += 1
+            self._messages.append((self._sequence, message))
+            self._condition.notify_all()
+            waiters = self._waiters
+            self._waiters = set()
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _collect(self, subscription):
+        """
+        Get the messages after the subscription cursor, must hold the lock
+        """
+        if not self._messages or self._messages[-1][0] <= subscription.cursor:
+            return []
+
+        skipped = self._messages[0][0] - subscription.cursor - 1
+        if skipped > 0:
+            if self._policy == "drop":
+                raise SlowSubscriberError(
+                    f"Subscriber fell {skipped} messages behind")
+            subscription.skipped += skipped
+            if self._skipped_counter:
+                self._skipped_counter.inc(skipped)
+
+        messages = [(sequence, message) for sequence, message in self._messages
+                    if sequence > subscription.cursor]
+        subscription.cursor = self._sequence
+        return messages
+
+    def wait(self, subscription, timeout: float = None):
+        """
+        Wait for the messages of a subscription
+
+        Args:
+            subscription (Subscription): the subscription to read
+            timeout (float, optional): Seconds to wait. Defaults to None to wait forever.
+
+        Returns:
+            List[Tuple[int, str]]: The sequence numbers and messages
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._messages and self._messages[-1][0] > subscription.cursor,
+                timeout)
+            return self._collect(subscription)
+
+    async def wait_async(self, subscription, timeout: float = None):
+        """
+        Wait for the messages of a subscription from an event loop
+
+        Args:
+            subscription (Subscription): the subscription to read
+            timeout (float, optional): Seconds to wait. Defaults to None to wait forever.
+
+        Returns:
+            List[Tuple[int, str]]: The sequence numbers and messages
+        """
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            messages = self._collect(subscription)
+            if messages:
+                return messages
+            waiter = (loop, loop.create_future())
+            self._waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        with self._condition:
+            self._waiters.discard(waiter)
+            return self._collect(subscription)
@@ -0,0 +1,378 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Append-only columnar log of the published detections for offline analysis
+
+A segment file starts with a magic string followed by row groups. Each row
+group has a header with its amount of rows and time range, the strings it
+adds to the segment dictionary and then every column stored contiguously
+as little endian fixed-width values. The stream, sensor, search and label
+columns are indexes in the segment dictionary, so every segment can be
+read on its own.
+"""
+
+import glob
+import logging
+import os
+import struct
+import time
+from threading import Condition, Thread
+
+import numpy as np
+
+logger = logging.getLogger("detection")
+
+SEGMENT_MAGIC = b"DETLOG1\n"
+GROUP_MAGIC = b"RGRP"
+GROUP_HEADER = struct.Struct("<4sIIIdd")
+
+# Eight bytes columns first so every column stays aligned
+COLUMNS = [("timestamp", "<f8"), ("track_id", "<i8"), ("stream", "<u4"),
+           ("sensor_id", "<u4"), ("search", "<u4"), ("label", "<u4"),
+           ("score", "<f4"), ("x0", "<f4"), ("y0", "<f4"), ("x1", "<f4"),
+           ("y1", "<f4")]
+STRING_COLUMNS = ["stream", "sensor_id", "search", "label"]
+ROW_SIZE = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+
+def _padding(size):
+    return -size % 8
+
+
+class ColumnarLog:
+    """
+    Write the published detections to rotating segment files from a
+    background thread.
+
+    The detections are accumulated in memory and written as a single row
+    group every flush interval or as soon as enough rows are pending, so
+    the disk sees few large sequential writes. A new segment is started
+    when the current one reaches its size or age limit. When the writer
+    falls behind and the pending rows reach their limit, new detections are
+    dropped.
+    """
+
+    def __init__(self, directory, segment_size: int = 64 * 1024 * 1024,
+                 segment_seconds: float = 3600.0, batch_rows: int = 65536,
+                 flush_interval: float = 5.0, max_pending_rows: int = 1048576,
+                 metrics=None):
+        """
+        Args:
+            directory (str): directory to write the segments to, created if missing
+            segment_size (int, optional): Bytes after which a new segment is
+            started. Defaults to 64 MiB.
+            segment_seconds (float, optional): Seconds after which a new segment
+            is started. Defaults to 3600.0.
+            batch_rows (int, optional): Pending rows that trigger a write before
+            the flush interval. Defaults to 65536.
+            flush_interval (float, optional): Maximum seconds the detections wait
+            in memory. Defaults to 5.0.
+            max_pending_rows (int, optional): Maximum rows waiting to be written.
+            Defaults to 1048576.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+        """
+        self._directory = directory
+        self._segment_size = segment_size
+        self._segment_seconds = segment_seconds
+        self._batch_rows = batch_rows
+        self._flush_interval = flush_interval
+        self._max_pending_rows = max_pending_rows
+        self._pending = []
+        self._pending_rows = 0
+        self._condition = Condition()
+        self._running = False
+        self._thread = None
+
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._dictionary = {}
+        self._sequence = 0
+
+        self._rows = None
+        self._dropped = None
+        self._segments = None
+        if metrics is not None:
+            self._rows = metrics.counter(
+                "detection_log_rows_total", "Detections written to the columnar log")
+            self._dropped = metrics.counter(
+                "detection_log_dropped_total",
+                "Detections dropped because the columnar log writer fell behind")
+            self._segments = metrics.counter(
+                "detection_log_segments_total", "Columnar log segments started")
+
+    def add(self, stream, sensor_id, timestamp, search, text_labels, scores, bboxes,
+            track_ids=None):
+        """
+        Queue the detections of a published message to be written
+
+        Args:
+            stream (str): VST sensor name
+            sensor_id (str): VST sensor id
+            timestamp (float): capture time in seconds since the epoch
+            search (str): name of the search the detections belong to
+            text_labels (List[str]): detections labels
+            scores (List[float]): detections scores
+            bboxes (List[List[float]]): detections x0, y0, x1, y1 boxes
+            track_ids (List[int], optional): detections track ids. Defaults to None.
+        """
+        if not text_labels:
+            return
+
+        with self._condition:
+            if self._pending_rows + len(text_labels) > self._max_pending_rows:
+                if self._dropped:
+                    self._dropped.inc(len(text_labels))
+                return
+
+            self._pending.append((stream, sensor_id, timestamp, search, text_labels,
+                                  scores, bboxes, track_ids))
+            self._pending_rows += len(text_labels)
+            if self._pending_rows >= self._batch_rows:
+                self._condition.notify()
+
+    def start(self):
+        """
+        Start the writer thread
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the writer thread once the pending detections are written
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        self._close_segment()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and self._pending_rows < self._batch_rows:
+                    self._condition.wait(self._flush_interval)
+                pending = self._pending
+                self._pending = []
+                self._pending_rows = 0
+                running = self._running
+
+            if pending:
+                try:
+                    self._write(pending)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(pending)} messages to the "
+                                 f"columnar log: {e!r}")
+                    self._close_segment()
+
+            if not running:
+                return
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = time.strftime("detections-%Y%m%d-%H%M%S", time.gmtime())
+        self._path = os.path.join(self._directory, f"{name}-{self._sequence:04d}.dlog")
+        self._file = open(self._path, "wb")
+        self._file.write(SEGMENT_MAGIC)
+        self._size = len(SEGMENT_MAGIC)
+        self._opened_at = time.monotonic()
+        self._dictionary = {}
+        if self._segments:
+            self._segments.inc()
+        logger.info(f"Writing detections to {self._path}")
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _code(self, value, new_strings):
+        code = self._dictionary.get(value)
+        if code is None:
+            code = len(self._dictionary)
+            self._dictionary[value] = code
+            new_strings.append(value)
+
+        return code
+
+    def _write(self, pending):
+        rows = sum(len(message[4]) for message in pending)
+        columns = {name: np.empty(rows, dtype) for name, dtype in COLUMNS}
+        boxes = np.empty((rows, 4), np.float32)
+
+        if self._file is None or self._size >= self._segment_size or \
+                time.monotonic() - self._opened_at >= self._segment_seconds:
+            self._close_segment()
+            self._open_segment()
+
+        new_strings = []
+        row = 0
+        for stream, sensor_id, timestamp, search, text_labels, scores, bboxes, \
+                track_ids in pending:
+            end = row + len(text_labels)
+            columns["timestamp"][row:end] = timestamp
+            columns["track_id"][row:end] = -1 if track_ids is None else track_ids
+            columns["stream"][row:end] = self._code(stream, new_strings)
+            columns["sensor_id"][row:end] = self._code(sensor_id, new_strings)
+            columns["search"][row:end] = self._code(search, new_strings)
+            columns["label"][row:end] = [self._code(label, new_strings)
+                                         for label in text_labels]
+            columns["score"][row:end] = scores
+            boxes[row:end] = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+            row = end
+
+        for i, name in enumerate(["x0", "y0", "x1", "y1"]):
+            columns[name][:] = boxes[:, i]
+
+        strings = "\0".join(new_strings).encode()
+        timestamps = columns["timestamp"]
+        chunks = [GROUP_HEADER.pack(GROUP_MAGIC, rows, len(new_strings), len(strings),
+                                    timestamps.min(), timestamps.max()),
+                  strings, bytes(_padding(len(strings)))]
+        chunks += [columns[name].tobytes() for name, _ in COLUMNS]
+        chunks.append(bytes(_padding(rows * ROW_SIZE)))
+
+        # A single write of the whole row group
+        data = b"".join(chunks)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        if self._rows:
+            self._rows.inc(rows)
+
+
+class ColumnarLogReader:
+    """
+    Read the segments written by the columnar log. The segments are memory
+    mapped and the columns are returned as views of the mapping, so only the
+    row groups in the requested time range are read from disk.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): directory with the segments
+        """
+        self._directory = directory
+
+    def segments(self):
+        """
+        Get the segment files, oldest first
+
+        Returns:
+            List[str]: The segment paths
+        """
+        return sorted(glob.glob(os.path.join(self._directory, "*.dlog")))
+
+    def read_segment(self, path, start=None, end=None):
+        """
+        Read the row groups of a segment in a time range
+
+        Args:
+            path (str): segment path
+            start (float, optional): oldest capture time in seconds since the epoch.
+            Defaults to None.
+            end (float, optional): newest capture time in seconds since the epoch.
+            Defaults to None.
+
+        Returns:
+            dict: Each column as an array, the stream, sensor_id, search and label
+            columns are decoded to strings
+        """
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        groups = []
+        dictionary = []
+        if os.path.getsize(path) > len(SEGMENT_MAGIC):
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+            if data[:len(SEGMENT_MAGIC)].tobytes() != SEGMENT_MAGIC:
+                raise ValueError(f"{path} is not a detection log segment")
+
+            offset = len(SEGMENT_MAGIC)
+            while offset + GROUP_HEADER.size <= len(data):
+                magic, rows, n_strings, strings_size, first, last = GROUP_HEADER.unpack(
+                    data[offset:offset + GROUP_HEADER.size].tobytes())
+                strings_offset = offset + GROUP_HEADER.size
+                offset = strings_offset + strings_size + _padding(strings_size)
+                group_end = offset + rows * ROW_SIZE + _padding(rows * ROW_SIZE)
+                # The segment being written may end with a partial row group
+                if magic != GROUP_MAGIC or group_end > len(data):
+                    break
+
+                # The amount of strings comes from the header, a single new empty
+                # string takes no bytes
+                if n_strings:
+                    strings = data[strings_offset:strings_offset + strings_size]
+                    dictionary += strings.tobytes().decode().split("\0")
+
+                if last >= start and first <= end:
+                    group = {}
+                    for name, dtype in COLUMNS:
+                        size = rows * np.dtype(dtype).itemsize
+                        group[name] = data[offset:offset + size].view(dtype)
+                        offset += size
+                    groups.append(group)
+
+                offset = group_end
+
+        table = {name: (groups[0][name] if len(groups) == 1 else
+                        np.concatenate([group[name] for group in groups]) if groups else
+                        np.zeros(0, dtype))
+                 for name, dtype in COLUMNS}
+
+        mask = (table["timestamp"] >= start) & (table["timestamp"] <= end)
+        if not mask.all():
+            table = {name: column[mask] for name, column in table.items()}
+
+        strings = np.array(dictionary, dtype=object)
+        for name in STRING_COLUMNS:
+            table[name] = strings[table[name]]
+
+        return table
+
+    def scan(self, start=None, end=None, streams=None, labels=None):
+        """
+        Read the detections of every segment in a time range, one segment at
+        a time
+
+        Args:
+            start (float, optional): oldest capture time in seconds since the epoch.
+            Defaults to None.
+            end (float, optional): newest capture time in seconds since the epoch.
+            Defaults to None.
+            streams (List[str], optional): only the detections of these VST
+            sensor names. Defaults to None.
+            labels (List[str], optional): only the detections with these labels.
+            Defaults to None.
+
+        Yields:
+            dict: The columns of the detections of each segment with any
+        """
+        for path in self.segments():
+            table = self.read_segment(path, start, end)
+            mask = np.ones(len(table["timestamp"]), bool)
+            if streams is not None:
+                mask &= np.isin(table["stream"], streams)
+            if labels is not None:
+                mask &= np.isin(table["label"], labels)
+            if not mask.all():
+                table = {name: column[mask] for name, column in table.items()}
+            if len(table["timestamp"]):
+                yield table
@@ -0,0 +1,67 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Detections Controller
+"""
+import logging
+
+from flask import Response, stream_with_context
+from flask_cors import cross_origin
+
+from detection.broadcaster import SlowSubscriberError, sse_event
+from detection.controllers.controller import Controller
+
+logger = logging.getLogger("detection")
+
+KEEPALIVE_INTERVAL = 15.0
+
+
+class DetectionsController(Controller):
+    """
+    Controller to stream the live detections as server sent events
+    """
+
+    def __init__(self, broadcaster):
+        self._broadcaster = broadcaster
+
+    def add_rules(self, app):
+        """
+        Add live detections rule at /detections/stream uri
+        """
+        app.add_url_rule('/detections/stream', 'stream_detections',
+                         self.stream_detections, methods=['GET'])
+
+    def _events(self):
+        subscription = self._broadcaster.subscribe()
+        try:
+            while True:
+                messages = subscription.get(timeout=KEEPALIVE_INTERVAL)
+                if not messages:
+                    yield ": keepalive\n\n"
+                for sequence, message in messages:
+                    yield sse_event(message, sequence)
+        except SlowSubscriberError as e:
+            logger.warning(f"Live detections client dropped: {e}")
+        finally:
+            subscription.close()
+
+    @cross_origin()
+    def stream_detections(self):
+        """
+        Stream the detections of every frame as they are published
+
+        Returns:
+            Flask.Response: A text/event-stream Response with one event per
+            published message
+        """
+        return Response(stream_with_context(self._events()),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
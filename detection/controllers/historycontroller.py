@@ -0,0 +1,80 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+History Controller
+"""
+
+import json
+import logging
+
+from flask import request
+from flask_cors import cross_origin
+from rrmsutils.models.apiresponse import ApiResponse
+
+from detection.controllers.controller import Controller
+
+logger = logging.getLogger("detection")
+
+
+class HistoryController(Controller):
+    """
+    Controller for the detections published in a time range
+    """
+
+    def __init__(self, history):
+        """
+        Args:
+            history (DetectionHistory): the detection history
+        """
+        self._history = history
+
+    def add_rules(self, app):
+        """
+        Add history rule at /history uri
+        """
+        app.add_url_rule('/history', 'get_history',
+                         self.get_history, methods=['GET'])
+
+    @cross_origin()
+    def get_history(self):
+        """
+        Validate history request and return the detections of the stream in
+        the requested time range
+
+        Returns:
+            Flask.Response: A Response object with the JSON detections and a
+            code 200 if succesfull, or a JSON message and code 400 if failed
+            or 404 if the stream has no history.
+        """
+
+        logger.debug(f"new history request: {request.args}")
+        args = request.args
+        try:
+            stream = args.get('stream')
+            if not stream:
+                raise ValueError("The stream is required")
+            start = float(args['start']) if 'start' in args else None
+            end = float(args['end']) if 'end' in args else None
+            limit = int(args['limit']) if 'limit' in args else None
+            if limit is not None and limit < 0:
+                raise ValueError("The limit must not be negative")
+            labels = args['labels'].split(',') if 'labels' in args else None
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        result = self._history.query(stream, start, end, labels,
+                                     args.get('search'), limit)
+        if result is None:
+            response = ApiResponse(code=1, message=f"No history of stream {stream}")
+            return self.response(response.model_dump_json(), 404)
+
+        return self.response(json.dumps(result), 200)
@@ -0,0 +1,45 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Metrics Controller
+"""
+
+from flask_cors import cross_origin
+
+from detection.controllers.controller import Controller
+
+
+class MetricsController(Controller):
+    """
+    Controller to expose the pipeline metrics
+    """
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def add_rules(self, app):
+        """
+        Add metrics rule at /metrics uri
+        """
+        app.add_url_rule('/metrics', 'get_metrics',
+                         self.get_metrics, methods=['GET'])
+
+    @cross_origin()
+    def get_metrics(self):
+        """
+        Get the pipeline metrics
+
+        Returns:
+            Flask.Response: A Response object with the metrics in Prometheus
+            text format and a code 200
+        """
+        return self.response(self._metrics.render(), 200,
+                             mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,80 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Model Controller
+"""
+
+import json
+import logging
+
+from flask import request
+from flask_cors import cross_origin
+from rrmsutils.models.apiresponse import ApiResponse
+
+from detection.controllers.controller import Controller
+from detection.quality import MODELS
+
+logger = logging.getLogger("detection")
+
+
+class ModelController(Controller):
+    """
+    Controller for the detection model and quality tiers
+    """
+
+    def __init__(self, queue, status):
+        """
+        Args:
+            queue (Queue): queue of the model changes applied by the detection loop
+            status (QualityStatus): model and quality tier in use
+        """
+        self._queue = queue
+        self._status = status
+
+    def add_rules(self, app):
+        """
+        Add model rules at /model uri
+        """
+        app.add_url_rule('/model', 'get_model',
+                         self.get_model, methods=['GET'])
+        app.add_url_rule('/model', 'update_model',
+                         self.update_model, methods=['PUT'])
+
+    @cross_origin()
+    def get_model(self):
+        """
+        Get the model and quality tier in use
+
+        Returns:
+            Flask.Response: A Response object with the JSON status and a code 200
+        """
+        return self.response(json.dumps(self._status.report()), 200)
+
+    @cross_origin()
+    def update_model(self):
+        """
+        Validate model request and add it to the queue, the model is swapped
+        once loaded
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+
+        logger.info(f"new model request: {request.args}")
+        name = request.args.get('name')
+        if name not in MODELS:
+            response = ApiResponse(
+                code=1, message=f"Unknown model {name}, use one of {list(MODELS)}")
+            return self.response(response.model_dump_json(), 400)
+
+        self._queue.put(name)
+        return self.response(ApiResponse().model_dump_json(), 200)
@@ -0,0 +1,87 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Query Controller
+"""
+
+import json
+import logging
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import request
+from flask_cors import cross_origin
+from rrmsutils.models.apiresponse import ApiResponse
+from rrmsutils.models.detection.search import Search
+
+from detection.controllers.controller import Controller
+from detection.embeddings import EmbeddingQuery
+
+logger = logging.getLogger("detection")
+
+
+class QueryController(Controller):
+    """
+    Controller for ad-hoc searches over the recent frames
+    """
+
+    def __init__(self, queue, timeout: float = 30.0):
+        """
+        Args:
+            queue (Queue): queue of the queries answered by the detection loop
+            timeout (float, optional): Seconds to wait for the answer. Defaults to 30.0.
+        """
+        self._queue = queue
+        self._timeout = timeout
+
+    def add_rules(self, app):
+        """
+        Add query rule at /query uri
+        """
+        app.add_url_rule('/query', 'query_objects',
+                         self.query_objects, methods=['GET'])
+
+    @cross_origin()
+    def query_objects(self):
+        """
+        Validate query request, wait for the detection loop to run it over
+        the cached embeddings and return the frames with detections
+
+        Returns:
+            Flask.Response: A Response object with the JSON query result and a
+            code 200 if succesfull, or a JSON message and code 400 if failed
+            or 503 if the detection did not answer in time.
+        """
+
+        logger.info(f"new query: {request.args}")
+        args = request.args.copy()
+        stream = args.pop('stream', None)
+        try:
+            seconds = float(args.pop('seconds', 60.0))
+            if seconds <= 0:
+                raise ValueError("The seconds to query must be positive")
+            search = Search.model_validate(args)
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        reply = Future()
+        self._queue.put((EmbeddingQuery(search, seconds, stream), reply))
+        try:
+            result = reply.result(timeout=self._timeout)
+        except FutureTimeoutError:
+            response = ApiResponse(code=1, message="The query timed out")
+            return self.response(response.model_dump_json(), 503)
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        return self.response(json.dumps(result), 200)
@@ -0,0 +1,51 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Ready Controller
+"""
+
+import json
+
+from flask_cors import cross_origin
+
+from detection.controllers.controller import Controller
+
+
+class ReadyController(Controller):
+    """
+    Controller to expose the detection readiness
+    """
+
+    def __init__(self, startup):
+        """
+        Args:
+            startup (Startup): the detection startup progress
+        """
+        self._startup = startup
+
+    def add_rules(self, app):
+        """
+        Add ready rule at /ready uri
+        """
+        app.add_url_rule('/ready', 'get_ready',
+                         self.get_ready, methods=['GET'])
+
+    @cross_origin()
+    def get_ready(self):
+        """
+        Get the detection startup progress
+
+        Returns:
+            Flask.Response: A Response object with the JSON startup stages and a
+            code 200 if the detection is ready or 503 if still starting up.
+        """
+        report = self._startup.report()
+        return self.response(json.dumps(report), 200 if report["ready"] else 503)
@@ -0,0 +1,86 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Regions of Interest Controller
+"""
+import logging
+
+from flask import request
+from flask_cors import cross_origin
+from rrmsutils.models.apiresponse import ApiResponse
+from rrmsutils.models.detection.source import Source
+
+from detection.controllers.controller import Controller
+from detection.roi import parse_regions
+
+logger = logging.getLogger("detection")
+
+
+class RoiController(Controller):
+    """
+    Controller for the regions of interest of each stream
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def add_rules(self, app):
+        """
+        Add regions of interest rules at /roi uri
+        """
+        app.add_url_rule('/roi', 'set_roi',
+                         self.set_roi, methods=['PUT'])
+        app.add_url_rule('/roi', 'clear_roi',
+                         self.clear_roi, methods=['DELETE'])
+
+    @cross_origin()
+    def set_roi(self):
+        """
+        Validate request to set the regions of interest of a stream and add it to the queue
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+
+        logger.info(f"Request to set regions of interest: {request.args.to_dict()}")
+        args = request.args.to_dict()
+        try:
+            regions = parse_regions(args.pop("regions", ""))
+            if not regions:
+                raise ValueError("At least one region is required")
+            source = Source.model_validate(args)
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        self._queue.put((source.name, regions))
+        return self.response(ApiResponse().model_dump_json(), 200)
+
+    @cross_origin()
+    def clear_roi(self):
+        """
+        Validate request to detect on the whole image of a stream and add it to the queue
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+
+        logger.info(f"Request to clear regions of interest: {request.args.to_dict()}")
+        try:
+            source = Source.model_validate(request.args.to_dict())
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        self._queue.put((source.name, None))
+        return self.response(ApiResponse().model_dump_json(), 200)
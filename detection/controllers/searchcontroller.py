@@ -20,6 +20,7 @@ from rrmsutils.models.apiresponse import ApiResponse
 from rrmsutils.models.detection.search import Search
 
 from detection.controllers.controller import Controller
+from detection.searches import DEFAULT_SEARCH, NamedSearch, parse_search
 
 logger = logging.getLogger("detection")
 
@@ -34,15 +35,19 @@ class SearchController(Controller):
 
     def add_rules(self, app):
         """
-        Add search update rule at /search uri
+        Add search update and removal rules at /search uri
         """
         app.add_url_rule('/search', 'update_search',
                          self.update_search, methods=['GET'])
+        app.add_url_rule('/search', 'remove_search',
+                         self.remove_search, methods=['DELETE'])
 
     @cross_origin()
     def update_search(self):
         """
-        Validate search request and add it to the queue
+        Validate search request and add it to the queue. The optional name
+        argument selects the named search to set, the default search if not
+        given, and the optional stream argument restricts it to a stream
 
         Returns:
             Flask.Response: A Response object with JSON message and a
@@ -50,11 +55,34 @@ class SearchController(Controller):
         """
 
         logger.info(f"new search: {request.args}")
+        args = request.args.copy()
+        name = args.pop('name', DEFAULT_SEARCH)
+        stream = args.pop('stream', None)
         try:
-            search = Search.model_validate(request.args)
+            search = Search.model_validate(args)
+            objects, thresholds = parse_search(search)
+            NamedSearch(name, objects, thresholds, stream)
         except Exception as e:
             response = ApiResponse(code=1, message=repr(e))
             return self.response(response.model_dump_json(), 400)
 
-        self._queue.put(search)
+        self._queue.put((name, stream, search))
+        return self.response(ApiResponse().model_dump_json(), 200)
+
+    @cross_origin()
+    def remove_search(self):
+        """
+        Remove the named search given by the name argument
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+        name = request.args.get('name')
+        if not name:
+            response = ApiResponse(code=1, message="Missing search name")
+            return self.response(response.model_dump_json(), 400)
+
+        logger.info(f"remove search: {name}")
+        self._queue.put((name, None, None))
         return self.response(ApiResponse().model_dump_json(), 200)
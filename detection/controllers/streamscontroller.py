@@ -0,0 +1,82 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Streams Controller
+"""
+import logging
+
+from flask import request
+from flask_cors import cross_origin
+from rrmsutils.models.apiresponse import ApiResponse
+from rrmsutils.models.detection.source import Source
+
+from detection.controllers.controller import Controller
+from detection.pipeline import parse_size
+
+logger = logging.getLogger("detection")
+
+
+class StreamsController(Controller):
+    """
+    Controller for the set of active video streams
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def add_rules(self, app):
+        """
+        Add stream rules at /streams uri
+        """
+        app.add_url_rule('/streams', 'add_stream',
+                         self.add_stream, methods=['PUT'])
+        app.add_url_rule('/streams', 'remove_stream',
+                         self.remove_stream, methods=['DELETE'])
+
+    def _queue_request(self, action):
+        args = request.args.to_dict()
+        inference_size = args.pop("inference_size", None)
+        try:
+            source = Source.model_validate(args)
+            if inference_size is not None:
+                inference_size = parse_size(inference_size)
+        except Exception as e:
+            response = ApiResponse(code=1, message=repr(e))
+            return self.response(response.model_dump_json(), 400)
+
+        self._queue.put((action, source.name, inference_size))
+        return self.response(ApiResponse().model_dump_json(), 200)
+
+    @cross_origin()
+    def add_stream(self):
+        """
+        Validate request to add a stream to the active ones and add it to the queue
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+
+        logger.info(f"Request to add stream: {request.args.to_dict()}")
+        return self._queue_request("add")
+
+    @cross_origin()
+    def remove_stream(self):
+        """
+        Validate request to remove an active stream and add it to the queue
+
+        Returns:
+            Flask.Response: A Response object with JSON message and a
+            code 200 if succesfull or code 400 if failed.
+        """
+
+        logger.info(f"Request to remove stream: {request.args.to_dict()}")
+        return self._queue_request("remove")
@@ -0,0 +1,127 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Filter of detections that did not change since the last published ones
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from detection.predictions import box_iou
+
+KEYFRAME = "keyframe"
+CHANGE = "change"
+
+
+class DeltaConfig(NamedTuple):
+    """
+    Publishing mode settings. In delta mode every search of a stream gets a
+    DeltaFilter and only the detections that changed, or a periodic keyframe,
+    are published
+    """
+    mode: str = "full"
+    iou: float = 0.9
+    pixels: float = 8.0
+    keyframe_interval: float = 10.0
+
+
+class DeltaFilter:
+    """
+    Compare the detections of each frame with the last published ones so
+    only meaningful changes are published: labels that appear or disappear
+    and boxes that moved beyond a tolerance. A keyframe is published
+    periodically even if nothing changed.
+    """
+
+    def __init__(self, iou_threshold: float = 0.9, pixel_tolerance: float = 8.0,
+                 keyframe_interval: float = 10.0):
+        """
+        Args:
+            iou_threshold (float, optional): Minimum IoU with the published box to
+            consider a box unchanged. Defaults to 0.9.
+            pixel_tolerance (float, optional): Maximum pixels any box coordinate may
+            move to consider it unchanged, regardless of the IoU. Defaults to 8.0.
+            keyframe_interval (float, optional): Seconds between keyframes.
+            Defaults to 10.0.
+        """
+        self._iou_threshold = iou_threshold
+        self._pixel_tolerance = pixel_tolerance
+        self._keyframe_interval = keyframe_interval
+        self._labels = None
+        self._boxes = None
+        self._next_keyframe = 0.0
+
+    def reset(self):
+        """
+        Forget the published detections so the next frame is a keyframe
+        """
+        self._labels = None
+        self._boxes = None
+        self._next_keyframe = 0.0
+
+    def _unchanged(self, labels, boxes):
+        if self._labels is None or len(labels) != len(self._labels):
+            return False
+
+        if sorted(labels) != sorted(self._labels):
+            return False
+
+        if len(labels) == 0:
+            return True
+
+        same_label = np.array(labels)[:, None] == np.array(self._labels)[None, :]
+        iou = box_iou(boxes, self._boxes)
+        moved = np.abs(boxes[:, None, :] - self._boxes[None, :, :]).max(axis=2)
+        close = same_label & ((iou >= self._iou_threshold) |
+                              (moved <= self._pixel_tolerance))
+
+        # Every box must be paired with a different published box
+        candidates = np.argwhere(close)
+        order = np.argsort(-iou[candidates[:, 0], candidates[:, 1]], kind="stable")
+        used_current = set()
+        used_published = set()
+        for current, published in candidates[order].tolist():
+            if current in used_current or published in used_published:
+                continue
+            used_current.add(current)
+            used_published.add(published)
+
+        return len(used_current) == len(labels)
+
+    def check(self, labels, bboxes, timestamp: float):
+        """
+        Check whether the detections of a frame must be published, and take
+        them as the published state if so
+
+        Args:
+            labels (List[str]): detected labels
+            bboxes (List[List[float]]): detected x0, y0, x1, y1 boxes
+            timestamp (float): capture time in seconds
+
+        Returns:
+            str: keyframe or change if the detections must be published, None
+            if they did not change
+        """
+        boxes = np.array(bboxes, dtype=np.float32).reshape(-1, 4)
+        if timestamp >= self._next_keyframe:
+            update = KEYFRAME
+        elif not self._unchanged(labels, boxes):
+            update = CHANGE
+        else:
+            return None
+
+        self._labels = list(labels)
+        self._boxes = boxes
+        if update == KEYFRAME:
+            self._next_keyframe = timestamp + self._keyframe_interval
+
+        return update
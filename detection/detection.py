@@ -12,18 +12,74 @@
 Object detection from vst video
 """
 
+import json
 import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
 
 import numpy as np
-from jetson_utils import videoSource
-from mmj_utils.vst import VST
-from rrmsutils.schemagenerator import SchemaGenerator
-from sahi.predict import get_sliced_prediction
 
-from detection.nanoowlmodel import NanoOwlModel
+from detection.metrics import Metrics
+from detection.deltafilter import DeltaConfig, DeltaFilter
+from detection.embeddings import EmbeddingCache, EmbeddingConfig, QueryJob
+from detection.motiongate import MotionConfig, MotionGate
+from detection.pipeline import FrameBuffer, FrameScaler, PipelineConfig
+from detection.predictions import Predictions
+from detection.publisher import Publisher, PublishConfig
+from detection.quality import (ModelConfig, QualityConfig, QualityController, QualityStatus,
+                               build_tiers, model_files)
+from detection.roi import RegionMask
+from detection.searches import DEFAULT_SEARCH, NamedSearch, SearchSet, parse_search
+from detection.slicing import AdaptiveSlicer, SlicingConfig
+from detection.sourcemanager import SourceManager, StreamCatalog
+from detection.startup import Startup
+from detection.stream import Stream
+from detection.tiles import TileCache, TileConfig
+from detection.tracker import Tracker
 
 logger = logging.getLogger("detection")
 
+VIDEO_OPTIONS = {"latency": 50, "codec": "h264"}
+
+# Frame size used to warm up the model when the streams size is not known yet
+WARMUP_SIZE = (1920, 1080)
+
+
+def emit_detections(publisher, broadcaster, stream, text_labels, bboxes, scores,
+                    recorders=(), **fields):
+    """
+    Publish a stream message to redis and to the live detections subscribers,
+    and keep the detections in the recorders
+
+    Args:
+       publisher(Publisher): publisher to post the message
+       broadcaster(Broadcaster): live detections subscribers, or None
+       stream(Stream): the stream the detections belong to, with its name,
+       sensor id and schema generator
+       text_labels(List[str]): detections labels
+       bboxes(List[List[float]]): detections boxes
+       scores(List[float]): detections scores
+       recorders(List, optional): detection history and columnar log to keep
+       the detections in
+       fields: additional message fields, lists are sent to redis as JSON
+    """
+    for recorder in recorders:
+        recorder.add(stream.name, stream.sensor_id, fields["timestamp"], fields["search"],
+                     text_labels, scores, bboxes, fields.get("track_ids"))
+
+    publisher.publish(stream.schema_gen, text_labels, bboxes,
+                      **{key: json.dumps(value) if isinstance(value, list) else value
+                         for key, value in fields.items()})
+
+    # Only serialize when somebody is listening
+    if broadcaster and broadcaster.subscribers:
+        message = {"stream": stream.name, "sensor_id": stream.sensor_id,
+                   "labels": text_labels, "bboxes": bboxes, **fields}
+        broadcaster.publish(json.dumps(message))
+
 
 class Detection:
     """
@@ -33,7 +89,13 @@ class Detection:
     def __init__(self, search_queue, source_queue,
                  vst_uri="http://0.0.0.0:81", redis_host="0.0.0.0",
                  redis_port=6379, redis_stream="detection", objects=None, thresholds=None,
-                 vertical_slices=1, horizontal_slices=1):
+                 vertical_slices=1, horizontal_slices=1, streams=None, rois=None, tracking=None,
+                 vst_cache_ttl=30.0, pipeline=PipelineConfig(), publish=PublishConfig(),
+                 delta=DeltaConfig(), motion=MotionConfig(), slicing=SlicingConfig(),
+                 tiles=TileConfig(), embeddings=EmbeddingConfig(), model=ModelConfig(),
+                 quality=QualityConfig(), stream_queue=None, roi_queue=None, query_queue=None,
+                 model_queue=None, metrics=None, broadcaster=None, recorders=None,
+                 startup=None, quality_status=None):
         if objects is None:
             objects = ["a person"]
 
@@ -43,15 +105,76 @@ class Detection:
         self._search_queue = search_queue
         self._source_queue = source_queue
         self._vst_uri = vst_uri
-        self._default_objects = objects
-        self._default_thresholds = thresholds
+        self._catalog = StreamCatalog(vst_uri, vst_cache_ttl)
+        self._sources = SourceManager(self.create_video_stream, self.release_video_stream)
         self._redis_host = redis_host
         self._redis_port = redis_port
         self._redis_stream = redis_stream
-        self._image_size = [0, 0]
         self._vertical_slices = vertical_slices
         self._horizontal_slices = horizontal_slices
         self._use_sahi = not (vertical_slices == 1 and horizontal_slices == 1)
+        self._pipeline = pipeline
+        self._publish = publish
+        self._delta = delta
+        self._motion = motion
+        self._slicing = slicing
+        self._tiles = tiles
+        self._model_config = model
+        self._tracking = tracking
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._searches = SearchSet()
+        self._searches.set(NamedSearch(DEFAULT_SEARCH, objects, thresholds))
+        self._searches_gauge = self._metrics.gauge(
+            "detection_searches", "Active named searches")
+        self._prompts_gauge = self._metrics.gauge(
+            "detection_search_prompts", "Prompts in the union of the active searches")
+        self._broadcaster = broadcaster
+        self._recorders = list(recorders or [])
+        self._startup = startup if startup is not None else Startup()
+        self._rois = dict(rois or {})
+        self._roi_queue = roi_queue
+        if slicing.mode == "adaptive":
+            self._grid_frames = self._metrics.counter(
+                "detection_slicing_frames_total", "Frames inferred with each slicing grid",
+                ["stream", "grid"])
+            self._grid_gauge = self._metrics.gauge(
+                "detection_slicing_grid", "Slices per side of the last inferred frame", ["stream"])
+        if tiles.threshold is not None:
+            self._tiles_counter = self._metrics.counter(
+                "detection_tiles_total", "Slices encoded again or reused from the tile cache",
+                ["stream", "state"])
+        self._embeddings = None
+        self._redecoded = {}
+        self._query_queue = query_queue
+        self._queries = deque()
+        if embeddings.size:
+            self._embeddings = EmbeddingCache(embeddings.size, embeddings.interval)
+            self._embeddings_gauge = self._metrics.gauge(
+                "detection_embedding_cache_frames", "Frames in the image embedding cache")
+        self._base_model = model.name
+        self._model_in_use = None
+        self._wanted_model = model.name
+        self._model_queue = model_queue
+        self._loader = ThreadPoolExecutor(max_workers=1)
+        self._loading = None
+        self._model_swaps = self._metrics.counter(
+            "detection_model_swaps_total", "Detection models swapped at runtime")
+        self._quality_tiers = quality.tiers
+        self._quality = None
+        self._scale = 1.0
+        self._frame_skip = 1
+        if quality.latency_target:
+            self._quality = QualityController(
+                build_tiers((vertical_slices, horizontal_slices), model.name, quality.tiers),
+                quality.latency_target, metrics=self._metrics)
+        self._quality_status = quality_status if quality_status is not None else QualityStatus()
+        self._stream_queue = stream_queue
+        self._stream_names = streams
+        self._streams = {}
+        # Several streams are always captured in their own threads
+        self._pipelined = pipeline.pipelined or (streams is not None and len(streams) > 1)
+        self._frame_event = Event()
+        self._running = False
 
     def get_input_stream(self, input_stream=None):
         """
@@ -61,29 +184,9 @@ class Detection:
            input_stream (str, optional): name of the RTSP source stream or empty to use the first stream available through VST
 
         Returns:
-           str: The uri for the requested stream
+           dict: The requested VST stream, with its uri
         """
-        vst = VST(self._vst_uri)
-        vst_rtsp_streams = vst.get_rtsp_streams()
-
-        logger.info(f"VST input streams: {vst_rtsp_streams}")
-        if len(vst_rtsp_streams) == 0:
-            raise RuntimeError("No valid input source in VST")
-
-        stream = None
-        if input_stream:
-            for rtsp_stream in vst_rtsp_streams:
-                if rtsp_stream['name'] == input_stream:
-                    stream = rtsp_stream
-                    break
-
-            if not stream:
-                logger.warning(f"{input_stream} not found in VST")
-
-        if not stream:
-            stream = vst_rtsp_streams[0]
-
-        return stream
+        return self._catalog.find(input_stream)
 
     def process_search(self, search):
         """
@@ -98,18 +201,7 @@ class Detection:
           Tuple[List(str), List(float)]: A tuple with two list: a list of extracted
           objects and a list of the corresponding thresholds
         """
-        str_objects = search.objects[0]
-        objects = str_objects.split(",")
-        objects = [x.strip() for x in objects]
-
-        str_thresholds = search.thresholds[0]
-        thresholds = str_thresholds.split(",")
-        thresholds = [float(x.strip()) for x in thresholds]
-
-        if len(thresholds) == 1:
-            thresholds = [thresholds[0]] * len(objects)
-
-        return objects, thresholds
+        return parse_search(search)
 
     def create_video_stream(self, stream_name=None):
         """
@@ -120,8 +212,8 @@ class Detection:
            stream_name(str): VST sensor name
 
         Returns:
-           Tuple[videoSource, str]: A tuple of videoSource to
-           capture frames and its corresponding sensor id
+           Tuple[videoSource, str, str]: A tuple of videoSource to
+           capture frames, its corresponding sensor id and stream name
         """
 
         # Get input stream from vst
@@ -131,41 +223,267 @@ class Detection:
         logger.info(f"Get video from stream {input_stream}")
 
         # Create video input using jetson-utils
-        v_source = videoSource(input_stream['url'], options={
-            "latency": 50, "codec": "h264"})
+        from jetson_utils import videoSource
 
-        return v_source, sensor_id
+        v_source = videoSource(input_stream['url'], options=VIDEO_OPTIONS)
 
-    def prepare(self):
+        return v_source, sensor_id, input_stream['name']
+
+    def _start_stream(self, v_source, sensor_id, name, inference_size=None):
         """
-        Prepare detection resources
+        Start processing an opened video source
+
+        Args:
+           v_source(videoSource): the stream video source
+           sensor_id(str): VST sensor id of the stream
+           name(str): VST sensor name
+           inference_size(Tuple[int, int], optional): maximum width and height
+           of the frames given to the model
 
         Returns:
-           Tuple[videoSource, OwlPredictor, SchemaGenerator]: A tuple with a videoSource object to
-           capture frames from vst stream, a predictor object to process detection
-           prompt and SchemaGenerator to post messages to redis
+           Stream: The new active stream
+        """
+        if name in self._streams:
+            logger.info(f"Stream {name} already active")
+            self.release_video_stream(v_source)
+            return self._streams[name]
+
+        # Get schema format generator, messages are sent by the publisher
+        schema_gen = self.create_schema_generator(
+            sensor_id, [v_source.GetWidth(), v_source.GetHeight()])
+
+        if self._streams and not self._pipelined:
+            self._capture_in_threads()
+
+        buffer = None
+        if self._pipelined:
+            buffer = FrameBuffer(self._pipeline.buffer_size, self._frame_event)
+
+        inference_size = inference_size or (self._pipeline.stream_inference_sizes or {}).get(
+            name, self._pipeline.inference_size)
+        scaler = self.create_scaler(v_source, inference_size)
+
+        stream = Stream(name, v_source, sensor_id,
+                        schema_gen, buffer, self._metrics, scaler)
+        stream.inference_size = inference_size
+        if self._motion.threshold is not None:
+            stream.gate = MotionGate(self._motion.threshold, self._motion.max_staleness)
+        if self._tracking:
+            stream.tracker = Tracker()
+        regions = self._rois.get(name, self._rois.get(None))
+        if regions:
+            stream.mask = RegionMask(regions)
+        if self._slicing.mode == "adaptive":
+            stream.slicer = AdaptiveSlicer(name, self._slicing.latency_budget,
+                                           self._slicing.max_grid, self._slicing.min_object_size)
+        if self._tiles.threshold is not None and self._slicing.backend == "native":
+            stream.tiles = TileCache(self._tiles.threshold, self._tiles.max_staleness)
+        stream.start()
+        self._streams[name] = stream
+
+        logger.info(f"Stream {name} added, {len(self._streams)} active streams")
+        return stream
+
+    def _capture_in_threads(self):
+        """
+        Capture each active stream in its own thread from now on, so a slow
+        stream does not stall the others once several are active
+        """
+        logger.info("Several active streams, capturing each one in its own thread")
+        self._pipelined = True
+        for stream in self._streams.values():
+            stream.capture_in_thread(FrameBuffer(self._pipeline.buffer_size, self._frame_event))
+
+    def remove_stream(self, stream_name):
+        """
+        Stop processing the given stream
 
+        Args:
+           stream_name(str): VST sensor name
         """
+        stream = self._streams.pop(stream_name, None)
+        if not stream:
+            logger.warning(f"Stream {stream_name} is not active")
+            return
 
-        # Load GenAI model
-        model_name = "google/owlvit-base-patch32"
-        model_engine = "/opt/nanoowl/data/owl_image_encoder_patch32.engine"
+        stream.stop()
+        self.release_video_stream(stream.source)
+        if self._embeddings:
+            self._embeddings.discard(stream_name)
+        logger.info(
+            f"Stream {stream_name} removed, {len(self._streams)} active streams")
+
+    def release_video_stream(self, v_source):
+        """
+        Release a video source that is no longer used. The jetson-utils
+        sources are closed when they are garbage collected
+
+        Args:
+           v_source(videoSource): the released video source
+        """
+
+    def create_scaler(self, v_source, inference_size):
+        """
+        Create the downscaler of the frames of a stream
+
+        Args:
+           v_source(videoSource): the stream video source
+           inference_size(Tuple[int, int]): maximum width and height of the
+           frames given to the model, or None to keep the original size
+
+        Returns:
+           FrameScaler: The stream frames scaler or None
+        """
+        if not inference_size:
+            return None
+
+        # Images kept for reuse: the buffered frames, the one being captured and
+        # the one being processed, more are allocated while these are in use
+        return FrameScaler(inference_size, pool_size=self._pipeline.buffer_size + 2)
+
+    def create_schema_generator(self, sensor_id, image_size):
+        """
+        Create the generator of the messages of a stream
+
+        Args:
+           sensor_id(str): VST sensor id of the stream
+           image_size(List[int]): image width and height
+
+        Returns:
+           SchemaGenerator: The stream messages generator
+        """
+        from rrmsutils.schemagenerator import SchemaGenerator
+
+        return SchemaGenerator(sensor_id=sensor_id, image_size=image_size)
+
+    def create_model(self, model=None):
+        """
+        Create and load the detection model
+
+        Args:
+           model(str, optional): model name, one of quality.MODELS, defaults to
+           the configured model
+
+        Returns:
+           NanoOwlModel: A predictor object to process detection prompt
+        """
+        from detection.nanoowlmodel import NanoOwlModel
+
+        model = model or self._base_model
+        model_name, model_engine = model_files(model, self._model_config.engine_dir)
+
+        # The prompt encodings of each model are saved to their own file
+        prompt_cache_path = self._model_config.prompt_cache_path
+        if prompt_cache_path and model != self._model_config.name:
+            root, extension = os.path.splitext(prompt_cache_path)
+            prompt_cache_path = f"{root}-{model}{extension}"
+
+        logger.info(f"Loading model {model_name} with engine {model_engine}")
         predictor = NanoOwlModel(model_name=model_name,
-                                 model_engine=model_engine)
+                                 model_engine=model_engine,
+                                 max_batch_size=self._pipeline.max_batch_size,
+                                 prompt_cache_size=self._model_config.prompt_cache_size,
+                                 prompt_cache_path=prompt_cache_path,
+                                 metrics=self._metrics)
         predictor.load_model()
 
-        # Get first VST stream source
-        v_input, sensor_id = self.create_video_stream()
+        return predictor
+
+    def create_publisher(self):
+        """
+        Create the publisher connected to redis
+
+        Returns:
+           Publisher: A publisher to post messages to redis
+        """
+        return Publisher(self._redis_host, self._redis_port, self._redis_stream,
+                         queue_size=self._publish.queue_size,
+                         policy=self._publish.policy,
+                         batch_size=self._publish.batch_size,
+                         metrics=self._metrics)
+
+    def _run_stage(self, name, create, *args):
+        with self._startup.stage(name):
+            return create(*args)
+
+    def _connect_publisher(self):
+        """
+        Create the publisher and connect it to redis. A redis server that is
+        not up yet does not stop the startup, the publisher keeps retrying
+
+        Returns:
+           Publisher: A publisher to post messages to redis
+        """
+        publisher = self.create_publisher()
+        try:
+            with self._startup.stage("redis"):
+                publisher.connect()
+        except Exception as e:
+            logger.warning(f"Redis is not reachable yet: {e}")
+
+        return publisher
+
+    def prepare(self):
+        """
+        Prepare detection resources. The model is loaded, the streams are
+        looked up in VST and opened, and redis is connected at the same time,
+        since each of them mostly waits on the device or the network
+
+        Returns:
+           Tuple[NanoOwlModel, Publisher]: A tuple with a predictor object to process
+           detection prompt and a Publisher to post messages to redis. The active
+           streams with their videoSource and SchemaGenerator are also created
+
+        """
+        stream_names = self._stream_names or [None]
+        with ThreadPoolExecutor(max_workers=len(stream_names) + 2) as pool:
+            # Load GenAI model
+            model = pool.submit(self._run_stage, "model", self.create_model)
+
+            # Get requested VST streams or the first available
+            sources = [pool.submit(self._run_stage, f"stream {stream_name or 'default'}",
+                                   self.create_video_stream, stream_name)
+                       for stream_name in stream_names]
 
-        image_size = [v_input.GetWidth(), v_input.GetHeight()]
-        self._image_size = image_size
-        # Get schema format generator and connect to redis
-        schema_gen = SchemaGenerator(sensor_id=sensor_id,
-                                     image_size=image_size)
-        schema_gen.connect_redis(
-            self._redis_host, self._redis_port, self._redis_stream)
+            # Connect to redis
+            publisher = pool.submit(self._connect_publisher)
 
-        return v_input, predictor, schema_gen
+            for stream_name, source in zip(stream_names, sources):
+                v_source, sensor_id, name = source.result()
+                if stream_name and name != stream_name:
+                    logger.warning(f"Stream {stream_name} not added")
+                    self.release_video_stream(v_source)
+                    continue
+                self._start_stream(v_source, sensor_id, name)
+
+            return model.result(), publisher.result()
+
+    def warmup(self, predictor):
+        """
+        Run the model on blank frames before the first real frame, so the
+        lazy initialization of the engine, the kernels and the input buffers
+        does not delay the first detections
+
+        Args:
+           predictor(NanoOwlModel): model to warm up
+        """
+        if not predictor.objects:
+            return
+
+        # Models swapped at runtime are warmed up while the streams change
+        streams = list(self._streams.values())
+        width, height = self._pipeline.inference_size or WARMUP_SIZE
+        for stream in streams:
+            if stream.source.GetWidth() and not self._pipeline.inference_size:
+                width, height = stream.source.GetWidth(), stream.source.GetHeight()
+                break
+
+        image = np.zeros((height, width, 3), np.uint8)
+        batch_size = max(1, min(len(streams), self._pipeline.max_batch_size))
+        predictor.perform_batch_inference([image] * batch_size)
+        if self._use_sahi and self._slicing.backend == "native":
+            slice_size = self._calculate_slice_size((width, height))
+            predictor.perform_sliced_inference(image, slice_size, overlap_ratio=0.2)
 
     def _calculate_slice_size(self, image_size):
         width = image_size[0]
@@ -178,76 +496,868 @@ class Detection:
 
         return slice_width, slice_height
 
+    def set_regions(self, stream_name, regions):
+        """
+        Restrict the detection of a stream to regions of interest
+
+        Args:
+           stream_name(str): VST sensor name or None for every stream
+           regions(List[np.ndarray]): polygons points in image pixels, or
+           None to detect on the whole image
+        """
+        if regions:
+            self._rois[stream_name] = regions
+        else:
+            self._rois.pop(stream_name, None)
+
+        names = [stream_name] if stream_name else list(self._streams)
+        for name in names:
+            stream = self._streams.get(name)
+            if not stream:
+                continue
+            regions = self._rois.get(name, self._rois.get(None))
+            stream.mask = RegionMask(regions) if regions else None
+            stream.reset_detections()
+            logger.info(f"Stream {name} regions of interest set to {regions}")
+
+    def set_model(self, model):
+        """
+        Change the detection model, it is loaded and warmed up in the
+        background and swapped in once ready. With quality tiers the model is
+        the one of the highest tier, lower tiers may still use lighter models
+
+        Args:
+           model(str): model name, one of quality.MODELS
+        """
+        model_files(model, self._model_config.engine_dir)
+        self._base_model = model
+        if self._quality:
+            self._quality.set_tiers(build_tiers(
+                self._quality.tiers[0].slices, model, self._quality_tiers))
+            self._quality_status.set(tiers=[tier._asdict() for tier in self._quality.tiers])
+            self._apply_tier(self._quality.tier)
+        else:
+            self._wanted_model = model
+        logger.info(f"Model changed to {model}")
+
+    def _load_model(self, model):
+        """
+        Load a model and prepare it with the current prompt, runs on the
+        loader thread
+
+        Args:
+           model(str): model name, one of quality.MODELS
+
+        Returns:
+           NanoOwlModel: The loaded model
+        """
+        start = time.monotonic()
+        predictor = self.create_model(model)
+        objects = self._searches.objects
+        if objects:
+            predictor.set_detection_objects(objects, self._searches.thresholds)
+            self.warmup(predictor)
+        logger.info(f"Model {model} ready in {time.monotonic() - start:.2f} s")
+
+        return predictor
+
+    def _swap_model(self, predictor):
+        """
+        Start loading the wanted model if it is not the one in use, and swap
+        it in once loaded
+
+        Args:
+           predictor(NanoOwlModel): model in use
+
+        Returns:
+           NanoOwlModel: The model to use from now on
+        """
+        if self._loading is None:
+            if self._wanted_model != self._model_in_use:
+                future = self._loader.submit(self._load_model, self._wanted_model)
+                self._loading = (self._wanted_model, future)
+                self._quality_status.set(loading=self._wanted_model)
+            return predictor
+
+        model, future = self._loading
+        if not future.done():
+            return predictor
+
+        self._loading = None
+        self._quality_status.set(loading=None)
+        try:
+            loaded = future.result()
+        except Exception as e:
+            logger.error(f"Failed to load model {model}, keeping {self._model_in_use}: {e}")
+            self._wanted_model = self._model_in_use
+            return predictor
+
+        # Another model was requested while loading, it is loaded next
+        if model != self._wanted_model:
+            return predictor
+
+        # The prompt may have changed while loading
+        if self._searches.objects:
+            loaded.set_detection_objects(self._searches.objects, self._searches.thresholds)
+
+        # The cached embeddings belong to the previous model
+        for stream in self._streams.values():
+            if stream.tiles:
+                stream.tiles.reset()
+        if self._embeddings:
+            self._embeddings.clear()
+        while self._queries:
+            self._reply(self._queries.popleft().reply,
+                        error=RuntimeError("The model changed during the query"))
+
+        logger.info(f"Model swapped from {self._model_in_use} to {model}")
+        self._model_in_use = model
+        self._model_swaps.inc()
+        self._quality_status.set(model=model)
+
+        return loaded
+
+    def _apply_tier(self, tier):
+        """
+        Change the detection settings to the ones of a quality tier
+
+        Args:
+           tier(QualityTier): the quality tier
+        """
+        # Adaptive slicing already chooses the grid from the latency
+        if self._slicing.mode != "adaptive" and \
+                tier.slices != (self._vertical_slices, self._horizontal_slices):
+            self._vertical_slices, self._horizontal_slices = tier.slices
+            self._use_sahi = not (self._vertical_slices == 1 and self._horizontal_slices == 1)
+            for stream in self._streams.values():
+                if self._use_sahi and stream.image_size != [0, 0]:
+                    stream.slice_size = self._calculate_slice_size(stream.input_size)
+
+        if tier.scale != self._scale:
+            self._scale = tier.scale
+            for stream in self._streams.values():
+                self._rescale(stream)
+
+        self._frame_skip = tier.skip
+        self._wanted_model = tier.model
+        self._quality_status.set(tier=tier.name)
+
+    def _rescale(self, stream):
+        """
+        Scale the inference resolution of a stream to the quality tier one,
+        relative to its inference size or its original size
+
+        Args:
+           stream(Stream): the stream to scale
+        """
+        if stream.image_size == [0, 0]:
+            # Scaled once its original size is known
+            return
+
+        size = stream.inference_size
+        if self._scale != 1.0:
+            width, height = size or stream.image_size
+            size = (max(1, round(width * self._scale)), max(1, round(height * self._scale)))
+
+        stream.quality_scale = self._scale
+        stream.set_scaler(self.create_scaler(stream.source, size))
+        logger.info(f"Stream {stream.name} inference size set to {size or stream.image_size}")
+
+    def _activate_source(self, opened):
+        """
+        Swap in a source opened in the background
+
+        Args:
+           opened(OpenedSource): the opened source and its request
+        """
+        request = opened.request
+        if request.action == "replace":
+            # The source replaces every active stream
+            for name in list(self._streams):
+                self.remove_stream(name)
+        elif request.name and opened.name != request.name:
+            logger.warning(f"Stream {request.name} not added")
+            self.release_video_stream(opened.source)
+            return
+
+        self._start_stream(opened.source, opened.sensor_id, opened.name,
+                           **request.options)
+
+    def _process_updates(self, predictor):
+        """
+        Apply the pending source, stream and search requests. New sources are
+        opened in the background and the active streams keep being processed
+        until they are ready
+
+        Args:
+           predictor(NanoOwlModel): model to update with new searches
+        """
+
+        # Get source updates
+        if not self._source_queue.empty():
+            self._sources.open(self._source_queue.get(), "replace")
+
+        # Get stream set updates
+        while self._stream_queue is not None and not self._stream_queue.empty():
+            action, name, inference_size = self._stream_queue.get()
+            if action == "remove":
+                self.remove_stream(name)
+            elif name in self._streams:
+                logger.info(f"Stream {name} already active")
+            else:
+                self._sources.open(name, "add", inference_size=inference_size)
+
+        # Get region of interest updates, they also apply to streams added later
+        while self._roi_queue is not None and not self._roi_queue.empty():
+            name, regions = self._roi_queue.get()
+            self.set_regions(name, regions)
+
+        # Swap in the sources that got their first frame
+        for opened in self._sources.ready():
+            self._activate_source(opened)
+
+        # Get search updates
+        updated = False
+        while not self._search_queue.empty():
+            name, stream_name, search = self._search_queue.get()
+            try:
+                updated = self.set_search(name, search, stream_name) or updated
+            except ValueError as e:
+                logger.error(f"Invalid search {name}: {e}")
+        if updated:
+            self._apply_searches(predictor)
+
+        # Get model changes, the new model is loaded in the background
+        while self._model_queue is not None and not self._model_queue.empty():
+            self.set_model(self._model_queue.get())
+
+        # Start the queries over the cached embeddings
+        while self._query_queue is not None and not self._query_queue.empty():
+            query, reply = self._query_queue.get()
+            try:
+                self._queries.append(self.start_query(query, reply))
+            except (RuntimeError, ValueError) as e:
+                self._reply(reply, error=e)
+
+        # Live frames wait for a single decoder batch of the oldest query
+        if self._queries:
+            self._advance_query(predictor)
+
+    def set_search(self, name, search, stream_name=None):
+        """
+        Add, replace or remove a named search. The model is updated by the
+        detection loop
+
+        Args:
+           name(str): search name
+           search(Search): model Search with the requested objects and
+           thresholds, or None to remove the search
+           stream_name(str, optional): VST sensor name the search applies to,
+           or None for every stream
+
+        Returns:
+           bool: True if the searches changed
+        """
+        if search is None:
+            if not self._searches.remove(name):
+                logger.warning(f"Search {name} does not exist")
+                return False
+            logger.info(f"Search {name} removed")
+            return True
+
+        objects, thresholds = self.process_search(search)
+        self._searches.set(NamedSearch(name, objects, thresholds, stream_name))
+        logger.info(f"Search {name} set to objects={objects} thresholds={thresholds}"
+                    f" on {stream_name or 'every stream'}")
+        return True
+
+    def _apply_searches(self, predictor):
+        """
+        Set the model prompts to the union of the active searches
+
+        Args:
+           predictor(NanoOwlModel): model to update
+        """
+        objects = self._searches.objects
+        thresholds = self._searches.thresholds
+        self._searches_gauge.set(len(self._searches))
+        self._prompts_gauge.set(len(objects))
+        if not objects:
+            logger.info("No active searches, detection paused")
+            return
+
+        changed = objects != predictor.objects
+        predictor.set_detection_objects(objects, thresholds)
+        logger.info(f"Prompt objects={objects} thresholds={thresholds}")
+
+        # Previous detections are not valid if the labels changed, the last
+        # frame of each stream is decoded again if its embeddings are cached
+        if changed:
+            for stream in self._streams.values():
+                if not self._redecode(predictor, stream):
+                    stream.reset_detections()
+
+    def _redecode(self, predictor, stream):
+        """
+        Detect the current prompt on the last inferred frame of a stream
+        without running the image encoder
+
+        Args:
+           predictor(NanoOwlModel): model to decode with
+           stream(Stream): the stream to update
+
+        Returns:
+           bool: True if the frame embeddings were cached
+        """
+        latest = self._embeddings.latest(stream.name) if self._embeddings else None
+        if latest is None:
+            return False
+
+        predictions = predictor.decode_embeddings([latest.embeddings])[0]
+        predictions = stream.to_image_coordinates(predictions)
+        if stream.mask:
+            predictions = stream.mask.filter(predictions)
+
+        # The motion gate and inference interval are kept, so static frames
+        # still skip the image encoder
+        if stream.tracker:
+            stream.tracker.reset()
+        stream.deltas.clear()
+        stream.last_predictions = predictions
+        self._redecoded[stream.name] = predictions
+        logger.debug(f"{stream.name} decoded again with the new prompt")
+        return True
+
+    def start_query(self, query, reply):
+        """
+        Start an ad-hoc search on the cached embeddings of the last seconds,
+        the detection loop runs only the decoder on them a batch at a time
+
+        Args:
+           query(EmbeddingQuery): the search, time window and optional stream
+           reply(Future): future the request waits on
+
+        Returns:
+           QueryJob: The query in progress
+        """
+        if self._embeddings is None:
+            raise RuntimeError(
+                "The embedding cache is disabled, set --embedding-cache-size to enable it")
+
+        objects, thresholds = self.process_search(query.search)
+        frames = self._embeddings.since(time.time() - query.seconds, query.stream)
+        return QueryJob(reply, objects, thresholds, frames)
+
+    def _advance_query(self, predictor):
+        """
+        Decode the next batch of frames of the oldest query and answer it
+        once every frame is decoded. The matches are the stream, sensor id,
+        timestamp, labels, boxes and scores of the frames with detections
+        inside the stream regions of interest
+
+        Args:
+           predictor(NanoOwlModel): model to decode with
+        """
+        job = self._queries[0]
+        batch = job.next_batch()
+        try:
+            results = []
+            if batch:
+                results = predictor.decode_embeddings([frame.embeddings for frame in batch],
+                                                      job.objects, job.thresholds)
+        except (RuntimeError, ValueError) as e:
+            self._queries.popleft()
+            self._reply(job.reply, error=e)
+            return
+
+        for frame, predictions in zip(batch, results):
+            if frame.scale != (1.0, 1.0):
+                predictions = predictions.scale(*frame.scale)
+            if frame.stream in self._streams:
+                mask = self._streams[frame.stream].mask
+            else:
+                # The older frames of removed streams can still be queried
+                regions = self._rois.get(frame.stream, self._rois.get(None))
+                mask = RegionMask(regions) if regions else None
+            if mask:
+                predictions = mask.filter(predictions)
+            if not len(predictions):
+                continue
+            text_labels, bboxes = predictions.to_lists(job.objects)
+            job.matches.append({"stream": frame.stream, "sensor_id": frame.sensor_id,
+                                "timestamp": frame.timestamp, "labels": text_labels,
+                                "bboxes": bboxes, "scores": predictions.scores.tolist()})
+
+        if job.done:
+            self._queries.popleft()
+            logger.info(f"Query objects={job.objects} over {len(job.frames)} cached frames, "
+                        f"{len(job.matches)} with detections")
+            self._reply(job.reply, {"frames": len(job.frames), "matches": job.matches})
+
+    def _reply(self, reply, result=None, error=None):
+        """
+        Send the result of a query to the waiting request
+
+        Args:
+           reply(Future): future the request waits on
+           result(dict, optional): the query result
+           error(Exception, optional): the error if the query failed
+        """
+        if error is not None:
+            reply.set_exception(error)
+        else:
+            reply.set_result(result)
+
+    def _capture(self):
+        """
+        Capture the next frame of every active stream
+
+        Returns:
+           List[Tuple[Stream, Frame]]: The streams with a new frame
+        """
+        if self._pipelined:
+            self._frame_event.wait(timeout=1.0)
+            self._frame_event.clear()
+
+        frames = []
+        for stream in self._streams.values():
+            frame = stream.capture(timeout=0)
+            if frame is None:
+                continue
+
+            if self._update_image_size(stream, frame):
+                frames.append((stream, frame))
+
+        return frames
+
+    def _update_image_size(self, stream, frame):
+        """
+        Update the sizes of a stream once its first frame is captured
+
+        Args:
+           stream(Stream): the stream the frame belongs to
+           frame(Frame): the captured frame
+
+        Returns:
+           bool: False if the frame was scaled before an inference resolution
+           change and must be discarded
+        """
+        if stream.update_image_size():
+            if stream.quality_scale != self._scale:
+                # The original size is needed to scale the stream resolution
+                self._rescale(stream)
+                return False
+            if self._use_sahi:
+                stream.slice_size = self._calculate_slice_size(stream.input_size)
+
+        if stream.resizing:
+            if not stream.fits(frame):
+                return False
+            stream.resizing = False
+
+        return True
+
+    def _predict(self, predictor, image, slice_size, tiles=None):
+        """
+        Run model prediction over the slices of an image
+
+        Args:
+           predictor(NanoOwlModel): model used for the prediction
+           image(cudaImage): captured image
+           slice_size(Tuple[int, int]): slice width and height
+           tiles(TileCache, optional): cached slices of the stream, only used by
+           the native backend
+
+        Returns:
+           Predictions: The merged detections of all the slices
+        """
+        slice_width, slice_height = slice_size
+        if self._slicing.backend == "native":
+            return predictor.perform_sliced_inference(
+                image, slice_size, overlap_ratio=0.2, tiles=tiles)
+
+        from sahi.predict import get_sliced_prediction
+
+        with self._metrics.timer("sahi"):
+            output = get_sliced_prediction(
+                np.asarray(image),
+                predictor,
+                slice_height=slice_height,
+                slice_width=slice_width,
+                overlap_height_ratio=0.2,
+                overlap_width_ratio=0.2)
+
+        predictions = output.object_prediction_list
+        if not predictions:
+            return Predictions()
+
+        return Predictions(
+            boxes=np.array([prediction.bbox.to_xyxy()
+                           for prediction in predictions], dtype=np.float32),
+            scores=np.array([prediction.score.value for prediction in predictions],
+                            dtype=np.float32),
+            labels=np.array([prediction.category.id for prediction in predictions],
+                            dtype=np.int64))
+
+    def _infer(self, predictor, frames):
+        """
+        Run model prediction over the frames of several streams
+
+        Args:
+           predictor(NanoOwlModel): model used for the prediction
+           frames(List[Tuple[Stream, Frame]]): the streams frames
+
+        Returns:
+           List[Predictions]: The detections for each frame
+        """
+        if not frames:
+            return []
+
+        results = [None] * len(frames)
+        latencies = [0.0] * len(frames)
+        plans = [None] * len(frames)
+        whole = []
+        for i, (stream, frame) in enumerate(frames):
+            slicing = None
+            if stream.slicer:
+                plans[i] = stream.slicer.plan(stream.input_size, frame.timestamp)
+                if plans[i].grid > 1:
+                    slicing = (plans[i].slice_size, plans[i].overlap_ratio)
+            elif self._use_sahi:
+                slicing = (stream.slice_size, 0.2)
+
+            start = time.perf_counter()
+            if stream.mask:
+                # Only the crops of the regions of interest go to the model
+                crops = stream.mask.crops(stream.input_size, stream.scale)
+                slice_size, overlap_ratio = slicing or (None, 0.2)
+                if not crops:
+                    results[i] = Predictions()
+                    continue
+                results[i] = predictor.perform_region_inference(
+                    frame.image, crops, slice_size, overlap_ratio=overlap_ratio)
+            elif slicing and stream.slicer:
+                results[i] = predictor.perform_sliced_inference(
+                    frame.image, slicing[0], overlap_ratio=slicing[1], tiles=stream.tiles)
+            elif slicing:
+                results[i] = self._predict(
+                    predictor, frame.image, stream.slice_size, stream.tiles)
+            else:
+                whole.append(i)
+                continue
+            latencies[i] = time.perf_counter() - start
+            self._keep_embeddings(predictor, stream, frame)
+            if stream.tiles and stream.tiles.rois:
+                self._tiles_counter.inc(stream.tiles.encoded, stream=stream.name,
+                                        state="encoded")
+                self._tiles_counter.inc(stream.tiles.reused, stream=stream.name,
+                                        state="reused")
+
+        if whole:
+            start = time.perf_counter()
+            batch = predictor.perform_batch_inference(
+                [frames[i][1].image for i in whole])
+            latency = (time.perf_counter() - start) / len(whole)
+            for index, (i, predictions) in enumerate(zip(whole, batch)):
+                results[i] = predictions
+                latencies[i] = latency
+                self._keep_embeddings(predictor, frames[i][0], frames[i][1], index)
+
+        for (stream, frame), plan, predictions, latency in zip(frames, plans, results, latencies):
+            if plan is None:
+                continue
+            stream.slicer.update(predictions, plan, stream.input_size, latency,
+                                 frame.timestamp)
+            self._grid_frames.inc(stream=stream.name, grid=plan.name)
+            self._grid_gauge.set(plan.grid, stream=stream.name)
+            logger.debug(
+                f"{stream.name} inferred with {plan.name} grid and {plan.overlap_ratio:.2f} "
+                f"overlap in {latency * 1000:.1f} ms")
+
+        return results
+
+    def _keep_embeddings(self, predictor, stream, frame, index=None):
+        """
+        Cache the image embeddings of the last inference of a frame
+
+        Args:
+           predictor(NanoOwlModel): model used for the prediction
+           stream(Stream): the stream the frame belongs to
+           frame(Frame): the inferred frame
+           index(int, optional): index of the frame in the last batched inference
+        """
+        if self._embeddings is None:
+            return
+
+        embeddings = predictor.last_embeddings(index)
+        if embeddings is None:
+            return
+
+        self._embeddings.add(stream.name, stream.sensor_id, frame.timestamp,
+                             stream.scale, embeddings)
+        self._embeddings_gauge.set(len(self._embeddings))
+
+    def _should_infer(self, stream, frame):
+        """
+        Check whether the model must run on the frame of a stream, according
+        to the inference interval, the frames skipped under load and the
+        motion gating
+
+        Args:
+           stream(Stream): the stream the frame belongs to
+           frame(Frame): the captured frame
+
+        Returns:
+           bool: True if the model must run on the frame
+        """
+        if frame.timestamp < stream.next_inference:
+            return False
+
+        # Under load only one of every few frames is inferred
+        if self._frame_skip > 1:
+            stream.skipped = (stream.skipped + 1) % self._frame_skip
+            if stream.skipped:
+                return False
+
+        if stream.gate and not stream.gate.check(frame.image, frame.timestamp):
+            return False
+
+        stream.next_inference = frame.timestamp + self._pipeline.inference_interval
+        return True
+
+    def _emit(self, publisher, stream, text_labels, bboxes, scores, **fields):
+        """
+        Publish a stream message to redis and to the live detections
+        subscribers, and keep the detections in the recorders
+
+        Args:
+           publisher(Publisher): publisher to post the message
+           stream(Stream): the stream the detections belong to
+           text_labels(List[str]): detections labels
+           bboxes(List[List[float]]): detections boxes
+           scores(List[float]): detections scores
+           fields: additional message fields, lists are sent to redis as JSON
+        """
+        emit_detections(publisher, self._broadcaster, stream, text_labels, bboxes,
+                        scores, self._recorders, **fields)
+
+    def _delta_fields(self, stream, search, text_labels, bboxes, timestamp):
+        """
+        Check the detections against the last published ones of the stream
+        search in delta publishing mode
+
+        Args:
+           stream(Stream): the stream the detections belong to
+           search(NamedSearch): the search the detections belong to
+           text_labels(List[str]): detections labels
+           bboxes(List[List[float]]): detections boxes
+           timestamp(float): capture time in seconds
+
+        Returns:
+           dict: The fields to add to the message, or None if the detections
+           did not change and must not be published
+        """
+        delta = stream.deltas.get(search.name)
+        if delta is None:
+            delta = DeltaFilter(self._delta.iou, self._delta.pixels,
+                                self._delta.keyframe_interval)
+            stream.deltas[search.name] = delta
+
+        update = delta.check(text_labels, bboxes, timestamp)
+        if update is None:
+            self._metrics.frames.inc(step="unchanged")
+            return None
+
+        return {"update": update}
+
+    def _publish_predictions(self, publisher, stream, frame, objects):
+        """
+        Publish the last detections of a stream, one message for each search
+        of the stream with the detections above the search thresholds
+
+        Args:
+           publisher(Publisher): publisher to post the message
+           stream(Stream): the stream to publish
+           frame(Frame): the captured frame
+           objects(List[str]): objects the predictor was set up with
+        """
+        predictions = stream.last_predictions
+        if predictions is None:
+            return
+
+        # Mark the detections as published to suppress them until the next inference
+        if self._motion.idle == "suppress":
+            stream.last_predictions = None
+
+        for search in self._searches.for_stream(stream.name):
+            selected = predictions.select(
+                search.accepts(predictions.labels, predictions.scores))
+            fields = {"search": search.name, "timestamp": frame.timestamp}
+            text_labels, bboxes = selected.to_lists(objects)
+            if self._delta.mode == "delta":
+                # Removed detections are a change, so empty frames are published too
+                delta = self._delta_fields(stream, search, text_labels, bboxes,
+                                           frame.timestamp)
+                if delta is None:
+                    continue
+                fields.update(delta)
+            elif not len(selected):
+                continue
+
+            logger.debug(
+                f"{stream.name} {search.name} labels {text_labels} bboxes {bboxes}")
+            self._emit(publisher, stream, text_labels, bboxes, selected.scores.tolist(),
+                       **fields)
+
+    def _publish_tracks(self, publisher, stream, frame, objects, predictions):
+        """
+        Update the tracks of a stream and publish them, either every frame
+        or only the tracks that started, were updated or ended. One message is
+        published for each search of the stream with the tracks above the
+        search thresholds
+
+        Args:
+           publisher(Publisher): publisher to post the message
+           stream(Stream): the stream to publish
+           frame(Frame): the captured frame
+           objects(List[str]): objects the predictor was set up with
+           predictions(Predictions): the frame detections or None if the model
+           did not run on the frame
+        """
+        with self._metrics.timer("track"):
+            if predictions is not None:
+                output = stream.tracker.update(predictions, frame.timestamp)
+            else:
+                output = stream.tracker.predict(frame.timestamp)
+
+        if self._tracking == "events":
+            tracks = output.started + output.updated + output.ended
+            boxes = [track.box.tolist() for track in tracks]
+            events = ["start"] * len(output.started) + ["update"] * \
+                len(output.updated) + ["end"] * len(output.ended)
+        else:
+            tracks = output.tracks
+            boxes = output.boxes.tolist()
+            events = None
+
+        for search in self._searches.for_stream(stream.name):
+            accepted = search.accepts([track.label for track in tracks],
+                                      [track.score for track in tracks])
+            search_tracks = [track for track, keep in zip(tracks, accepted) if keep]
+            text_labels = [objects[track.label] for track in search_tracks]
+            bboxes = [box for box, keep in zip(boxes, accepted) if keep]
+            fields = {"search": search.name, "timestamp": frame.timestamp}
+            if events is not None:
+                fields["events"] = [event for event, keep in zip(events, accepted) if keep]
+
+            if self._delta.mode == "delta" and events is None:
+                delta = self._delta_fields(stream, search, text_labels, bboxes,
+                                           frame.timestamp)
+                if delta is None:
+                    continue
+                fields.update(delta)
+            elif not search_tracks:
+                continue
+
+            track_ids = [track.id for track in search_tracks]
+            fields["track_ids"] = track_ids
+            logger.debug(f"{stream.name} {search.name} tracks {track_ids} "
+                         f"labels {text_labels} bboxes {bboxes}")
+            self._emit(publisher, stream, text_labels, bboxes,
+                       [float(track.score) for track in search_tracks], **fields)
+
+    def stop(self):
+        """
+        Stop the detection loop
+        """
+        self._running = False
+
     def loop(self):
         """
-        Get buffers from RTSP stream and detect requested objects
+        Get buffers from the RTSP streams and detect requested objects
         """
 
         # Prepare resources
-        v_input, predictor, schema_gen = self.prepare()
+        predictor, publisher = self.prepare()
+        self._model_in_use = self._base_model
+        self._quality_status.set(model=self._base_model)
+        if self._quality:
+            self._quality_status.set(tier=self._quality.tier.name,
+                                     tiers=[tier._asdict() for tier in self._quality.tiers])
 
         # Initial prompt
-        objects = self._default_objects
-        thresholds = self._default_thresholds
+        objects = self._searches.objects
+        thresholds = self._searches.thresholds
         predictor.set_detection_objects(objects, thresholds)
+        self._searches_gauge.set(len(self._searches))
+        self._prompts_gauge.set(len(objects))
 
         logger.info(
             f"Initial prompt objects={objects} thresholds={thresholds}")
 
-        if self._use_sahi:
-            slice_width, slice_height = self._calculate_slice_size(
-                self._image_size)
-
-        while True:
-            # Get source updates
-            if not self._source_queue.empty():
-                input_name = self._source_queue.get()
-                v_input, _ = self.create_video_stream(input_name)
-                self._image_size = [0, 0]
-
-            # Get search updates
-            if not self._search_queue.empty():
-                objects, thresholds = self.process_search(
-                    self._search_queue.get())
-                predictor.set_detection_objects(objects, thresholds)
-
-            # Capture next image
-            image = v_input.Capture()
-            if image is None:
-                logger.warning("Capture timeout")
-                continue
+        with self._startup.stage("warmup"):
+            self.warmup(predictor)
+        self._startup.set_ready()
 
-            if self._image_size == [0, 0]:
-                image_size = [v_input.GetWidth(), v_input.GetHeight()]
-                self._image_size = image_size
-                schema_gen.image_size = image_size
-
-                if self._use_sahi:
-                    slice_width, slice_height = self._calculate_slice_size(
-                        self._image_size)
-
-            # Run model prediction
-            if not self._use_sahi:
-                predictor.perform_inference(image)
-                output = predictor.original_predictions
-                text_labels = [objects[x] for x in output.labels]
-                bboxes = output.boxes.tolist()
-            else:
-                output = get_sliced_prediction(
-                    np.ascontiguousarray(image),
-                    predictor,
-                    slice_height=slice_height,
-                    slice_width=slice_width,
-                    overlap_height_ratio=0.2,
-                    overlap_width_ratio=0.2)
-
-                bboxes = []
-                text_labels = []
-                predictions = output.object_prediction_list
-                for prediction in predictions:
-                    bboxes.append(prediction.bbox.to_xyxy())
-                    text_labels.append(prediction.category.name)
-
-            if text_labels:
-                logger.debug(f"labels {text_labels} bboxes {bboxes}")
-                schema_gen(text_labels, bboxes)
+        publisher.start()
+        self._sources.start()
+        if self._pipelined:
+            logger.info(
+                f"Pipelined mode enabled with a buffer of {self._pipeline.buffer_size} frames")
+
+        self._running = True
+        try:
+            while self._running:
+                self._process_updates(predictor)
+                predictor = self._swap_model(predictor)
+                objects = predictor.objects
+
+                # Capture next images
+                with self._metrics.timer("capture"):
+                    frames = self._capture()
+                if not frames:
+                    continue
+                self._metrics.frames.inc(len(frames), step="captured")
+
+                # Skip the model on static frames, between inference intervals
+                # and while there are no searches
+                changed = [(stream, frame) for stream, frame in frames
+                           if len(self._searches) and self._should_infer(stream, frame)]
+
+                # Run model prediction
+                with self._metrics.timer("inference"):
+                    results = self._infer(predictor, changed)
+                self._metrics.frames.inc(len(changed), step="inferred")
+
+                # Step the quality down when the frames wait too long
+                if self._quality and changed:
+                    now = time.time()
+                    tier = self._quality.observe(
+                        max(now - frame.timestamp for _, frame in changed))
+                    if tier:
+                        self._apply_tier(tier)
+
+                # Streams decoded again after a prompt change update their tracks too
+                inferred = self._redecoded
+                self._redecoded = {}
+                for (stream, _), predictions in zip(changed, results):
+                    predictions = stream.to_image_coordinates(predictions)
+                    if stream.mask:
+                        predictions = stream.mask.filter(predictions)
+                    stream.last_predictions = predictions
+                    inferred[stream.name] = predictions
+                    self._metrics.detections.observe(len(predictions))
+
+                for stream, frame in frames:
+                    if stream.tracker:
+                        self._publish_tracks(publisher, stream, frame, objects,
+                                             inferred.get(stream.name))
+                    else:
+                        self._publish_predictions(
+                            publisher, stream, frame, objects)
+        finally:
+            self._sources.stop()
+            for stream in self._streams.values():
+                stream.stop()
+                self.release_video_stream(stream.source)
+            publisher.stop()
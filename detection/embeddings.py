@@ -0,0 +1,194 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Cache of recent image embeddings, decoded again against new prompts
+"""
+
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional, Tuple
+
+# Cached frames decoded by a query on each iteration of the detection loop
+QUERY_BATCH = 32
+
+
+class EmbeddingConfig(NamedTuple):
+    """
+    Embedding cache settings, the cache is disabled without a size. The image
+    embeddings of the inferred frames are kept so prompt changes and ad-hoc
+    queries only run the decoder
+    """
+    size: int = 0
+    interval: float = 1.0
+
+
+class CachedFrame(NamedTuple):
+    """
+    Image embeddings of a frame with the stream it comes from
+    """
+    stream: str
+    sensor_id: str
+    timestamp: float
+    scale: Tuple[float, float]
+    embeddings: Any
+
+
+class EmbeddingQuery(NamedTuple):
+    """
+    Ad-hoc search over the cached embeddings of the last seconds
+    """
+    search: Any
+    seconds: float
+    stream: Optional[str] = None
+
+
+class QueryJob:
+    """
+    Query over the cached embeddings in progress. The frames are decoded a
+    batch at a time between the live frames, so a long history does not
+    stall the detection
+    """
+
+    def __init__(self, reply, objects, thresholds, frames):
+        """
+        Args:
+            reply (Future): future the request waits on
+            objects (List[str]): objects to detect
+            thresholds (List[float]): score threshold of each object
+            frames (List[CachedFrame]): the cached frames to search, oldest first
+        """
+        self.reply = reply
+        self.objects = objects
+        self.thresholds = thresholds
+        self.frames = frames
+        self.matches = []
+        self._position = 0
+
+    @property
+    def done(self):
+        """
+        Whether every frame was decoded
+        """
+        return self._position >= len(self.frames)
+
+    def next_batch(self, size: int = QUERY_BATCH):
+        """
+        Take the next frames to decode
+
+        Args:
+            size (int, optional): Maximum amount of frames. Defaults to 32.
+
+        Returns:
+            List[CachedFrame]: The frames
+        """
+        batch = self.frames[self._position:self._position + size]
+        self._position += len(batch)
+        return batch
+
+
+class EmbeddingCache:
+    """
+    Bounded cache of the image embeddings of recent frames, keyed by stream
+    and frame timestamp.
+
+    The embeddings of the last inferred frame of each stream are kept on
+    the device, so a prompt change is applied to the current frame without
+    running the image encoder again. One frame every interval of each
+    stream is also copied to host, to run queries over the last seconds at
+    the cost of the decoder only.
+    """
+
+    def __init__(self, size: int = 256, interval: float = 1.0):
+        """
+        Args:
+            size (int, optional): Maximum amount of frames kept on host, the oldest
+            frames are discarded first. Defaults to 256.
+            interval (float, optional): Minimum seconds between the frames kept of
+            each stream. Defaults to 1.0.
+        """
+        if size < 1:
+            raise ValueError("The embedding cache needs room for at least one frame")
+
+        self._size = size
+        self._interval = interval
+        self._frames = OrderedDict()
+        self._latest = {}
+        self._next = {}
+
+    def __len__(self):
+        return len(self._frames)
+
+    def add(self, stream, sensor_id, timestamp, scale, embeddings):
+        """
+        Keep the embeddings of an inferred frame
+
+        Args:
+            stream (str): VST sensor name
+            sensor_id (str): VST sensor id
+            timestamp (float): capture time in seconds
+            scale (Tuple[float, float]): original image size over the model input size
+            embeddings (ImageEmbeddings): the frame embeddings on the device
+        """
+        self._latest[stream] = CachedFrame(stream, sensor_id, timestamp, scale, embeddings)
+        if timestamp < self._next.get(stream, 0.0):
+            return
+
+        self._next[stream] = timestamp + self._interval
+        self._frames[(stream, timestamp)] = CachedFrame(
+            stream, sensor_id, timestamp, scale, embeddings.to_host())
+        while len(self._frames) > self._size:
+            self._frames.popitem(last=False)
+
+    def latest(self, stream):
+        """
+        Get the embeddings of the last inferred frame of a stream
+
+        Args:
+            stream (str): VST sensor name
+
+        Returns:
+            CachedFrame: The last frame of the stream or None
+        """
+        return self._latest.get(stream)
+
+    def discard(self, stream):
+        """
+        Forget the last frame of a stream that is no longer active, its
+        older frames can still be queried
+
+        Args:
+            stream (str): VST sensor name
+        """
+        self._latest.pop(stream, None)
+        self._next.pop(stream, None)
+
+    def clear(self):
+        """
+        Forget every frame, after a model change the embeddings can no
+        longer be decoded
+        """
+        self._frames.clear()
+        self._latest.clear()
+        self._next.clear()
+
+    def since(self, timestamp, stream=None):
+        """
+        Get the frames captured after a given time
+
+        Args:
+            timestamp (float): oldest capture time in seconds
+            stream (str, optional): VST sensor name or None for every stream.
+            Defaults to None.
+
+        Returns:
+            List[CachedFrame]: The frames oldest first
+        """
+        return [frame for frame in self._frames.values()
+                if frame.timestamp >= timestamp and stream in (None, frame.stream)]
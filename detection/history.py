@@ -0,0 +1,210 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Bounded in-memory history of the published detections
+"""
+
+import threading
+
+import numpy as np
+
+HISTORY_DTYPE = np.dtype([("timestamp", np.float64), ("label", np.int32),
+                          ("search", np.int32), ("track_id", np.int64),
+                          ("score", np.float32), ("box", np.float32, (4,))])
+
+
+class _StreamHistory:
+    """
+    Ring of detection rows of a single stream, preallocated with a fixed
+    capacity and sorted by timestamp
+    """
+
+    def __init__(self, sensor_id, capacity):
+        self.sensor_id = sensor_id
+        self.rows = np.zeros(capacity, HISTORY_DTYPE)
+        self.start = 0
+        self.count = 0
+        self.last_timestamp = -np.inf
+
+    def append(self, rows):
+        """
+        Add rows after the newest ones, overwriting the oldest when full
+
+        Args:
+            rows (np.ndarray): rows of HISTORY_DTYPE, oldest first
+        """
+        capacity = len(self.rows)
+        if len(rows) > capacity:
+            rows = rows[-capacity:]
+
+        end = (self.start + self.count) % capacity
+        first = min(len(rows), capacity - end)
+        self.rows[end:end + first] = rows[:first]
+        self.rows[:len(rows) - first] = rows[first:]
+
+        overflow = self.count + len(rows) - capacity
+        if overflow > 0:
+            self.start = (self.start + overflow) % capacity
+        self.count = min(self.count + len(rows), capacity)
+
+    def segments(self):
+        """
+        The rows oldest first as at most two contiguous views
+        """
+        end = self.start + self.count
+        if end <= len(self.rows):
+            return [self.rows[self.start:end]]
+
+        return [self.rows[self.start:], self.rows[:end - len(self.rows)]]
+
+
+class DetectionHistory:
+    """
+    Rolling history of the detections published for each stream, kept in
+    preallocated NumPy structured arrays so the memory used is fixed no
+    matter how long the service runs. Once a stream history is full the
+    oldest detections are overwritten.
+
+    Labels and search names are stored as indexes in a table shared by
+    every stream, and the rows are kept sorted by timestamp, so a time range
+    is found with a binary search and filtered without leaving NumPy.
+    """
+
+    def __init__(self, size: int = 100000):
+        """
+        Args:
+            size (int, optional): Maximum amount of detections kept for each
+            stream. Defaults to 100000.
+        """
+        if size < 1:
+            raise ValueError("The detection history needs room for at least one detection")
+
+        self._size = size
+        self._streams = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _index(self, name):
+        index = self._names.get(name)
+        if index is None:
+            index = len(self._names)
+            self._names[name] = index
+
+        return index
+
+    def add(self, stream, sensor_id, timestamp, search, text_labels, scores, bboxes,
+            track_ids=None):
+        """
+        Keep the detections of a published message
+
+        Args:
+            stream (str): VST sensor name
+            sensor_id (str): VST sensor id
+            timestamp (float): capture time in seconds since the epoch
+            search (str): name of the search the detections belong to
+            text_labels (List[str]): detections labels
+            scores (List[float]): detections scores
+            bboxes (List[List[float]]): detections x0, y0, x1, y1 boxes
+            track_ids (List[int], optional): detections track ids. Defaults to None.
+        """
+        if not text_labels:
+            return
+
+        rows = np.zeros(len(text_labels), HISTORY_DTYPE)
+        rows["score"] = scores
+        rows["box"] = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        rows["track_id"] = -1 if track_ids is None else track_ids
+
+        with self._lock:
+            history = self._streams.get(stream)
+            if history is None:
+                history = _StreamHistory(sensor_id, self._size)
+                self._streams[stream] = history
+
+            # The wall clock may step back, keep the rows sorted for the binary search
+            timestamp = max(timestamp, history.last_timestamp)
+            history.last_timestamp = timestamp
+            history.sensor_id = sensor_id
+
+            rows["timestamp"] = timestamp
+            rows["label"] = [self._index(label) for label in text_labels]
+            rows["search"] = self._index(search)
+            history.append(rows)
+
+    def streams(self):
+        """
+        Get the streams with history
+
+        Returns:
+            List[str]: The VST sensor names
+        """
+        with self._lock:
+            return list(self._streams)
+
+    def query(self, stream, start=None, end=None, labels=None, search=None, limit=None):
+        """
+        Get the detections of a stream in a time range
+
+        Args:
+            stream (str): VST sensor name
+            start (float, optional): oldest capture time in seconds since the
+            epoch, the start of the history if None. Defaults to None.
+            end (float, optional): newest capture time in seconds since the
+            epoch, the end of the history if None. Defaults to None.
+            labels (List[str], optional): only the detections with these labels,
+            or every label if None. Defaults to None.
+            search (str, optional): only the detections of this search, or every
+            search if None. Defaults to None.
+            limit (int, optional): maximum amount of detections, the newest are
+            returned. Defaults to None.
+
+        Returns:
+            dict: The stream, its sensor id and the timestamps, labels, searches,
+            scores, bboxes and track ids of the detections oldest first, or None
+            if the stream has no history
+        """
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        with self._lock:
+            history = self._streams.get(stream)
+            if history is None:
+                return None
+
+            selected = []
+            for segment in history.segments():
+                timestamps = segment["timestamp"]
+                first = np.searchsorted(timestamps, start, side="left")
+                last = np.searchsorted(timestamps, end, side="right")
+                if first < last:
+                    selected.append(segment[first:last])
+
+            # Copy while locked, the rows may be overwritten afterwards
+            rows = np.concatenate(selected) if selected else np.zeros(0, HISTORY_DTYPE)
+            names = list(self._names)
+            label_ids = [self._names[label] for label in labels or [] if label in self._names]
+            search_id = self._names.get(search)
+            sensor_id = history.sensor_id
+
+        if labels is not None:
+            rows = rows[np.isin(rows["label"], label_ids)]
+        if search is not None:
+            rows = rows[rows["search"] == search_id] if search_id is not None else rows[:0]
+        if limit is not None:
+            rows = rows[len(rows) - min(limit, len(rows)):]
+
+        return {"stream": stream, "sensor_id": sensor_id,
+                "timestamps": rows["timestamp"].tolist(),
+                "labels": [names[label] for label in rows["label"].tolist()],
+                "searches": [names[index] for index in rows["search"].tolist()],
+                "scores": rows["score"].tolist(),
+                "bboxes": rows["box"].tolist(),
+                "track_ids": rows["track_id"].tolist()}
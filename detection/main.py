@@ -16,10 +16,11 @@ import logging
 from queue import Queue
 from threading import Thread
 
-from detection.controllers.searchcontroller import SearchController
-from detection.controllers.sourcecontroller import SourceController
-from detection.detection import Detection
-from detection.server import Server
+from detection.broadcaster import SLOW_CLIENT_POLICIES
+from detection.pipeline import parse_size
+from detection.publisher import POLICIES
+from detection.quality import DEFAULT_ENGINE_DIR, DEFAULT_MODEL, MODELS, parse_tier
+from detection.roi import parse_regions
 
 logger = logging.getLogger("detection")
 
@@ -34,6 +35,40 @@ def list_of_floats(arg):
     return list(map(float, arg.split(',')))
 
 
+def size(arg):
+    """ Define a custom argument type for a WIDTHxHEIGHT size """
+    try:
+        return parse_size(arg)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def dict_of_sizes(arg):
+    """ Define a custom argument type for a list of name=WIDTHxHEIGHT sizes """
+    sizes = {}
+    for item in arg.split(','):
+        name, _, value = item.partition('=')
+        sizes[name.strip()] = size(value)
+    return sizes
+
+
+def stream_regions(arg):
+    """ Define a custom argument type for the regions of interest of a stream """
+    name, _, regions = arg.rpartition('=')
+    try:
+        return name.strip() or None, parse_regions(regions)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def quality_tier(arg):
+    """ Define a custom argument type for the settings of a quality tier """
+    try:
+        return parse_tier(arg)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
 def parse_args():
     """ Parse arguments """
     parser = argparse.ArgumentParser()
@@ -41,6 +76,13 @@ def parse_args():
                         help="Port for server")
     parser.add_argument("--host", type=str, default='127.0.0.1',
                         help="Server ip address")
+    parser.add_argument("--server", type=str, default="flask", choices=["flask", "async"],
+                        help="Serve the API with the Flask threaded server or an async server, the async server "
+                        "requires uvicorn and asgiref and also streams the live detections over WebSocket")
+    parser.add_argument("--live-buffer-size", type=int, default=32,
+                        help="Amount of recent messages kept for the live detections clients")
+    parser.add_argument("--slow-clients", type=str, default="coalesce", choices=SLOW_CLIENT_POLICIES,
+                        help="Skip the messages a slow live detections client fell behind on, or disconnect it")
     parser.add_argument("--objects", type=list_of_strings, default=None,
                         help="List of objects to detect, example: 'a person,a box,a ball'")
     parser.add_argument("--thresholds", type=list_of_floats, default=None,
@@ -49,6 +91,104 @@ def parse_args():
                         help="Divide the image in given amount of vertical slices to detect small objects")
     parser.add_argument("--horizontal-slices", type=int, default=1,
                         help="Divide the image in given amount of horizontal slices to detect small objects")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Capture, detect and publish in separate stages, always detecting on the newest frame")
+    parser.add_argument("--buffer-size", type=int, default=2,
+                        help="Amount of frames kept by the capture ring buffer in pipelined mode")
+    parser.add_argument("--streams", type=list_of_strings, default=None,
+                        help="List of VST streams to process at once, example: 'camera1,camera2'")
+    parser.add_argument("--max-batch-size", type=int, default=1,
+                        help="Maximum amount of frames encoded at once by the model engine")
+    parser.add_argument("--slicing-backend", type=str, default="native", choices=["native", "sahi"],
+                        help="Detect on the image slices in a single batched pass (native) or one by one with SAHI")
+    parser.add_argument("--slicing", type=str, default="fixed", choices=["fixed", "adaptive"],
+                        help="Use the fixed slices grid or choose the grid of each frame from the latency budget and "
+                        "the recent objects sizes, adaptive slicing is always native")
+    parser.add_argument("--latency-budget", type=float, default=0.1,
+                        help="Target seconds of inference per frame with adaptive slicing")
+    parser.add_argument("--max-grid", type=int, default=4,
+                        help="Maximum slices per side with adaptive slicing")
+    parser.add_argument("--min-object-size", type=float, default=24.0,
+                        help="Minimum pixels an object should span at the model input with adaptive slicing")
+    parser.add_argument("--prompt-cache-size", type=int, default=256,
+                        help="Maximum amount of prompt text encodings kept in cache")
+    parser.add_argument("--prompt-cache", type=str, default=None,
+                        help="File to save the prompt text encodings cache and load it on startup")
+    parser.add_argument("--publish-queue-size", type=int, default=64,
+                        help="Maximum amount of messages waiting to be published to redis")
+    parser.add_argument("--publish-policy", type=str, default="drop-oldest", choices=POLICIES,
+                        help="What to do when the publish queue is full")
+    parser.add_argument("--publish-batch-size", type=int, default=8,
+                        help="Maximum amount of messages published to redis in a single round trip")
+    parser.add_argument("--publish-mode", type=str, default="full", choices=["full", "delta"],
+                        help="Publish the detections of every frame or only when they change")
+    parser.add_argument("--delta-iou", type=float, default=0.9,
+                        help="Minimum IoU with the published box to consider a box unchanged in delta mode")
+    parser.add_argument("--delta-pixels", type=float, default=8.0,
+                        help="Maximum pixels a box may move to consider it unchanged in delta mode")
+    parser.add_argument("--keyframe-interval", type=float, default=10.0,
+                        help="Seconds between keyframes with all the detections in delta mode")
+    parser.add_argument("--motion-threshold", type=float, default=None,
+                        help="Only detect when the mean pixel change (0 to 1) since the last detected frame exceeds "
+                        "this threshold, disabled by default")
+    parser.add_argument("--motion-max-staleness", type=float, default=5.0,
+                        help="Maximum seconds without detecting when motion gating is enabled")
+    parser.add_argument("--motion-idle", type=str, default="republish", choices=["republish", "suppress"],
+                        help="Publish again or suppress the previous detections on frames skipped by motion gating")
+    parser.add_argument("--tracking", type=str, default=None, choices=["frames", "events"],
+                        help="Track the detections and publish the tracks every frame or only when they start, "
+                        "are updated or end, disabled by default")
+    parser.add_argument("--inference-interval", type=float, default=0.0,
+                        help="Minimum seconds between detections on each stream, tracks are predicted in between")
+    parser.add_argument("--inference-size", type=size, default=None,
+                        help="Maximum resolution the frames are downscaled to before detection, example: 1280x720. "
+                        "Boxes are reported in the original resolution, disabled by default")
+    parser.add_argument("--stream-inference-sizes", type=dict_of_sizes, default=None,
+                        help="Inference resolution of specific streams, example: 'camera1=1920x1080,camera2=640x360'")
+    parser.add_argument("--roi", type=stream_regions, action="append", default=None,
+                        help="Only detect inside these regions, in image pixels, as x0,y0,x1,y1 rectangles or "
+                        "x,y,x,y,x,y,... polygons separated by ';'. Prefix with the stream name to set the regions of "
+                        "a single stream, example: 'camera1=0,0,640,480;800,100,900,100,850,300'. Can be repeated")
+    parser.add_argument("--vst-cache-ttl", type=float, default=30.0,
+                        help="Seconds the VST streams list is cached before querying it again")
+    parser.add_argument("--tile-threshold", type=float, default=None,
+                        help="Enable the tile cache: mean absolute pixel difference, from 0 to 1, "
+                        "above which a slice is encoded again, example: 0.02")
+    parser.add_argument("--tile-max-staleness", type=float, default=5.0,
+                        help="Maximum seconds without encoding a slice when the tile cache is enabled")
+    parser.add_argument("--embedding-cache-size", type=int, default=0,
+                        help="Frames whose image embeddings are kept to query them with new "
+                        "prompts, 0 to disable the cache")
+    parser.add_argument("--embedding-cache-interval", type=float, default=1.0,
+                        help="Seconds between the frames of each stream kept in the embedding cache")
+    parser.add_argument("--history-size", type=int, default=100000,
+                        help="Detections of each stream kept in memory for the history queries, "
+                        "0 to disable the history")
+    parser.add_argument("--log-dir", type=str, default=None,
+                        help="Directory to write the columnar detection log segments to, disabled by default")
+    parser.add_argument("--log-segment-size", type=int, default=64,
+                        help="Megabytes after which a new columnar log segment is started")
+    parser.add_argument("--log-segment-seconds", type=float, default=3600.0,
+                        help="Seconds after which a new columnar log segment is started")
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="Run the inference and the capture of each stream in worker processes")
+    parser.add_argument("--ring-slots", type=int, default=4,
+                        help="Frames in the shared memory ring of each stream in multiprocess mode")
+    parser.add_argument("--ring-frame-size", type=size, default=(1920, 1080),
+                        help="Maximum WIDTHxHEIGHT of the frames in the shared memory rings, "
+                        "bigger frames are downscaled")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, choices=list(MODELS),
+                        help="Detection model, it can be changed at runtime through the API")
+    parser.add_argument("--engine-dir", type=str, default=DEFAULT_ENGINE_DIR,
+                        help="Directory with the TensorRT image encoder engine of each model")
+    parser.add_argument("--latency-target", type=float, default=None,
+                        help="Seconds from capture to inference to keep the frames under by lowering the "
+                        "detection quality under load, disabled by default")
+    parser.add_argument("--quality-tier", type=quality_tier, action="append", default=None,
+                        help="Settings changed by the next lower quality tier, example: "
+                        "'slices=2x2,scale=0.5,model=owlvit-base-patch32,skip=2'. Can be repeated, by default "
+                        "the slices are halved, then the inference size is scaled down, then lighter models "
+                        "are used and then frames are skipped")
 
     args = parser.parse_args()
 
@@ -62,21 +202,130 @@ def main():
     args = parse_args()
     logging.basicConfig(level=logging.INFO)
 
+    # Imported once the arguments are parsed so --help does not load the server
+    # and detection dependencies
+    from detection.broadcaster import Broadcaster
+    from detection.columnarlog import ColumnarLog
+    from detection.controllers.detectionscontroller import DetectionsController
+    from detection.controllers.historycontroller import HistoryController
+    from detection.controllers.metricscontroller import MetricsController
+    from detection.controllers.modelcontroller import ModelController
+    from detection.controllers.querycontroller import QueryController
+    from detection.controllers.readycontroller import ReadyController
+    from detection.controllers.roicontroller import RoiController
+    from detection.controllers.searchcontroller import SearchController
+    from detection.controllers.sourcecontroller import SourceController
+    from detection.controllers.streamscontroller import StreamsController
+    from detection.deltafilter import DeltaConfig
+    from detection.detection import Detection
+    from detection.embeddings import EmbeddingConfig
+    from detection.history import DetectionHistory
+    from detection.metrics import Metrics
+    from detection.motiongate import MotionConfig
+    from detection.pipeline import PipelineConfig
+    from detection.publisher import PublishConfig
+    from detection.quality import ModelConfig, QualityConfig, QualityStatus
+    from detection.server import Server
+    from detection.slicing import SlicingConfig
+    from detection.startup import Startup
+    from detection.tiles import TileConfig
+
     controllers = []
     search_queue = Queue()
     source_queue = Queue()
+    stream_queue = Queue()
+    roi_queue = Queue()
+    query_queue = Queue()
+    model_queue = Queue()
     controllers.append(SearchController(search_queue))
     controllers.append(SourceController(source_queue))
+    metrics = Metrics()
+    controllers.append(StreamsController(stream_queue))
+    controllers.append(RoiController(roi_queue))
+    controllers.append(QueryController(query_queue))
+    quality_status = QualityStatus()
+    controllers.append(ModelController(model_queue, quality_status))
+    controllers.append(MetricsController(metrics))
+    startup = Startup()
+    controllers.append(ReadyController(startup))
+    recorders = []
+    if args.history_size > 0:
+        history = DetectionHistory(args.history_size)
+        recorders.append(history)
+        controllers.append(HistoryController(history))
+    log = None
+    if args.log_dir:
+        log = ColumnarLog(args.log_dir, args.log_segment_size * 1024 * 1024,
+                          args.log_segment_seconds, metrics=metrics)
+        recorders.append(log)
+    broadcaster = Broadcaster(args.live_buffer_size, args.slow_clients, metrics)
+    controllers.append(DetectionsController(broadcaster))
+
+    if args.server == "async":
+        from detection.asyncserver import AsyncServer
 
-    logger.info("Launch flask server")
-    server = Server(controllers, host=args.host, port=args.port)
+        logger.info("Launch async server")
+        server = AsyncServer(controllers, host=args.host, port=args.port,
+                             broadcaster=broadcaster)
+    else:
+        logger.info("Launch flask server")
+        server = Server(controllers, host=args.host, port=args.port)
     server_thread = Thread(target=server.start, daemon=True)
     server_thread.start()
 
-    detection = Detection(search_queue, source_queue, objects=args.objects,
-                          thresholds=args.thresholds, vertical_slices=args.vertical_slices,
-                          horizontal_slices=args.horizontal_slices)
-    detection.loop()
+    options = dict(
+        objects=args.objects, thresholds=args.thresholds,
+        vertical_slices=args.vertical_slices, horizontal_slices=args.horizontal_slices,
+        streams=args.streams, rois=dict(args.roi or []), tracking=args.tracking,
+        vst_cache_ttl=args.vst_cache_ttl,
+        pipeline=PipelineConfig(pipelined=args.pipelined, buffer_size=args.buffer_size,
+                                max_batch_size=args.max_batch_size,
+                                inference_interval=args.inference_interval,
+                                inference_size=args.inference_size,
+                                stream_inference_sizes=args.stream_inference_sizes),
+        publish=PublishConfig(queue_size=args.publish_queue_size, policy=args.publish_policy,
+                              batch_size=args.publish_batch_size),
+        delta=DeltaConfig(mode=args.publish_mode, iou=args.delta_iou, pixels=args.delta_pixels,
+                          keyframe_interval=args.keyframe_interval),
+        motion=MotionConfig(threshold=args.motion_threshold,
+                            max_staleness=args.motion_max_staleness, idle=args.motion_idle),
+        slicing=SlicingConfig(backend=args.slicing_backend, mode=args.slicing,
+                              latency_budget=args.latency_budget, max_grid=args.max_grid,
+                              min_object_size=args.min_object_size),
+        tiles=TileConfig(threshold=args.tile_threshold, max_staleness=args.tile_max_staleness),
+        embeddings=EmbeddingConfig(size=args.embedding_cache_size,
+                                   interval=args.embedding_cache_interval),
+        model=ModelConfig(name=args.model, engine_dir=args.engine_dir,
+                          prompt_cache_size=args.prompt_cache_size,
+                          prompt_cache_path=args.prompt_cache),
+        quality=QualityConfig(latency_target=args.latency_target, tiers=args.quality_tier))
+
+    if args.multiprocess:
+        from detection.workers import InferenceSupervisor
+
+        logger.info("Run inference in a worker process")
+        detection = InferenceSupervisor(search_queue, source_queue,
+                                        stream_queue=stream_queue, roi_queue=roi_queue,
+                                        query_queue=query_queue, model_queue=model_queue,
+                                        quality_status=quality_status,
+                                        broadcaster=broadcaster, recorders=recorders,
+                                        startup=startup, metrics=metrics,
+                                        ring_slots=args.ring_slots,
+                                        ring_frame_size=args.ring_frame_size, **options)
+    else:
+        detection = Detection(search_queue, source_queue, stream_queue=stream_queue,
+                              roi_queue=roi_queue, query_queue=query_queue,
+                              model_queue=model_queue, quality_status=quality_status,
+                              broadcaster=broadcaster, recorders=recorders,
+                              startup=startup, metrics=metrics, **options)
+
+    if log is not None:
+        log.start()
+    try:
+        detection.loop()
+    finally:
+        if log is not None:
+            log.stop()
 
 
 if __name__ == "__main__":
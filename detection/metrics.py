@@ -0,0 +1,363 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Pipeline metrics in Prometheus text format
+"""
+
+import bisect
+import time
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def timer(metrics, stage):
+    """
+    Time a stage if metrics are enabled
+
+    Args:
+        metrics (Metrics): metrics registry or None to disable the timing
+        stage (str): stage name
+
+    Returns:
+        ContextManager: A context manager that times its block
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.timer(stage)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def snapshot(self):
+        """
+        Get a copy of the metric definition and values, to send them to
+        another process
+
+        Returns:
+            dict: The metric kind, documentation, label names, buckets and values
+        """
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value
+                      for key, value in self._values.items()}
+        return {"kind": self.kind, "documentation": self.documentation,
+                "labels": self.label_names, "buckets": getattr(self, "buckets", None),
+                "values": values}
+
+    def _combine(self, value, other):
+        return value + other
+
+    def render(self, remote_values=()):
+        """
+        Render the metric in Prometheus text format
+
+        Args:
+            remote_values (List[dict], optional): values of the same metric from
+            other processes, combined with the local ones. Defaults to none.
+
+        Returns:
+            List[str]: The metric lines
+        """
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = dict(self._values)
+        for remote in remote_values:
+            for key, value in remote.items():
+                values[key] = self._combine(values[key], value) if key in values else value
+
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing counter
+    """
+    kind = "counter"
+
+    def value(self, **labels):
+        """
+        Get the counter value
+
+        Args:
+            labels: label values
+
+        Returns:
+            int: The current count
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter
+
+        Args:
+            amount (int, optional): Amount to increase. Defaults to 1.
+            labels: label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down
+    """
+    kind = "gauge"
+
+    def _combine(self, value, other):
+        return other
+
+    def set(self, value, **labels):
+        """
+        Set the gauge value
+
+        Args:
+            value (float): the new value
+            labels: label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = list(buckets or LATENCY_BUCKETS)
+
+    def observe(self, value, **labels):
+        """
+        Add an observation
+
+        Args:
+            value (float): observed value
+            labels: label values
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Bucket counts plus the +Inf bucket, then the sum
+                counts = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[key] = counts
+            counts[index] += 1
+            counts[-1] += value
+
+    def _combine(self, value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def totals(self):
+        """
+        Get the amount and sum of the observations for each label values
+
+        Returns:
+            Dict[Tuple[str], Tuple[int, float]]: The count and sum of the
+            observations by label values
+        """
+        with self._lock:
+            return {key: (sum(value[:-1]), value[-1])
+                    for key, value in self._values.items()}
+
+    def _render_value(self, key, value):
+        lines = []
+        cumulative = 0
+        bounds = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, value[:-1]):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {value[-1]}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    Registry of the detection pipeline metrics
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._remote = {}
+        self._lock = Lock()
+
+        self.stage_seconds = self.histogram(
+            "detection_stage_seconds", "Time spent on each pipeline stage", ["stage"])
+        self.end_to_end_seconds = self.histogram(
+            "detection_end_to_end_seconds", "Time from frame capture to detections published")
+        self.frames = self.counter(
+            "detection_frames_total", "Frames processed on each pipeline step", ["step"])
+        self.capture_timeouts = self.counter(
+            "detection_capture_timeouts_total", "Capture timeouts", ["stream"])
+        self.detections = self.histogram(
+            "detection_objects_per_frame", "Detections on each inferred frame",
+            buckets=COUNT_BUCKETS)
+        self.publish_queue_depth = self.gauge(
+            "detection_publish_queue_depth", "Messages waiting to be published")
+        self.publish_messages = self.counter(
+            "detection_publish_messages_total",
+            "Messages published to redis or dropped on a full queue or failed send", ["result"])
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Get or create a counter
+
+        Args:
+            name (str): metric name
+            documentation (str): metric description
+            labels (List[str], optional): label names. Defaults to none.
+
+        Returns:
+            Counter: The registered counter
+        """
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        """
+        Get or create a gauge
+
+        Args:
+            name (str): metric name
+            documentation (str): metric description
+            labels (List[str], optional): label names. Defaults to none.
+
+        Returns:
+            Gauge: The registered gauge
+        """
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        """
+        Get or create a histogram
+
+        Args:
+            name (str): metric name
+            documentation (str): metric description
+            labels (List[str], optional): label names. Defaults to none.
+            buckets (List[float], optional): bucket upper bounds. Defaults to
+            latency buckets.
+
+        Returns:
+            Histogram: The registered histogram
+        """
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time a block of code as a pipeline stage
+
+        Args:
+            stage (str): stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(
+                time.perf_counter() - start, stage=stage)
+
+    def snapshot(self):
+        """
+        Get a copy of all the metrics, to send them to another process
+
+        Returns:
+            Dict[str, dict]: The snapshot of each metric by name
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def merge_remote(self, source, snapshot):
+        """
+        Replace the metrics reported by another process, they are rendered
+        combined with the local metrics of the same name
+
+        Args:
+            source (str): name of the reporting process
+            snapshot (Dict[str, dict]): the process metrics snapshot
+        """
+        for name, metric in snapshot.items():
+            if metric["kind"] == "histogram":
+                self.histogram(name, metric["documentation"], metric["labels"],
+                               metric["buckets"])
+            elif metric["kind"] == "gauge":
+                self.gauge(name, metric["documentation"], metric["labels"])
+            else:
+                self.counter(name, metric["documentation"], metric["labels"])
+
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def render(self):
+        """
+        Render all the metrics in Prometheus text format
+
+        Returns:
+            str: The metrics exposition
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            remotes = list(self._remote.values())
+
+        lines = []
+        for metric in metrics:
+            remote_values = [remote[metric.name]["values"] for remote in remotes
+                             if metric.name in remote]
+            lines.extend(metric.render(remote_values))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,112 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Motion gating to skip inference on static frames
+"""
+
+import logging
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger("detection")
+
+
+class MotionConfig(NamedTuple):
+    """
+    Motion gating settings, the gating is disabled without a threshold. Frames
+    that did not change since the last frame the model ran on skip the model,
+    and the previous detections are published again or suppressed depending
+    on the idle policy
+    """
+    threshold: Optional[float] = None
+    max_staleness: float = 5.0
+    idle: str = "republish"
+
+
+def downscale_gray(image, step):
+    """
+    Get a cheap downscaled grayscale copy of an image by sampling
+    every step pixels
+
+    Args:
+        image (Union[np.ndarray, cudaImage]): HWC image
+        step (int): sampling step in both directions
+
+    Returns:
+        np.ndarray: The downscaled image as float32 in the 0 to 1 range
+    """
+    small = np.asarray(image)[::step, ::step]
+    if small.ndim == 3:
+        small = small.mean(axis=2, dtype=np.float32)
+
+    return small.astype(np.float32) / 255.0
+
+
+class MotionGate:
+    """
+    Decide whether a frame must go through the model by comparing a
+    downscaled copy against the last frame the model ran on
+    """
+
+    def __init__(self, threshold: float = 0.02, max_staleness: float = 5.0,
+                 step: int = 16):
+        """
+        Args:
+            threshold (float, optional): Mean absolute pixel difference, in the
+            0 to 1 range, above which the scene is considered changed. Defaults to 0.02.
+            max_staleness (float, optional): Maximum seconds without running the
+            model. Defaults to 5.0.
+            step (int, optional): Pixel sampling step used to downscale the
+            frames. Defaults to 16.
+        """
+        self._threshold = threshold
+        self._max_staleness = max_staleness
+        self._step = step
+        self._reference = None
+        self._reference_time = 0.0
+        self.skipped = 0
+
+    def reset(self):
+        """
+        Forget the reference frame so the next frame goes through the model
+        """
+        self._reference = None
+
+    def check(self, image, timestamp: float):
+        """
+        Check whether the model should run on the frame, if so the frame
+        becomes the new reference
+
+        Args:
+            image (Union[np.ndarray, cudaImage]): captured image
+            timestamp (float): capture time in seconds
+
+        Returns:
+            bool: True if the scene changed past the threshold or the
+            maximum staleness expired
+        """
+        small = downscale_gray(image, self._step)
+
+        changed = (self._reference is None
+                   or self._reference.shape != small.shape
+                   or timestamp - self._reference_time >= self._max_staleness)
+        if not changed:
+            change = float(np.abs(small - self._reference).mean())
+            changed = change > self._threshold
+
+        if changed:
+            self._reference = small
+            self._reference_time = timestamp
+        else:
+            self.skipped += 1
+
+        return changed
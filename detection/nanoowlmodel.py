@@ -12,28 +12,146 @@
 NanoOwl model
 """
 
-from typing import List, Optional
+from typing import Any, List, NamedTuple, Optional
 
-import numpy as np
-from nanoowl.owl_predictor import OwlPredictor
-from PIL import Image
+import torch
+from nanoowl.owl_predictor import OwlEncodeImageOutput, OwlPredictor
 from sahi.models.base import DetectionModel
 from sahi.prediction import ObjectPrediction
 
+from detection.metrics import timer
+from detection.predictions import Predictions
+from detection.preprocess import FramePreprocessor
+from detection.promptcache import PromptCache
+from detection.slicing import get_slice_rois
+
+# Cached frames decoded at once by a query
+DECODE_BATCH = 32
+
+
+def _box_roi_to_global(boxes, rois):
+    """
+    Map boxes normalized to their region of interest to image coordinates
+    """
+    x0y0 = rois[..., :2]
+    x1y1 = rois[..., 2:]
+    wh = (x1y1 - x0y0).repeat(1, 1, 2)
+    x0y0 = x0y0.repeat(1, 1, 2)
+    return (boxes * wh) + x0y0
+
+
+class ImageEmbeddings(NamedTuple):
+    """
+    Image encoder output of a frame, with what the decoder needs. Frames
+    encoded as several regions have one input per region, and their
+    detections are merged after decoding
+    """
+    output: Any
+    merge: bool
+
+    @property
+    def inputs(self):
+        """
+        Amount of encoded images or regions
+        """
+        return self.output.pred_boxes.shape[0]
+
+    @classmethod
+    def concatenate(cls, items, merge):
+        """
+        Join the embeddings of several images or regions
+
+        Args:
+            items (List[ImageEmbeddings]): embeddings on the same device
+            merge (bool): the joined inputs are regions of a single image
+
+        Returns:
+            ImageEmbeddings: The joined embeddings
+        """
+        output = OwlEncodeImageOutput(
+            image_embeds=None,
+            image_class_embeds=torch.cat([item.output.image_class_embeds for item in items]),
+            logit_shift=torch.cat([item.output.logit_shift for item in items]),
+            logit_scale=torch.cat([item.output.logit_scale for item in items]),
+            pred_boxes=torch.cat([item.output.pred_boxes for item in items]))
+        return cls(output, merge)
+
+    def select(self, index):
+        """
+        Get the embeddings of one input, without copying them
+
+        Args:
+            index (int): index of the image or region
+
+        Returns:
+            ImageEmbeddings: The input embeddings
+        """
+        output = self.output
+        return ImageEmbeddings(OwlEncodeImageOutput(
+            image_embeds=None,
+            image_class_embeds=output.image_class_embeds[index:index + 1],
+            logit_shift=output.logit_shift[index:index + 1],
+            logit_scale=output.logit_scale[index:index + 1],
+            pred_boxes=output.pred_boxes[index:index + 1]), False)
+
+    def to(self, device, dtype=torch.float32):
+        """
+        Move the embeddings to a device, the boxes are kept in single precision
+
+        Args:
+            device (Union[str, torch.device]): target device
+            dtype (torch.dtype, optional): target type of the embeddings.
+            Defaults to float32.
+
+        Returns:
+            ImageEmbeddings: The moved embeddings
+        """
+        output = OwlEncodeImageOutput(
+            image_embeds=None,
+            image_class_embeds=self.output.image_class_embeds.to(device, dtype),
+            logit_shift=self.output.logit_shift.to(device, dtype),
+            logit_scale=self.output.logit_scale.to(device, dtype),
+            pred_boxes=self.output.pred_boxes.to(device, torch.float32))
+        return ImageEmbeddings(output, self.merge)
+
+    def to_host(self):
+        """
+        Copy the embeddings to host in half precision
+
+        Returns:
+            ImageEmbeddings: The host embeddings
+        """
+        return self.to("cpu", torch.float16)
+
 
 class NanoOwlModel(DetectionModel):
     """
     NanoOwl detection model for SAHI
     """
 
-    def __init__(self, model_name: str, model_engine: str = None, **kwargs):
+    def __init__(self, model_name: str, model_engine: str = None,
+                 max_batch_size: int = 1, prompt_cache_size: int = 256,
+                 prompt_cache_path: str = None, metrics=None,
+                 model_device: str = "cuda", **kwargs):
         self.model_name = model_name
+        self.model_device = model_device
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.prompt_cache_size = prompt_cache_size
+        self.prompt_cache_path = prompt_cache_path
+        self.prompt_cache = None
+        self.preprocessor = None
         self.model = None
         self.objects = None
         self.objects_encoding = None
         self.objects_threshold = None
         self._original_predictions = None
         self._object_prediction_list_per_image = None
+        self._last_embeddings = None
+        self._last_tiles = None
+        self.prompt_version = 0
+        # The engine is loaded once by load_model, not by SAHI on construction
+        kwargs.setdefault("load_at_init", False)
         super().__init__(model_path=model_engine, **kwargs)
 
     def set_detection_objects(self, objects, thresholds):
@@ -45,8 +163,10 @@ class NanoOwlModel(DetectionModel):
           threshold: score threshold's array corresponding to the objects
         """
         self.objects = objects
-        self.objects_encoding = self.model.encode_text(objects)
+        self.objects_encoding = self.prompt_cache.encode(
+            objects, self.model.encode_text)
         self.objects_threshold = thresholds
+        self.prompt_version += 1
 
     def load_model(self):
         """
@@ -55,49 +175,313 @@ class NanoOwlModel(DetectionModel):
         try:
             self.model = OwlPredictor(
                 self.model_name,
-                image_encoder_engine=self.model_path
+                device=self.model_device,
+                image_encoder_engine=self.model_path,
+                image_encoder_engine_max_batch_size=self.max_batch_size
             )
+            self.prompt_cache = PromptCache(self.prompt_cache_size,
+                                            self.prompt_cache_path,
+                                            device=self.model.device)
+            self.preprocessor = FramePreprocessor(
+                self.model.get_image_size(),
+                self.model.image_preprocessor.mean,
+                self.model.image_preprocessor.std,
+                self.model.device)
 
         except Exception as e:
             raise TypeError("Load model failed.", e) from e
 
+    def _encode_timed(self, encode, *args, **kwargs):
+        """
+        Run the image encoder, waiting for the device to finish
+        when timing so the encoder time is not accounted later
+        """
+        with timer(self.metrics, "encode"):
+            output = encode(*args, **kwargs)
+            if self.metrics is not None and torch.cuda.is_available():
+                torch.cuda.synchronize()
+
+        return output
+
+    def perform_batch_inference(self, images):
+        """
+        Object detection is performed over several images in a single
+        batched image encoder pass.
+
+        Args:
+            images(List[Union[np.ndarray, PIL.Image, cudaImage]]):
+                The images to be predicted.
+
+        Returns:
+            List[Predictions]: The prediction for each image with the
+            boxes in the image coordinates
+        """
+        with timer(self.metrics, "preprocess"):
+            inputs, rois = self.preprocessor.letterbox(images)
+
+        # Encode every image at once and decode against the current prompt
+        image_output = self._encode_timed(self.model.encode_image, inputs)
+        with timer(self.metrics, "decode"):
+            image_output.pred_boxes = _box_roi_to_global(
+                image_output.pred_boxes, rois[:, None, :])
+            output = self.model.decode(
+                image_output, self.objects_encoding, self.objects_threshold)
+            predictions = Predictions.from_owl(output)
+        self._last_embeddings = ImageEmbeddings(image_output, False)
+        self._last_tiles = None
+
+        # Split the results back for each image
+        return predictions.split(len(images))
+
+    def perform_sliced_inference(self, image, slice_size, overlap_ratio=0.2,
+                                 iou_threshold=0.5, full_frame=True, tiles=None):
+        """
+        Object detection is performed over an overlapping grid of slices of
+        the image. The slices are cropped from a single preprocessed image
+        and encoded in one batched image encoder pass, then the results of all
+        the slices are copied to host at once and merged with a class aware
+        non maximum suppression.
+
+        With a tile cache, only the slices whose pixels changed since they
+        were last encoded go through the image encoder, and the cached
+        results of the rest are merged with them.
+
+        Args:
+            image(Union[np.ndarray, PIL.Image, cudaImage]):
+                The image to be predicted.
+            slice_size(Tuple[int, int]): slice width and height
+            overlap_ratio(float, optional): fraction of the slice overlapping with
+            the neighbour slices. Defaults to 0.2.
+            iou_threshold(float, optional): IoU threshold used to merge the
+            detections of overlapping slices. Defaults to 0.5.
+            full_frame(bool, optional): detect on the whole image too, to keep the
+            objects bigger than a slice. Defaults to True.
+            tiles(TileCache, optional): cached slices of the previous frames of
+            the stream. Defaults to None to encode every slice.
+
+        Returns:
+            Predictions: The merged prediction with the boxes in the image
+            coordinates and the index of the slice as input index
+        """
+        with timer(self.metrics, "preprocess"):
+            image_tensor = self.preprocessor.normalize(image)
+            image_size = [image_tensor.shape[3], image_tensor.shape[2]]
+            rois = get_slice_rois(image_size, slice_size, overlap_ratio)
+            if full_frame and len(rois) > 1:
+                rois.append([0, 0, image_size[0], image_size[1]])
+
+        if tiles is None:
+            return self._detect_rois(image_tensor, rois, iou_threshold)
+
+        return self._detect_changed_rois(image_tensor, rois, iou_threshold, tiles)
+
+    def _detect_changed_rois(self, image_tensor, rois, iou_threshold, tiles):
+        """
+        Detect on the regions of a preprocessed image that changed since they
+        were last encoded, and merge their detections with the cached ones of
+        the unchanged regions
+        """
+        with timer(self.metrics, "preprocess"):
+            changed = tiles.changed(
+                self.preprocessor.thumbnail(image_tensor, tiles.step), rois)
+
+        if changed:
+            changed_rois = torch.tensor([rois[i] for i in changed], dtype=image_tensor.dtype,
+                                        device=image_tensor.device)
+            image_output = self._encode_timed(
+                self.model.encode_rois, image_tensor, changed_rois, pad_square=True)
+            encoded = ImageEmbeddings(image_output, False)
+            for index, tile in enumerate(changed):
+                tiles.embeddings[tile] = encoded.select(index)
+
+        # The cached detections are only valid for the prompt they were decoded with
+        decode = changed
+        if tiles.prompt_version != self.prompt_version:
+            decode = list(range(len(rois)))
+            tiles.prompt_version = self.prompt_version
+
+        if decode:
+            with timer(self.metrics, "decode"):
+                image_output = ImageEmbeddings.concatenate(
+                    [tiles.embeddings[tile] for tile in decode], False).output
+                output = self.model.decode(
+                    image_output, self.objects_encoding, self.objects_threshold)
+                predictions = Predictions.from_owl(output)
+
+            for tile, tile_predictions in zip(decode, predictions.split(len(decode))):
+                tile_predictions.inputs[:] = tile
+                tiles.predictions[tile] = tile_predictions
+
+        self._last_embeddings = None
+        self._last_tiles = list(tiles.embeddings)
+
+        with timer(self.metrics, "merge"):
+            return Predictions.concatenate(tiles.predictions).nms(iou_threshold)
+
+    def perform_region_inference(self, image, regions, slice_size=None,
+                                 overlap_ratio=0.2, iou_threshold=0.5):
+        """
+        Object detection is performed only over the given regions of the
+        image, cropped from a single preprocessed image and encoded in one
+        batched image encoder pass. Regions bigger than the slice size are
+        also split in an overlapping grid of slices.
+
+        Args:
+            image(Union[np.ndarray, PIL.Image, cudaImage]):
+                The image to be predicted.
+            regions(List[List[int]]): x0, y0, x1, y1 of each region
+            slice_size(Tuple[int, int], optional): slice width and height.
+            Defaults to None to detect on each whole region.
+            overlap_ratio(float, optional): fraction of the slice overlapping with
+            the neighbour slices. Defaults to 0.2.
+            iou_threshold(float, optional): IoU threshold used to merge the
+            detections of overlapping regions. Defaults to 0.5.
+
+        Returns:
+            Predictions: The merged prediction with the boxes in the image
+            coordinates and the index of the crop as input index
+        """
+        with timer(self.metrics, "preprocess"):
+            image_tensor = self.preprocessor.normalize(image)
+            rois = []
+            for x0, y0, x1, y1 in regions:
+                slices = [[x0, y0, x1, y1]]
+                if slice_size:
+                    slices = [[sx0 + x0, sy0 + y0, sx1 + x0, sy1 + y0] for sx0, sy0, sx1, sy1
+                              in get_slice_rois([x1 - x0, y1 - y0], slice_size, overlap_ratio)]
+                    if len(slices) > 1:
+                        slices.append([x0, y0, x1, y1])
+                rois.extend(slices)
+
+        return self._detect_rois(image_tensor, rois, iou_threshold)
+
+    def _detect_rois(self, image_tensor, rois, iou_threshold):
+        """
+        Detect on several regions of a preprocessed image at once and merge
+        the detections of overlapping regions
+        """
+        rois = torch.tensor(rois, dtype=image_tensor.dtype,
+                            device=image_tensor.device)
+
+        # Encode all the regions at once and decode against the current prompt
+        image_output = self._encode_timed(
+            self.model.encode_rois, image_tensor, rois, pad_square=True)
+        with timer(self.metrics, "decode"):
+            output = self.model.decode(
+                image_output, self.objects_encoding, self.objects_threshold)
+            predictions = Predictions.from_owl(output)
+
+        self._original_predictions = output
+        self._last_embeddings = ImageEmbeddings(image_output, len(rois) > 1)
+        self._last_tiles = None
+
+        with timer(self.metrics, "merge"):
+            return predictions.nms(iou_threshold)
+
     def perform_inference(self, image):
         """
         Object detection is performed over image and the prediction
         result is set to self._original_predictions.
 
         Args:
-            image(Union[np.ndarray, PIL.Image]
-                A numpy array or PIL.Image that contains the image to be predicted.
+            image(Union[np.ndarray, PIL.Image, cudaImage]
+                A numpy array, PIL.Image or cudaImage that contains the image to be predicted.
 
         """
 
-        if isinstance(image, np.ndarray):
-            if image.shape[0] < 5:  # image in CHW
-                image = image[:, :, ::-1]
-            image_pil = Image.fromarray(image)
-        else:
-            image_pil = image
+        with timer(self.metrics, "preprocess"):
+            inputs, rois = self.preprocessor.letterbox([image])
 
         # Run model prediction
-        output = self.model.predict(
-            image=image_pil,
-            text=self.objects,
-            text_encodings=self.objects_encoding,
-            threshold=self.objects_threshold,
-            pad_square=True
-        )
+        image_output = self._encode_timed(self.model.encode_image, inputs)
+        with timer(self.metrics, "decode"):
+            image_output.pred_boxes = _box_roi_to_global(
+                image_output.pred_boxes, rois[:, None, :])
+            output = self.model.decode(
+                image_output, self.objects_encoding, self.objects_threshold)
         self._original_predictions = output
 
+        # SAHI shifts the slices detections itself, so they are not reusable
+        self._last_embeddings = None
+        self._last_tiles = None
+
+    def last_embeddings(self, index=None):
+        """
+        Get the image embeddings of the last inference, without copying them
+
+        Args:
+            index (int, optional): image of the last batched inference, or None
+            for the last single image inference. Defaults to None.
+
+        Returns:
+            ImageEmbeddings: The image embeddings on the device or None if they
+            can not be decoded again
+        """
+        if self._last_tiles is not None:
+            return ImageEmbeddings.concatenate(self._last_tiles, True)
+
+        embeddings = self._last_embeddings
+        if embeddings is None or index is None:
+            return embeddings
+
+        return embeddings.select(index)
+
+    def decode_embeddings(self, embeddings, objects=None, thresholds=None,
+                          iou_threshold=0.5):
+        """
+        Detect on previously encoded images, running only the decoder
+
+        Args:
+            embeddings(List[ImageEmbeddings]): embeddings of each image
+            objects(List[str], optional): objects to detect. Defaults to the
+            current prompt.
+            thresholds(List[float], optional): score threshold of each object.
+            Defaults to the current prompt thresholds.
+            iou_threshold(float, optional): IoU threshold used to merge the
+            detections of the regions of an image. Defaults to 0.5.
+
+        Returns:
+            List[Predictions]: The prediction for each image with the boxes
+            in the model input coordinates
+        """
+        if objects is None:
+            text_output = self.objects_encoding
+            thresholds = self.objects_threshold
+        else:
+            text_output = self.prompt_cache.encode(objects, self.model.encode_text)
+
+        results = []
+        for start in range(0, len(embeddings), DECODE_BATCH):
+            batch = [item.to(self.model.device) for item in
+                     embeddings[start:start + DECODE_BATCH]]
+            image_output = ImageEmbeddings.concatenate(batch, False).output
+
+            with timer(self.metrics, "decode"):
+                output = self.model.decode(image_output, text_output, thresholds)
+                predictions = Predictions.from_owl(output)
+
+            offset = 0
+            for item in batch:
+                inputs = predictions.inputs
+                image_predictions = predictions.select(
+                    (inputs >= offset) & (inputs < offset + item.inputs))
+                if item.merge:
+                    image_predictions = image_predictions.nms(iou_threshold)
+                results.append(image_predictions)
+                offset += item.inputs
+
+        return results
+
     def _create_object_prediction_list_from_original_predictions(
             self,
             shift_amount_list: Optional[List[List[int]]] = None,
             full_shape_list: Optional[List[List[int]]] = None):
 
-        predictions = self._original_predictions
-        labels = predictions.labels
-        bboxes = predictions.boxes
-        scores = predictions.scores
+        # Copy all the boxes, scores and labels to host at once
+        predictions = Predictions.from_owl(self._original_predictions)
+        labels = predictions.labels.tolist()
+        bboxes = predictions.boxes.tolist()
+        scores = predictions.scores.tolist()
 
         if shift_amount_list is None:
             shift_amount_list = [[0, 0]]
@@ -106,8 +490,8 @@ class NanoOwlModel(DetectionModel):
         object_prediction_list = []
         for i, label in enumerate(labels):
             object_prediction = ObjectPrediction(
-                bbox=bboxes[i].cpu(),
-                category_id=int(label),
+                bbox=bboxes[i],
+                category_id=label,
                 category_name=self.objects[label],
                 shift_amount=shift_amount_list,
                 score=scores[i],
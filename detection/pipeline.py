@@ -0,0 +1,328 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Pipeline stages to decouple frame capture from inference
+"""
+
+import logging
+import sys
+import time
+from collections import deque
+from threading import Condition, Event, Thread
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("detection")
+
+
+class Frame(NamedTuple):
+    """
+    Captured frame with its capture timestamp
+    """
+    image: Any
+    timestamp: float
+
+
+class PipelineConfig(NamedTuple):
+    """
+    Frame capture and inference rate settings
+
+    In pipelined mode each stream is captured in its own thread into a
+    FrameBuffer and inference always takes the freshest frame, so slow
+    inference does not back up the video decoder. Several streams are always
+    captured this way. The frames of all the streams are batched into a single
+    model forward pass. With an inference size the frames are downscaled right
+    after capture and the detections are scaled back to the original size.
+    """
+    pipelined: bool = False
+    buffer_size: int = 2
+    max_batch_size: int = 1
+    inference_interval: float = 0.0
+    inference_size: Optional[Tuple[int, int]] = None
+    stream_inference_sizes: Optional[Dict[str, Tuple[int, int]]] = None
+
+
+def parse_size(text):
+    """
+    Parse an image size
+
+    Args:
+        text (str): size as WIDTHxHEIGHT, example: 1280x720
+
+    Returns:
+        Tuple[int, int]: The width and height
+    """
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError as e:
+        raise ValueError(f"Invalid size {text}, expected WIDTHxHEIGHT") from e
+
+    if width < 1 or height < 1:
+        raise ValueError(f"Invalid size {text}, expected WIDTHxHEIGHT")
+
+    return width, height
+
+
+def import_cv2():
+    """
+    Import OpenCV, needed to scale frames in host memory and read video files
+
+    Returns:
+        module: The cv2 module
+    """
+    try:
+        import cv2
+    except ImportError as e:
+        raise RuntimeError(
+            "Scaling frames in host memory and reading video files requires OpenCV, "
+            "install it with: pip install .[opencv], or use the JetPack python3-opencv "
+            "package") from e
+
+    return cv2
+
+
+class FrameScaler:
+    """
+    Downscale captured frames to the inference resolution.
+
+    Frames are fitted inside the inference size keeping their aspect ratio
+    and are never upscaled. CUDA frames are resized on the GPU into a pool
+    of preallocated images. An image is only reused once no frame refers to
+    it anymore, that is once the buffer dropped it and the detection loop
+    finished with it, and a new image is allocated while every pooled one is
+    still in use.
+    """
+
+    def __init__(self, size, pool_size: int = 4):
+        """
+        Args:
+            size (Tuple[int, int]): maximum inference width and height
+            pool_size (int, optional): Maximum amount of output images kept for
+            reuse. Defaults to 4.
+        """
+        self.size = tuple(size)
+        self._pool_size = pool_size
+        self._pool = []
+
+    def output_size(self, image_size):
+        """
+        Get the size frames of the given size are scaled to
+
+        Args:
+            image_size (List[int]): original image width and height
+
+        Returns:
+            Tuple[int, int]: The scaled width and height
+        """
+        width, height = image_size
+        ratio = min(self.size[0] / width, self.size[1] / height, 1.0)
+
+        return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+    def _next_image(self, width, height, image_format):
+        from jetson_utils import cudaAllocMapped
+
+        for i in range(len(self._pool)):
+            # Only referenced by the pool and the getrefcount argument
+            if sys.getrefcount(self._pool[i]) > 2:
+                continue
+
+            image = self._pool[i]
+            if image.width != width or image.height != height or image.format != image_format:
+                image = cudaAllocMapped(width=width, height=height, format=image_format)
+                self._pool[i] = image
+            return image
+
+        image = cudaAllocMapped(width=width, height=height, format=image_format)
+        if len(self._pool) < self._pool_size:
+            self._pool.append(image)
+        return image
+
+    def __call__(self, image):
+        """
+        Scale a frame
+
+        Args:
+            image (Union[cudaImage, np.ndarray]): HWC captured frame
+
+        Returns:
+            Union[cudaImage, np.ndarray]: The scaled frame, or the same frame
+            if it already fits the inference size
+        """
+        if hasattr(image, "width"):
+            image_size = (image.width, image.height)
+        else:
+            image_size = (image.shape[1], image.shape[0])
+
+        width, height = self.output_size(image_size)
+        if (width, height) == tuple(image_size):
+            return image
+
+        if not hasattr(image, "width"):
+            cv2 = import_cv2()
+
+            return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        from jetson_utils import cudaResize
+
+        output = self._next_image(width, height, image.format)
+        cudaResize(image, output)
+        return output
+
+
+class FrameBuffer:
+    """
+    Bounded ring buffer that always keeps the newest frames.
+
+    When the buffer is full the oldest frame is overwritten. The consumer
+    always gets the freshest frame and the older ones are discarded, every
+    frame that is never consumed is counted as dropped.
+    """
+
+    def __init__(self, capacity: int = 2, event: Event = None):
+        """
+        Args:
+            capacity (int, optional): Maximum number of frames kept. Defaults to 2.
+            event (Event, optional): Event set every time a frame is added, useful
+            to wait on several buffers at once. Defaults to None.
+        """
+        if capacity < 1:
+            raise ValueError("Frame buffer capacity must be at least 1")
+
+        self._frames = deque(maxlen=capacity)
+        self._condition = Condition()
+        self._event = event
+        self._dropped = 0
+
+    @property
+    def dropped(self):
+        """
+        Total amount of stale frames dropped
+        """
+        return self._dropped
+
+    def put(self, frame: Frame):
+        """
+        Add a frame to the buffer, overwriting the oldest one if full
+
+        Args:
+            frame (Frame): the captured frame
+        """
+        with self._condition:
+            if len(self._frames) == self._frames.maxlen:
+                self._dropped += 1
+            self._frames.append(frame)
+            self._condition.notify()
+
+        if self._event:
+            self._event.set()
+
+    def get(self, timeout: float = None):
+        """
+        Get the newest frame and discard the older ones
+
+        Args:
+            timeout (float, optional): Seconds to wait for a frame. Defaults to
+            None to wait forever.
+
+        Returns:
+            Frame: The newest frame or None if the timeout expired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frames, timeout):
+                return None
+
+            frame = self._frames.pop()
+            self._dropped += len(self._frames)
+            self._frames.clear()
+
+        return frame
+
+    def clear(self):
+        """
+        Discard all the frames in the buffer without counting them as dropped
+        """
+        with self._condition:
+            self._frames.clear()
+
+
+class CaptureStage:
+    """
+    Capture frames from a video source in a dedicated thread
+    and write them into a FrameBuffer
+    """
+
+    def __init__(self, source, buffer: FrameBuffer, name: str = "", metrics=None,
+                 scaler: FrameScaler = None):
+        """
+        Args:
+            source (videoSource): video source to capture frames from
+            buffer (FrameBuffer): buffer where the captured frames are written
+            name (str, optional): stream name used in logs and metrics. Defaults to empty.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+            scaler (FrameScaler, optional): scaler to the inference resolution
+            applied to every frame. Defaults to None to keep the full resolution.
+        """
+        self._source = source
+        self._buffer = buffer
+        self._name = name
+        self._metrics = metrics
+        self._scaler = scaler
+        self._running = False
+        self._thread = None
+
+    @property
+    def buffer(self):
+        """
+        Buffer with the captured frames
+        """
+        return self._buffer
+
+    def set_scaler(self, scaler):
+        """
+        Replace the frames scaler, frames scaled by the previous one are discarded
+
+        Args:
+            scaler (FrameScaler): the new scaler or None to keep the frames size
+        """
+        self._scaler = scaler
+        self._buffer.clear()
+
+    def start(self):
+        """
+        Start the capture thread
+        """
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the capture thread
+        """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            image = self._source.Capture()
+            if image is None:
+                logger.warning(f"Capture timeout {self._name}")
+                if self._metrics:
+                    self._metrics.capture_timeouts.inc(stream=self._name)
+                continue
+
+            timestamp = time.time()
+            if self._scaler:
+                image = self._scaler(image)
+
+            self._buffer.put(Frame(image, timestamp))
@@ -0,0 +1,219 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Array based detection results
+"""
+
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Intersection over union between every pair of boxes
+
+    Args:
+        boxes_a (np.ndarray): Nx4 array of x0, y0, x1, y1 boxes
+        boxes_b (np.ndarray): Mx4 array of x0, y0, x1, y1 boxes
+
+    Returns:
+        np.ndarray: NxM array with the IoU of each pair
+    """
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    return intersection / np.maximum(union, 1e-6)
+
+
+class Predictions:
+    """
+    Detections of an image stored as whole arrays of boxes, scores and labels
+    """
+
+    def __init__(self, boxes=None, scores=None, labels=None, inputs=None):
+        """
+        Args:
+            boxes (np.ndarray, optional): Nx4 array of x0, y0, x1, y1 boxes
+            scores (np.ndarray, optional): N detection scores
+            labels (np.ndarray, optional): N label indices in the prompt objects
+            inputs (np.ndarray, optional): N indices of the input image or slice
+            each detection comes from
+        """
+        self.boxes = np.zeros((0, 4), np.float32) if boxes is None else boxes
+        self.scores = np.zeros(0, np.float32) if scores is None else scores
+        self.labels = np.zeros(0, np.int64) if labels is None else labels
+        self.inputs = np.zeros(
+            len(self.labels), np.int64) if inputs is None else inputs
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_owl(cls, output):
+        """
+        Create predictions from a NanoOwl decode output with a single
+        device to host transfer
+
+        Args:
+            output (OwlDecodeOutput): NanoOwl predictor output
+
+        Returns:
+            Predictions: The predictions as NumPy arrays
+        """
+        import torch
+
+        boxes = output.boxes
+        data = torch.cat([boxes,
+                          output.scores[:, None].to(boxes.dtype),
+                          output.labels[:, None].to(boxes.dtype),
+                          output.input_indices[:, None].to(boxes.dtype)],
+                         dim=1).cpu().numpy()
+
+        return cls(boxes=data[:, :4].astype(np.float32),
+                   scores=data[:, 4].astype(np.float32),
+                   labels=data[:, 5].astype(np.int64),
+                   inputs=data[:, 6].astype(np.int64))
+
+    @classmethod
+    def concatenate(cls, predictions_list):
+        """
+        Join several predictions in a single one
+
+        Args:
+            predictions_list (List[Predictions]): predictions to join
+
+        Returns:
+            Predictions: The joined predictions
+        """
+        if not predictions_list:
+            return cls()
+
+        return cls(boxes=np.concatenate([p.boxes for p in predictions_list]),
+                   scores=np.concatenate(
+                       [p.scores for p in predictions_list]),
+                   labels=np.concatenate(
+                       [p.labels for p in predictions_list]),
+                   inputs=np.concatenate([p.inputs for p in predictions_list]))
+
+    def select(self, index):
+        """
+        Get a subset of the predictions
+
+        Args:
+            index (Union[np.ndarray, slice]): boolean mask or indices to keep
+
+        Returns:
+            Predictions: The selected predictions
+        """
+        return Predictions(boxes=self.boxes[index], scores=self.scores[index],
+                           labels=self.labels[index], inputs=self.inputs[index])
+
+    def split(self, num_inputs):
+        """
+        Split the predictions by their input index
+
+        Args:
+            num_inputs (int): amount of inputs
+
+        Returns:
+            List[Predictions]: The predictions of each input
+        """
+        order = np.argsort(self.inputs, kind="stable")
+        bounds = np.searchsorted(self.inputs[order], np.arange(num_inputs + 1))
+
+        return [self.select(order[bounds[i]:bounds[i + 1]])
+                for i in range(num_inputs)]
+
+    def shift(self, offsets):
+        """
+        Shift the boxes by the offset of the input they come from,
+        for example to map slice coordinates to image coordinates
+
+        Args:
+            offsets (np.ndarray): Kx2 array with the x, y offset of each input
+
+        Returns:
+            Predictions: The predictions with the shifted boxes
+        """
+        offsets = np.asarray(offsets, dtype=self.boxes.dtype)
+        boxes = self.boxes + np.tile(offsets[self.inputs], 2)
+
+        return Predictions(boxes=boxes, scores=self.scores,
+                           labels=self.labels, inputs=self.inputs)
+
+    def scale(self, scale_x, scale_y):
+        """
+        Scale the boxes coordinates
+
+        Args:
+            scale_x (float): horizontal scale factor
+            scale_y (float): vertical scale factor
+
+        Returns:
+            Predictions: The predictions with the scaled boxes
+        """
+        factors = np.array([scale_x, scale_y, scale_x, scale_y],
+                           dtype=self.boxes.dtype)
+
+        return Predictions(boxes=self.boxes * factors, scores=self.scores,
+                           labels=self.labels, inputs=self.inputs)
+
+    def nms(self, iou_threshold=0.5, class_aware=True):
+        """
+        Greedy non maximum suppression, used to merge the detections
+        of overlapping slices
+
+        Args:
+            iou_threshold (float, optional): boxes overlapping more than this
+            with a higher score box are suppressed. Defaults to 0.5.
+            class_aware (bool, optional): only suppress boxes with the same
+            label. Defaults to True.
+
+        Returns:
+            Predictions: The kept predictions sorted by score
+        """
+        if len(self) < 2:
+            return self
+
+        order = np.argsort(-self.scores, kind="stable")
+        boxes = self.boxes[order]
+        overlap = box_iou(boxes, boxes) > iou_threshold
+        if class_aware:
+            labels = self.labels[order]
+            overlap &= labels[:, None] == labels[None, :]
+
+        # Only a box with higher score can suppress another one
+        overlap = np.triu(overlap, k=1)
+
+        keep = np.ones(len(order), dtype=bool)
+        for i in range(len(order)):
+            if keep[i]:
+                keep[overlap[i]] = False
+
+        return self.select(order[keep])
+
+    def to_lists(self, objects):
+        """
+        Convert to the label names and bounding boxes lists to be published
+
+        Args:
+            objects (List[str]): prompt objects used for the prediction
+
+        Returns:
+            Tuple[List[str], List[List[float]]]: A tuple with the detected
+            labels and their bounding boxes
+        """
+        text_labels = [objects[x] for x in self.labels.tolist()]
+        return text_labels, self.boxes.tolist()
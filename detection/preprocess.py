@@ -0,0 +1,168 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Frame preprocessing into preallocated model input buffers
+"""
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class FramePreprocessor:
+    """
+    Convert captured frames into normalized image encoder inputs.
+
+    Frames are read through their array interface without copying, CUDA
+    frames are used in place on the device. Resize, pad and normalize are
+    done once into input buffers that are allocated on the first frame and
+    reused afterwards, with no PIL round trip.
+    """
+
+    def __init__(self, input_size, mean, std, device):
+        """
+        Args:
+            input_size (Tuple[int, int]): image encoder input height and width
+            mean (torch.Tensor): normalization mean in 0 to 255 scale, shaped 1x3x1x1
+            std (torch.Tensor): normalization standard deviation in 0 to 255
+            scale, shaped 1x3x1x1
+            device (torch.device): device the model runs on
+        """
+        self._input_size = tuple(input_size)
+        self._mean = mean.reshape(1, 3, 1, 1).to(device)
+        self._std = std.reshape(1, 3, 1, 1).to(device)
+        self._device = torch.device(device)
+        self._dtype = self._mean.dtype
+        self._batch = None
+        self._frames = {}
+
+    def to_tensor(self, image):
+        """
+        Get a HWC uint8 tensor on the model device sharing the image memory
+        when possible
+
+        Args:
+            image (Union[np.ndarray, PIL.Image, cudaImage, torch.Tensor]): HWC RGB image
+
+        Returns:
+            torch.Tensor: HWC image tensor
+        """
+        if isinstance(image, torch.Tensor):
+            return image.to(self._device, non_blocking=True)
+
+        if hasattr(image, "__cuda_array_interface__") and self._device.type == "cuda":
+            return torch.as_tensor(image, device=self._device)
+
+        array = np.asarray(image)
+        if array.shape[0] < 5:  # image in CHW
+            array = array[:, :, ::-1]
+        if any(stride < 0 for stride in array.strides):
+            array = np.ascontiguousarray(array)
+
+        return torch.from_numpy(array).to(self._device, non_blocking=True)
+
+    def _buffer(self, buffer, shape):
+        if buffer is None or buffer.shape[0] < shape[0] or buffer.shape[1:] != shape[1:]:
+            buffer = torch.empty(shape, dtype=self._dtype, device=self._device)
+        return buffer
+
+    def _frame_buffer(self, hwc):
+        """
+        Copy the frame into the reusable full resolution buffer of its size
+        """
+        height, width = hwc.shape[:2]
+        frame = self._frames.get((height, width))
+        if frame is None:
+            frame = torch.empty((1, 3, height, width), dtype=self._dtype,
+                                device=self._device)
+            self._frames[(height, width)] = frame
+
+        return frame.copy_(hwc.permute(2, 0, 1)[None])
+
+    @torch.no_grad()
+    def normalize(self, image):
+        """
+        Normalize a whole frame at its original resolution, used to crop
+        slices from it
+
+        Args:
+            image (Union[np.ndarray, PIL.Image, cudaImage, torch.Tensor]): HWC RGB image
+
+        Returns:
+            torch.Tensor: 1x3xHxW normalized image, valid until the next frame
+            of the same size
+        """
+        frame = self._frame_buffer(self.to_tensor(image))
+
+        return frame.sub_(self._mean).div_(self._std)
+
+    @torch.no_grad()
+    def thumbnail(self, normalized, step):
+        """
+        Get a cheap downscaled grayscale copy of a normalized frame by
+        sampling every step pixels
+
+        Args:
+            normalized (torch.Tensor): 1x3xHxW normalized image
+            step (int): sampling step in both directions
+
+        Returns:
+            torch.Tensor: The downscaled image in the 0 to 1 range
+        """
+        small = normalized[0, :, ::step, ::step] * self._std[0] + self._mean[0]
+
+        return small.mean(dim=0) / 255.0
+
+    @torch.no_grad()
+    def letterbox(self, images):
+        """
+        Resize each frame keeping its aspect ratio and pad it to the square
+        image encoder input, the frame is centered in the input
+
+        Args:
+            images (List[Union[np.ndarray, PIL.Image, cudaImage, torch.Tensor]]): HWC RGB images
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Nx3xSxS normalized inputs, valid
+            until the next call, and Nx4 square regions of each image, in image
+            coordinates, the inputs correspond to
+        """
+        input_height, input_width = self._input_size
+        self._batch = self._buffer(
+            self._batch, (len(images), 3, input_height, input_width))
+        batch = self._batch[:len(images)]
+        batch.zero_()
+
+        rois = []
+        for i, image in enumerate(images):
+            hwc = self.to_tensor(image)
+            height, width = hwc.shape[:2]
+            side = max(width, height)
+            resized_width = round(width * input_width / side)
+            resized_height = round(height * input_height / side)
+            x0 = (input_width - resized_width) // 2
+            y0 = (input_height - resized_height) // 2
+
+            # Only the resized region is normalized so the padding stays at zero
+            region = batch[i:i + 1, :, y0:y0 + resized_height,
+                           x0:x0 + resized_width]
+            region.copy_(F.interpolate(self._frame_buffer(hwc),
+                                       size=(resized_height, resized_width),
+                                       mode="bilinear", align_corners=False))
+            region.sub_(self._mean).div_(self._std)
+
+            # Region of the image covered by the whole input, including the padding
+            scale_x = width / resized_width
+            scale_y = height / resized_height
+            rois.append([-x0 * scale_x, -y0 * scale_y,
+                         (input_width - x0) * scale_x, (input_height - y0) * scale_y])
+
+        return batch, torch.tensor(rois, dtype=self._dtype, device=self._device)
@@ -0,0 +1,157 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Prompt text encodings cache
+"""
+
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock, Thread
+
+import torch
+from nanoowl.owl_predictor import OwlEncodeTextOutput
+
+logger = logging.getLogger("detection")
+
+
+class PromptCache:
+    """
+    Least recently used cache of the text encoding of each prompt.
+
+    Only the prompts that are not in the cache are encoded and, if a path
+    is given, the cache is saved to disk so it can be reused on restarts.
+    The cache is saved from a background thread after new prompts are
+    encoded, writing only the newest contents when several saves pile up.
+    """
+
+    def __init__(self, capacity: int = 256, path: str = None, device=None):
+        """
+        Args:
+            capacity (int, optional): Maximum amount of prompts kept. Defaults to 256.
+            path (str, optional): File to load and save the cache. Defaults to None
+            to keep the cache only in memory.
+            device (torch.device, optional): Device to place the loaded encodings.
+            Defaults to None to keep them where they were saved.
+        """
+        if capacity < 1:
+            raise ValueError("Prompt cache capacity must be at least 1")
+
+        self._capacity = capacity
+        self._path = path
+        self._device = device
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._save_lock = Lock()
+        self._pending_save = None
+        self._saving = False
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, prompt):
+        return prompt in self._entries
+
+    def encode(self, prompts, encoder):
+        """
+        Get the text encodings of the prompts, encoding only the ones
+        not found in the cache. Each distinct prompt counts once as a hit or
+        a miss, even if it is repeated
+
+        Args:
+            prompts (List[str]): prompts to encode
+            encoder (Callable[[List[str]], OwlEncodeTextOutput]): function used
+            to encode the missing prompts
+
+        Returns:
+            OwlEncodeTextOutput: The encodings of the prompts in the given order
+        """
+        unique = list(dict.fromkeys(prompts))
+        embeds = {}
+        for prompt in unique:
+            if prompt in self._entries:
+                self._entries.move_to_end(prompt)
+                embeds[prompt] = self._entries[prompt]
+
+        self.hits += len(embeds)
+        missing = [prompt for prompt in unique if prompt not in embeds]
+        if missing:
+            logger.info(f"Encoding prompts {missing}")
+            self.misses += len(missing)
+            output = encoder(missing)
+            for i, prompt in enumerate(missing):
+                embeds[prompt] = output.text_embeds[i:i + 1].detach()
+                self._entries[prompt] = embeds[prompt]
+
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+            if self._path:
+                self._save_later()
+
+        return OwlEncodeTextOutput(
+            text_embeds=torch.cat([embeds[prompt] for prompt in prompts]))
+
+    def load(self):
+        """
+        Load the cache from disk
+        """
+        try:
+            entries = torch.load(self._path, map_location=self._device,
+                                 weights_only=True)
+        except Exception as e:
+            logger.warning(f"Unable to load prompt cache {self._path}: {e}")
+            return
+
+        for prompt, embed in list(entries.items())[-self._capacity:]:
+            self._entries[prompt] = embed
+
+        logger.info(
+            f"Loaded {len(self._entries)} prompts from cache {self._path}")
+
+    def save(self):
+        """
+        Save the cache to disk
+        """
+        self._write(OrderedDict(self._entries))
+
+    def _save_later(self):
+        with self._save_lock:
+            self._pending_save = OrderedDict(self._entries)
+            if self._saving:
+                return
+            self._saving = True
+
+        Thread(target=self._run_saves, daemon=True).start()
+
+    def _run_saves(self):
+        while True:
+            with self._save_lock:
+                entries = self._pending_save
+                self._pending_save = None
+                if entries is None:
+                    self._saving = False
+                    return
+
+            self._write(entries)
+
+    def _write(self, entries):
+        entries = OrderedDict((prompt, embed.cpu()) for prompt, embed in entries.items())
+        tmp_path = f"{self._path}.tmp"
+        try:
+            torch.save(entries, tmp_path)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logger.warning(f"Unable to save prompt cache {self._path}: {e}")
@@ -0,0 +1,202 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Asynchronous redis publisher
+"""
+
+import logging
+import time
+from queue import Empty, Full, Queue
+from threading import Thread
+from typing import NamedTuple
+
+logger = logging.getLogger("detection")
+
+POLICIES = ["drop-oldest", "block"]
+
+
+class PublishConfig(NamedTuple):
+    """
+    Settings of the redis publisher queue, see Publisher
+    """
+    queue_size: int = 64
+    policy: str = "drop-oldest"
+    batch_size: int = 8
+
+
+class Publisher:
+    """
+    Publish detection messages to a redis stream from a background thread.
+
+    The messages are generated by the SchemaGenerator of each stream, which is
+    not connected to redis so calling it only returns the serialized message.
+    Several pending messages are sent together in a single pipelined round trip
+    over a pooled connection. The pending messages queue is bounded, when full
+    either the oldest message is dropped or the caller is blocked.
+    """
+
+    def __init__(self, redis_host="0.0.0.0", redis_port=6379, redis_stream="detection",
+                 queue_size: int = 64, policy: str = "drop-oldest", batch_size: int = 8,
+                 client=None, metrics=None):
+        """
+        Args:
+            redis_host (str, optional): Redis server address. Defaults to 0.0.0.0.
+            redis_port (int, optional): Redis server port. Defaults to 6379.
+            redis_stream (str, optional): Redis stream name. Defaults to detection.
+            queue_size (int, optional): Maximum amount of pending messages. Defaults to 64.
+            policy (str, optional): What to do when the queue is full, drop-oldest
+            or block. Defaults to drop-oldest.
+            batch_size (int, optional): Maximum amount of messages sent in a single
+            round trip. Defaults to 8.
+            client (redis.Redis, optional): Redis client to use instead of
+            connecting to the given host and port. Defaults to None.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid publish policy {policy}, use one of {POLICIES}")
+
+        if client is None:
+            import redis
+
+            pool = redis.ConnectionPool(host=redis_host, port=redis_port)
+            client = redis.Redis(connection_pool=pool)
+
+        self._client = client
+        self._stream = redis_stream
+        self._queue = Queue(maxsize=queue_size)
+        self._policy = policy
+        self._batch_size = batch_size
+        self._metrics = metrics
+        self._running = False
+        self._thread = None
+
+    @property
+    def queue_depth(self):
+        """
+        Amount of messages waiting to be published
+        """
+        return self._queue.qsize()
+
+    def connect(self):
+        """
+        Open a connection to redis now instead of on the first message, the
+        connection is kept in the pool for the publisher thread
+        """
+        self._client.ping()
+
+    def publish(self, schema_gen, labels, bboxes, **fields):
+        """
+        Queue a message to be published
+
+        Args:
+            schema_gen (SchemaGenerator): generator of the stream the message belongs to
+            labels (List[str]): detected labels
+            bboxes (List[List[float]]): bounding boxes for each label
+            fields: extra fields added to the redis stream entry, a timestamp
+            field with the frame capture time is used to measure the end to
+            end latency
+        """
+        item = (schema_gen, labels, bboxes, fields)
+        if self._policy == "block":
+            self._queue.put(item)
+            self._update_queue_depth()
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                    self._count("dropped")
+                    logger.warning("Publish queue full, dropping oldest message")
+                except Empty:
+                    pass
+
+        self._update_queue_depth()
+
+    def start(self):
+        """
+        Start the publisher thread
+        """
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the publisher thread once the pending messages are published
+        """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _count(self, result, amount=1):
+        if self._metrics:
+            self._metrics.publish_messages.inc(amount, result=result)
+
+    def _update_queue_depth(self):
+        if self._metrics:
+            self._metrics.publish_queue_depth.set(self.queue_depth)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except Empty:
+            return []
+
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _send(self, batch):
+        pipe = self._client.pipeline(transaction=False)
+        for schema_gen, labels, bboxes, fields in batch:
+            entry = {"metadata": schema_gen(labels, bboxes)}
+            entry.update(fields)
+            pipe.xadd(self._stream, entry)
+
+        start = time.perf_counter()
+        try:
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to publish {len(batch)} messages: {e}")
+            self._count("dropped", len(batch))
+            self._update_queue_depth()
+            return
+
+        latency = time.perf_counter() - start
+        self._count("published", len(batch))
+        self._update_queue_depth()
+
+        if self._metrics:
+            now = time.time()
+            self._metrics.stage_seconds.observe(latency, stage="publish")
+            for _, _, _, fields in batch:
+                if "timestamp" in fields:
+                    self._metrics.end_to_end_seconds.observe(
+                        now - fields["timestamp"])
+
+        logger.debug(
+            f"Published {len(batch)} messages in {latency * 1000:.2f} ms, "
+            f"{self.queue_depth} pending")
+
+    def _run(self):
+        while self._running or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
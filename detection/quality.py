@@ -0,0 +1,322 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Load aware quality tiers and the detection models they switch between
+"""
+
+import logging
+import os
+import time
+from threading import Lock
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("detection")
+
+# Hugging Face model and TensorRT engine file of each model, heaviest first
+MODELS = {
+    "owlvit-large-patch14": ("google/owlvit-large-patch14",
+                             "owl_image_encoder_large_patch14.engine"),
+    "owlvit-base-patch16": ("google/owlvit-base-patch16", "owl_image_encoder_patch16.engine"),
+    "owlvit-base-patch32": ("google/owlvit-base-patch32", "owl_image_encoder_patch32.engine"),
+}
+DEFAULT_MODEL = "owlvit-base-patch32"
+DEFAULT_ENGINE_DIR = "/opt/nanoowl/data"
+
+
+def model_files(model, engine_dir=DEFAULT_ENGINE_DIR):
+    """
+    Get the files of a detection model
+
+    Args:
+        model (str): model name, one of MODELS
+        engine_dir (str, optional): directory with the TensorRT engines.
+        Defaults to /opt/nanoowl/data.
+
+    Returns:
+        Tuple[str, str]: The Hugging Face model name and the engine path
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model}, use one of {list(MODELS)}")
+
+    model_name, engine = MODELS[model]
+    return model_name, os.path.join(engine_dir, engine)
+
+
+class ModelConfig(NamedTuple):
+    """
+    Detection model settings. Models changed at runtime are loaded and warmed
+    up in the background and swapped in once ready, each model saves its
+    prompt encodings to its own cache file
+    """
+    name: str = DEFAULT_MODEL
+    engine_dir: str = DEFAULT_ENGINE_DIR
+    prompt_cache_size: int = 256
+    prompt_cache_path: Optional[str] = None
+
+
+class QualityConfig(NamedTuple):
+    """
+    Load aware quality settings, disabled without a latency target. While the
+    frames take longer than the target from capture to inference the
+    QualityController steps down to lighter tiers, see build_tiers
+    """
+    latency_target: Optional[float] = None
+    tiers: Optional[List[dict]] = None
+
+
+class QualityTier(NamedTuple):
+    """
+    Detection settings of a quality tier
+    """
+    name: str
+    slices: Optional[Tuple[int, int]]
+    scale: float
+    model: str
+    skip: int
+
+
+def parse_tier(arg):
+    """
+    Parse the settings a quality tier changes from the previous one
+
+    Args:
+        arg (str): comma separated settings, example: 'slices=2x2,scale=0.5,skip=2'.
+        slices are given as vertical x horizontal, scale is the fraction of the
+        inference size, model is one of MODELS and skip infers one of every
+        skip frames
+
+    Returns:
+        dict: The tier settings
+    """
+    settings = {}
+    for item in arg.split(','):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        value = value.strip()
+        if key == "slices":
+            vertical, horizontal = value.split('x')
+            settings[key] = (int(vertical), int(horizontal))
+        elif key == "scale":
+            settings[key] = float(value)
+            if not 0 < settings[key] <= 1:
+                raise ValueError("The tier scale must be between 0 and 1")
+        elif key == "model":
+            if value not in MODELS:
+                raise ValueError(f"Unknown model {value}, use one of {list(MODELS)}")
+            settings[key] = value
+        elif key == "skip":
+            settings[key] = int(value)
+            if settings[key] < 1:
+                raise ValueError("The tier skip must be at least 1")
+        else:
+            raise ValueError(f"Unknown tier setting {key}")
+
+    return settings
+
+
+def build_tiers(slices, model, specs=None):
+    """
+    Build the quality tiers from the configured settings down
+
+    Every tier takes the settings of the previous one and changes some of
+    them. Without specs the tiers halve the slices down to a single one,
+    then scale the inference size down to 75 and 50 percent, then go
+    through the lighter models and finally skip frames.
+
+    Args:
+        slices (Tuple[int, int]): configured vertical and horizontal slices
+        model (str): configured model, one of MODELS
+        specs (List[dict], optional): settings changed by each tier below the
+        configured one, as returned by parse_tier. Defaults to None.
+
+    Returns:
+        List[QualityTier]: The tiers, the configured settings first
+    """
+    tiers = [QualityTier("full", tuple(slices), 1.0, model, 1)]
+
+    if specs is None:
+        specs = []
+        vertical, horizontal = slices
+        while vertical > 1 or horizontal > 1:
+            vertical = max(1, vertical // 2)
+            horizontal = max(1, horizontal // 2)
+            specs.append({"slices": (vertical, horizontal)})
+        specs += [{"scale": 0.75}, {"scale": 0.5}]
+        names = list(MODELS)
+        specs += [{"model": name} for name in names[names.index(model) + 1:]]
+        specs += [{"skip": 2}, {"skip": 3}]
+
+    for i, spec in enumerate(specs):
+        tiers.append(tiers[-1]._replace(name=f"tier{i + 1}", **spec))
+
+    return tiers
+
+
+class QualityController:
+    """
+    Step through the quality tiers to keep the latency under a target.
+
+    The latency from capture until the end of inference is smoothed with an
+    exponential moving average. When it misses the target, the next lower
+    tier is taken, and only after the previous change had time to take
+    effect. When it stays under a fraction of the target for a while, the
+    next higher tier is tried again.
+    """
+
+    def __init__(self, tiers, target: float, headroom: float = 0.6, cooldown: float = 2.0,
+                 recovery: float = 10.0, smoothing: float = 0.2, metrics=None):
+        """
+        Args:
+            tiers (List[QualityTier]): quality tiers, highest quality first
+            target (float): target seconds from capture to inference
+            headroom (float, optional): Fraction of the target the latency must stay
+            under to step up. Defaults to 0.6.
+            cooldown (float, optional): Minimum seconds between steps down. Defaults to 2.0.
+            recovery (float, optional): Seconds the latency must stay under the
+            headroom to step up. Defaults to 10.0.
+            smoothing (float, optional): Weight of each new latency in the moving
+            average. Defaults to 0.2.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+        """
+        self._tiers = list(tiers)
+        self._target = target
+        self._headroom = headroom
+        self._cooldown = cooldown
+        self._recovery = recovery
+        self._smoothing = smoothing
+        self._index = 0
+        self._latency = None
+        self._changed_at = 0.0
+        self._calm_since = None
+
+        self._gauge = None
+        self._changes = None
+        self._latency_gauge = None
+        if metrics is not None:
+            self._gauge = metrics.gauge(
+                "detection_quality_tier", "Current quality tier, 0 is the highest quality")
+            self._changes = metrics.counter(
+                "detection_quality_changes_total", "Quality tier changes", ["direction"])
+            self._latency_gauge = metrics.gauge(
+                "detection_quality_latency_seconds",
+                "Smoothed seconds from capture to inference")
+            self._gauge.set(0)
+
+    @property
+    def tier(self):
+        """
+        Current quality tier
+        """
+        return self._tiers[self._index]
+
+    @property
+    def tiers(self):
+        """
+        Every quality tier, highest quality first
+        """
+        return list(self._tiers)
+
+    def set_tiers(self, tiers):
+        """
+        Replace the quality tiers keeping the current level
+
+        Args:
+            tiers (List[QualityTier]): quality tiers, highest quality first
+        """
+        self._tiers = list(tiers)
+        self._index = min(self._index, len(self._tiers) - 1)
+
+    def observe(self, latency, now=None):
+        """
+        Take the latency of the last inferred frames and choose the tier
+
+        Args:
+            latency (float): seconds from capture to the end of inference
+            now (float, optional): monotonic time in seconds. Defaults to now.
+
+        Returns:
+            QualityTier: The new tier, or None if the tier did not change
+        """
+        now = time.monotonic() if now is None else now
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self._smoothing * (latency - self._latency)
+        if self._gauge:
+            self._latency_gauge.set(self._latency)
+
+        if self._latency > self._target:
+            self._calm_since = None
+            if self._index + 1 < len(self._tiers) and now - self._changed_at >= self._cooldown:
+                return self._step(1, now)
+        elif self._latency < self._headroom * self._target:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif self._index > 0 and now - self._calm_since >= self._recovery:
+                return self._step(-1, now)
+        else:
+            self._calm_since = None
+
+        return None
+
+    def _step(self, direction, now):
+        self._index += direction
+        self._changed_at = now
+        self._calm_since = None
+        tier = self.tier
+        logger.info(f"Latency {self._latency * 1000:.0f} ms against a target of "
+                    f"{self._target * 1000:.0f} ms, quality {'down' if direction > 0 else 'up'} "
+                    f"to {tier.name}: {tier}")
+        if self._gauge:
+            self._gauge.set(self._index)
+            self._changes.inc(direction="down" if direction > 0 else "up")
+
+        return tier
+
+
+class QualityStatus:
+    """
+    Model and quality tier in use, shared with the API
+    """
+
+    def __init__(self, listener=None):
+        """
+        Args:
+            listener (Callable[[dict], None], optional): called with the report
+            every time the status changes. Defaults to None.
+        """
+        self._listener = listener
+        self._lock = Lock()
+        self._status = {"model": None, "loading": None, "tier": None, "tiers": []}
+
+    def set(self, **fields):
+        """
+        Update some of the status fields
+
+        Args:
+            fields: model, loading, tier or tiers
+        """
+        with self._lock:
+            self._status.update(fields)
+            report = dict(self._status)
+        if self._listener:
+            self._listener(report)
+
+    def report(self):
+        """
+        Get the status
+
+        Returns:
+            dict: The model in use, the model being loaded, the current tier and
+            the tiers, along with the available models
+        """
+        with self._lock:
+            return {**self._status, "models": list(MODELS)}
@@ -0,0 +1,159 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Regions of interest restricting the detection to zones of the image
+"""
+
+import numpy as np
+
+
+def parse_region(text):
+    """
+    Parse a region of interest
+
+    Args:
+        text (str): x0,y0,x1,y1 rectangle or x,y,x,y,x,y,... polygon with at
+        least three points, in image pixels
+
+    Returns:
+        np.ndarray: Kx2 array with the polygon points
+    """
+    try:
+        values = [float(value) for value in text.split(",")]
+    except ValueError as e:
+        raise ValueError(f"Invalid region {text}, expected comma separated numbers") from e
+
+    if len(values) == 4:
+        x0, y0, x1, y1 = values
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"Invalid rectangle {text}, expected x0,y0,x1,y1")
+        values = [x0, y0, x1, y0, x1, y1, x0, y1]
+    elif len(values) < 6 or len(values) % 2:
+        raise ValueError(
+            f"Invalid region {text}, expected a x0,y0,x1,y1 rectangle or a polygon points")
+
+    return np.array(values, dtype=np.float32).reshape(-1, 2)
+
+
+def parse_regions(text):
+    """
+    Parse several regions of interest separated by semicolons
+
+    Args:
+        text (str): regions, example: 0,0,100,100;200,200,300,200,250,300
+
+    Returns:
+        List[np.ndarray]: The points of each polygon
+    """
+    return [parse_region(region) for region in text.split(";") if region.strip()]
+
+
+def points_in_polygon(points, polygon):
+    """
+    Check which points lie inside a polygon using ray casting
+
+    Args:
+        points (np.ndarray): Nx2 array of x, y points
+        polygon (np.ndarray): Kx2 array with the polygon points
+
+    Returns:
+        np.ndarray: N booleans, True for the points inside the polygon
+    """
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    x0 = polygon[:, 0]
+    y0 = polygon[:, 1]
+    x1 = np.roll(x0, -1)
+    y1 = np.roll(y0, -1)
+
+    # Edges crossed by a horizontal ray from each point to the right
+    crosses = (y0 > y) != (y1 > y)
+    height = np.where(y1 != y0, y1 - y0, 1)
+    x_cross = x0 + (y - y0) * (x1 - x0) / height
+
+    return (crosses & (x < x_cross)).sum(axis=1) % 2 == 1
+
+
+class RegionMask:
+    """
+    Set of polygons, in image pixels, where the detections are wanted.
+
+    The model only runs on the bounding rectangle of each region, and the
+    detections whose center falls outside every region are discarded.
+    """
+
+    def __init__(self, regions):
+        """
+        Args:
+            regions (List[np.ndarray]): Kx2 arrays with the points of each polygon
+        """
+        if not regions:
+            raise ValueError("At least one region is required")
+
+        self.regions = [np.asarray(region, dtype=np.float32)
+                        for region in regions]
+
+    def crops(self, input_size, scale=(1.0, 1.0)):
+        """
+        Get the bounding rectangle of each region in the model input frame
+
+        Args:
+            input_size (List[int]): width and height of the frames given to the model
+            scale (Tuple[float, float], optional): original image size over the input
+            size. Defaults to no scaling.
+
+        Returns:
+            List[List[int]]: x0, y0, x1, y1 of each region crop, regions
+            outside the frame are skipped
+        """
+        width, height = input_size
+        crops = []
+        for region in self.regions:
+            x0, y0 = region.min(axis=0) / scale
+            x1, y1 = region.max(axis=0) / scale
+            crop = [max(0, int(np.floor(x0))), max(0, int(np.floor(y0))),
+                    min(width, int(np.ceil(x1))), min(height, int(np.ceil(y1)))]
+            if crop[2] > crop[0] and crop[3] > crop[1]:
+                crops.append(crop)
+
+        return crops
+
+    def contains(self, boxes):
+        """
+        Check which boxes have their center inside any region
+
+        Args:
+            boxes (np.ndarray): Nx4 array of x0, y0, x1, y1 boxes in image pixels
+
+        Returns:
+            np.ndarray: N booleans, True for the boxes inside the mask
+        """
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        inside = np.zeros(len(boxes), dtype=bool)
+        for region in self.regions:
+            inside |= points_in_polygon(centers, region)
+
+        return inside
+
+    def filter(self, predictions):
+        """
+        Discard the detections outside the mask
+
+        Args:
+            predictions (Predictions): detections in image pixels
+
+        Returns:
+            Predictions: The detections inside the mask
+        """
+        if not len(predictions):
+            return predictions
+
+        return predictions.select(self.contains(predictions.boxes))
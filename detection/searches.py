@@ -0,0 +1,174 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Named searches sharing a single model pass
+"""
+
+import numpy as np
+
+DEFAULT_SEARCH = "default"
+
+
+def parse_search(search):
+    """
+    Parse a search request into the list of requested objects with the
+    corresponding thresholds. If only one threshold is provided it is used
+    for all the objects
+
+    Args:
+        search (Search): model Search with the requested objects and thresholds
+
+    Returns:
+        Tuple[List[str], List[float]]: A tuple with two lists: the extracted
+        objects and the corresponding thresholds
+    """
+    objects = [x.strip() for x in search.objects[0].split(",")]
+    thresholds = [float(x.strip()) for x in search.thresholds[0].split(",")]
+
+    if len(thresholds) == 1:
+        thresholds = [thresholds[0]] * len(objects)
+
+    return objects, thresholds
+
+
+class NamedSearch:
+    """
+    Objects and thresholds requested by one client, optionally restricted
+    to a single stream
+    """
+
+    def __init__(self, name, objects, thresholds, stream=None):
+        """
+        Args:
+            name (str): search name
+            objects (List[str]): objects to detect
+            thresholds (List[float]): score threshold of each object
+            stream (str, optional): VST sensor name the search applies to, or None
+            for every stream. Defaults to None.
+        """
+        if len(objects) != len(thresholds):
+            raise ValueError(
+                f"Search {name} has {len(objects)} objects and {len(thresholds)} thresholds")
+
+        self.name = name
+        self.objects = list(objects)
+        self.thresholds = list(thresholds)
+        self.stream = stream
+
+        # Score needed by each label of the prompts union, infinite for the
+        # labels not in this search
+        self.label_thresholds = np.zeros(0, np.float32)
+
+    def applies_to(self, stream_name):
+        """
+        Check whether the search applies to a stream
+
+        Args:
+            stream_name (str): VST sensor name
+
+        Returns:
+            bool: True if the search applies to the stream
+        """
+        return self.stream is None or self.stream == stream_name
+
+    def accepts(self, labels, scores):
+        """
+        Check which detections belong to the search
+
+        Args:
+            labels (np.ndarray): N labels, indexes in the prompts union
+            scores (np.ndarray): N scores
+
+        Returns:
+            np.ndarray: N booleans, True for the detections of the search
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        return np.asarray(scores) >= self.label_thresholds[labels]
+
+
+class SearchSet:
+    """
+    Set of named searches merged into one deduplicated union of prompts,
+    so the model runs once per frame no matter how many searches are
+    active. Each prompt is decoded with the lowest threshold any search
+    asks for, and the detections are routed back to every search with its
+    own thresholds.
+    """
+
+    def __init__(self):
+        self._searches = {}
+        self.objects = []
+        self.thresholds = []
+
+    def __len__(self):
+        return len(self._searches)
+
+    def __iter__(self):
+        return iter(self._searches.values())
+
+    def set(self, search):
+        """
+        Add a search or replace the search with the same name
+
+        Args:
+            search (NamedSearch): the search
+        """
+        self._searches[search.name] = search
+        self._merge()
+
+    def remove(self, name):
+        """
+        Remove a search
+
+        Args:
+            name (str): search name
+
+        Returns:
+            bool: True if the search existed
+        """
+        if self._searches.pop(name, None) is None:
+            return False
+
+        self._merge()
+        return True
+
+    def for_stream(self, stream_name):
+        """
+        Get the searches that apply to a stream
+
+        Args:
+            stream_name (str): VST sensor name
+
+        Returns:
+            List[NamedSearch]: The searches of the stream
+        """
+        return [search for search in self._searches.values()
+                if search.applies_to(stream_name)]
+
+    def _merge(self):
+        index = {}
+        thresholds = []
+        for search in self._searches.values():
+            for obj, threshold in zip(search.objects, search.thresholds):
+                if obj in index:
+                    thresholds[index[obj]] = min(thresholds[index[obj]], threshold)
+                else:
+                    index[obj] = len(thresholds)
+                    thresholds.append(threshold)
+
+        self.objects = list(index)
+        self.thresholds = thresholds
+
+        for search in self._searches.values():
+            label_thresholds = np.full(len(self.objects), np.inf, np.float32)
+            for obj, threshold in zip(search.objects, search.thresholds):
+                label_thresholds[index[obj]] = min(label_thresholds[index[obj]], threshold)
+            search.label_thresholds = label_thresholds
@@ -0,0 +1,212 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Shared memory ring buffer to move frames between processes
+"""
+
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Any, NamedTuple, Tuple
+
+import numpy as np
+
+# Control words: newest slot, slot being read, frames written, maximum
+# frame width and height requested by the reader
+_LATEST = 0
+_READING = 1
+_WRITTEN = 2
+_MAX_WIDTH = 3
+_MAX_HEIGHT = 4
+_CONTROL_SIZE = 5
+
+# Slot header: sequence, timestamp, frame width and height, original width and height
+_HEADER_SIZE = 6
+
+
+class RingFrame(NamedTuple):
+    """
+    Frame read from the ring, the image is a view of the shared memory
+    """
+    image: Any
+    timestamp: float
+    original_size: Tuple[int, int]
+    count: int
+
+
+class FrameRing:
+    """
+    Fixed slot ring of frames in shared memory, with one writer process
+    and one reader process.
+
+    Each slot holds a contiguous frame up to the maximum size. The writer never
+    writes into the newest slot nor into the slot being read, so the reader
+    uses the frame in place without copying it. Every slot is protected by
+    a sequence number that is odd while the slot is being written.
+    """
+
+    def __init__(self, name: str = None, slots: int = 4, max_size=(1920, 1080),
+                 channels: int = 3, create: bool = False):
+        """
+        Args:
+            name (str, optional): shared memory name, required to attach to an
+            existing ring. Defaults to None.
+            slots (int, optional): Amount of frames in the ring, at least 3.
+            Defaults to 4.
+            max_size (Tuple[int, int], optional): Maximum frame width and height.
+            Defaults to 1920x1080.
+            channels (int, optional): Channels of the frames. Defaults to 3.
+            create (bool, optional): Create the shared memory instead of
+            attaching to it. Defaults to False.
+        """
+        if slots < 3:
+            raise ValueError("A frame ring needs at least 3 slots")
+
+        self.slots = slots
+        self.max_size = tuple(max_size)
+        self.channels = channels
+        width, height = self.max_size
+        control_bytes = _CONTROL_SIZE * 8
+        header_bytes = slots * _HEADER_SIZE * 8
+        frame_bytes = height * width * channels
+        size = control_bytes + header_bytes + slots * frame_bytes
+
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        elif sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # Processes started by the creator share its resource tracker, so the
+            # memory is only unlinked once
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self._shm.name
+        self._owner = create
+        buffer = self._shm.buf
+        self._control = np.ndarray(_CONTROL_SIZE, np.int64, buffer, 0)
+        self._headers = np.ndarray((slots, _HEADER_SIZE), np.float64, buffer,
+                                   control_bytes)
+        self._frames = np.ndarray((slots, frame_bytes), np.uint8, buffer,
+                                  control_bytes + header_bytes)
+        self._next = 0
+
+        if create:
+            self._control[:] = [-1, -1, 0, width, height]
+            self._headers[:] = 0
+
+    @property
+    def written(self):
+        """
+        Amount of frames written so far
+        """
+        return int(self._control[_WRITTEN])
+
+    @property
+    def frame_size(self):
+        """
+        Maximum frame width and height requested by the reader
+        """
+        return int(self._control[_MAX_WIDTH]), int(self._control[_MAX_HEIGHT])
+
+    @frame_size.setter
+    def frame_size(self, size):
+        width = min(size[0], self.max_size[0])
+        height = min(size[1], self.max_size[1])
+        self._control[_MAX_WIDTH] = width
+        self._control[_MAX_HEIGHT] = height
+
+    def write(self, image, timestamp: float, original_size=None):
+        """
+        Copy a frame into a free slot and make it the newest frame
+
+        Args:
+            image (np.ndarray): HWC frame no bigger than the maximum size
+            timestamp (float): capture time in seconds
+            original_size (Tuple[int, int], optional): width and height of the
+            frame before it was downscaled. Defaults to the frame size.
+        """
+        height, width = image.shape[:2]
+        if width > self.max_size[0] or height > self.max_size[1]:
+            raise ValueError(
+                f"Frame of {width}x{height} does not fit the ring slots of "
+                f"{self.max_size[0]}x{self.max_size[1]}")
+
+        busy = (self._control[_LATEST], self._control[_READING])
+        slot = self._next
+        while slot in busy:
+            slot = (slot + 1) % self.slots
+        self._next = (slot + 1) % self.slots
+
+        header = self._headers[slot]
+        header[0] += 1
+        frame = self._frames[slot, :height * width * self.channels]
+        frame.reshape(height, width, self.channels)[:] = image
+        original_size = original_size or (width, height)
+        header[1:] = [timestamp, width, height, original_size[0], original_size[1]]
+        header[0] += 1
+
+        self._control[_LATEST] = slot
+        self._control[_WRITTEN] += 1
+
+    def read(self, count: int = 0, timeout: float = 0.0):
+        """
+        Get the newest frame if it is newer than the given count. The frame
+        slot is not written again until the next read
+
+        Args:
+            count (int, optional): frames written when the last frame was read.
+            Defaults to 0.
+            timeout (float, optional): Seconds to wait for a new frame. Defaults to
+            0 to return at once.
+
+        Returns:
+            RingFrame: The newest frame or None if there is no new frame
+        """
+        deadline = time.monotonic() + timeout
+        while self._control[_WRITTEN] <= count:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.001)
+
+        while True:
+            slot = int(self._control[_LATEST])
+            written = int(self._control[_WRITTEN])
+            self._control[_READING] = slot
+
+            # The writer may have taken the slot before it was marked as read
+            sequence = self._headers[slot, 0]
+            if sequence % 2 == 0 and slot == self._control[_LATEST]:
+                break
+
+        _, timestamp, width, height, original_width, original_height = \
+            self._headers[slot].tolist()
+        width = int(width)
+        height = int(height)
+        image = self._frames[slot, :height * width * self.channels].reshape(
+            height, width, self.channels)
+
+        return RingFrame(image, timestamp, (int(original_width), int(original_height)),
+                         written)
+
+    def close(self):
+        """
+        Detach from the shared memory, and remove it if this ring created it
+        """
+        self._control = None
+        self._headers = None
+        self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Frames still in use keep the mapping alive until they are released
+            pass
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,269 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Image slicing
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("detection")
+
+
+def get_slice_rois(image_size, slice_size, overlap_ratio=0.2):
+    """
+    Split the image in an overlapping grid of slices, the last slice of each
+    row and column is shifted back to fit in the image
+
+    Args:
+        image_size(List[int]): image width and height
+        slice_size(Tuple[int, int]): slice width and height
+        overlap_ratio(float, optional): fraction of the slice overlapping with
+        the neighbour slices. Defaults to 0.2.
+
+    Returns:
+        List[List[int]]: x0, y0, x1, y1 coordinates of each slice
+    """
+    width, height = image_size
+    slice_width = min(slice_size[0], width)
+    slice_height = min(slice_size[1], height)
+    x_step = max(slice_width - int(overlap_ratio * slice_width), 1)
+    y_step = max(slice_height - int(overlap_ratio * slice_height), 1)
+
+    rois = []
+    y = 0
+    while True:
+        y1 = min(y + slice_height, height)
+        x = 0
+        while True:
+            x1 = min(x + slice_width, width)
+            rois.append([x1 - slice_width, y1 - slice_height, x1, y1])
+            if x1 >= width:
+                break
+            x += x_step
+
+        if y1 >= height:
+            break
+        y += y_step
+
+    return rois
+
+
+class SlicingConfig(NamedTuple):
+    """
+    Slicing settings. The slices are inferred with the native backend or with
+    SAHI. With adaptive slicing each stream gets an AdaptiveSlicer choosing the
+    grid of each frame from the recent objects sizes and inference latency,
+    instead of the fixed grid
+    """
+    backend: str = "native"
+    mode: str = "fixed"
+    latency_budget: float = 0.1
+    max_grid: int = 4
+    min_object_size: float = 24.0
+
+
+class SlicePlan(NamedTuple):
+    """
+    Slicing chosen for a frame
+    """
+    grid: int
+    slice_size: Tuple[int, int]
+    overlap_ratio: float
+
+    @property
+    def name(self):
+        """
+        Grid name, example: 3x3
+        """
+        return f"{self.grid}x{self.grid}"
+
+
+def slice_count(image_size, slice_size, overlap_ratio):
+    """
+    Get the amount of slices of an image
+
+    Args:
+        image_size(List[int]): image width and height
+        slice_size(Tuple[int, int]): slice width and height
+        overlap_ratio(float): fraction of the slice overlapping with the
+        neighbour slices
+
+    Returns:
+        int: The amount of slices
+    """
+    counts = []
+    for length, slice_length in zip(image_size, slice_size):
+        slice_length = min(slice_length, length)
+        step = max(slice_length - int(overlap_ratio * slice_length), 1)
+        counts.append(max(1, math.ceil((length - slice_length) / step) + 1))
+
+    return counts[0] * counts[1]
+
+
+class AdaptiveSlicer:
+    """
+    Choose the slicing grid and overlap of each frame.
+
+    The grid is the coarsest one where the smallest recent objects still
+    reach a minimum size at the model input, limited to the finest grid
+    whose estimated latency fits the per frame budget. Frames run on the
+    whole image while objects are large. While nothing is being detected,
+    the finest affordable grid is probed periodically to find small objects
+    that the whole image misses. The overlap grows with the object size so
+    objects are not cut between slices.
+    """
+
+    def __init__(self, name: str = "", latency_budget: float = 0.1, max_grid: int = 4,
+                 min_object_size: float = 24.0, model_input_size: int = 768,
+                 window: float = 5.0, probe_interval: float = 2.0,
+                 min_overlap: float = 0.1, max_overlap: float = 0.3):
+        """
+        Args:
+            name (str, optional): stream name used in logs. Defaults to empty.
+            latency_budget (float, optional): Target seconds of inference per frame.
+            Defaults to 0.1.
+            max_grid (int, optional): Maximum slices per side. Defaults to 4.
+            min_object_size (float, optional): Minimum pixels an object should span
+            at the model input to be detected. Defaults to 24.0.
+            model_input_size (int, optional): Side of the square model input.
+            Defaults to 768.
+            window (float, optional): Seconds of recent detections used to
+            estimate the object sizes. Defaults to 5.0.
+            probe_interval (float, optional): Seconds between probes with the finest
+            grid while nothing is detected. Defaults to 2.0.
+            min_overlap (float, optional): Minimum slices overlap. Defaults to 0.1.
+            max_overlap (float, optional): Maximum slices overlap. Defaults to 0.3.
+        """
+        self._name = name
+        self._latency_budget = latency_budget
+        self._max_grid = max(1, max_grid)
+        self._min_object_size = min_object_size
+        self._model_input_size = model_input_size
+        self._window = window
+        self._probe_interval = probe_interval
+        self._min_overlap = min_overlap
+        self._max_overlap = max_overlap
+        self._sizes = deque()
+        self._crop_latency = None
+        self._next_probe = 0.0
+        self._last_grid = None
+
+    def reset(self):
+        """
+        Forget the recent detections
+        """
+        self._sizes.clear()
+        self._next_probe = 0.0
+
+    def _affordable_grid(self):
+        """
+        Finest grid whose estimated latency fits the budget
+        """
+        if self._crop_latency is None:
+            return self._max_grid
+
+        # Each grid encodes its slices plus the whole image
+        for grid in range(self._max_grid, 1, -1):
+            if (grid * grid + 1) * self._crop_latency <= self._latency_budget:
+                return grid
+        return 1
+
+    def _needed_grid(self, image_size, smallest):
+        """
+        Coarsest grid where the smallest object reaches the minimum size
+        """
+        longest = max(image_size)
+        for grid in range(1, self._max_grid + 1):
+            slice_length = longest / grid / (1 - self._min_overlap) if grid > 1 else longest
+            if smallest * self._model_input_size / slice_length >= self._min_object_size:
+                return grid
+        return self._max_grid
+
+    def plan(self, image_size, timestamp: float = None):
+        """
+        Choose the slicing of a frame
+
+        Args:
+            image_size (List[int]): width and height of the frame given to the model
+            timestamp (float, optional): capture time in seconds. Defaults to now.
+
+        Returns:
+            SlicePlan: The chosen grid, slice size and overlap
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        while self._sizes and timestamp - self._sizes[0][0] > self._window:
+            self._sizes.popleft()
+
+        affordable = self._affordable_grid()
+        overlap = self._min_overlap
+        if self._sizes:
+            sizes = np.concatenate([sizes for _, sizes in self._sizes])
+            grid = min(self._needed_grid(image_size, np.percentile(sizes, 10)),
+                       affordable)
+            if grid > 1:
+                slice_length = max(image_size) / grid
+                overlap = float(np.clip(np.median(sizes) / slice_length,
+                                        self._min_overlap, self._max_overlap))
+        elif timestamp >= self._next_probe:
+            grid = affordable
+            self._next_probe = timestamp + self._probe_interval
+        else:
+            grid = 1
+
+        # Slices grow with the overlap so the grid still covers the image
+        slice_size = (int(math.ceil(image_size[0] / grid / (1 - overlap))),
+                      int(math.ceil(image_size[1] / grid / (1 - overlap))))
+        if grid == 1:
+            slice_size = (image_size[0], image_size[1])
+
+        plan = SlicePlan(grid, slice_size, overlap)
+        if grid != self._last_grid:
+            logger.info(
+                f"{self._name} slicing grid changed to {plan.name} with {overlap:.2f} overlap")
+            self._last_grid = grid
+
+        return plan
+
+    def update(self, predictions, plan, image_size, latency: float, timestamp: float = None):
+        """
+        Learn from the detections and latency of a frame
+
+        Args:
+            predictions (Predictions): detections in the model input frame coordinates
+            plan (SlicePlan): slicing used on the frame
+            image_size (List[int]): width and height of the frame given to the model
+            latency (float): seconds the inference took
+            timestamp (float, optional): capture time in seconds. Defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        crops = 1
+        if plan.grid > 1:
+            crops = slice_count(image_size, plan.slice_size, plan.overlap_ratio) + 1
+        crop_latency = latency / crops
+        if self._crop_latency is None:
+            self._crop_latency = crop_latency
+        else:
+            self._crop_latency = 0.8 * self._crop_latency + 0.2 * crop_latency
+
+        if len(predictions):
+            boxes = predictions.boxes
+            sizes = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            self._sizes.append((timestamp, sizes))
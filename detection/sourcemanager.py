@@ -0,0 +1,236 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+VST stream catalog and background opening of video sources
+"""
+
+import logging
+import time
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Any, NamedTuple
+
+logger = logging.getLogger("detection")
+
+
+class StreamCatalog:
+    """
+    VST RTSP streams list cached for a limited time, so looking up a
+    stream does not query VST every time
+    """
+
+    def __init__(self, vst_uri: str, ttl: float = 30.0):
+        """
+        Args:
+            vst_uri (str): VST address
+            ttl (float, optional): Seconds the streams list is cached. Defaults to 30.0.
+        """
+        self._vst_uri = vst_uri
+        self._ttl = ttl
+        self._vst = None
+        self._streams = []
+        self._expiration = 0.0
+        self._lock = Lock()
+
+    def streams(self, refresh: bool = False):
+        """
+        Get the VST RTSP streams
+
+        Args:
+            refresh (bool, optional): Query VST even if the cached list has not
+            expired. Defaults to False.
+
+        Returns:
+            List[dict]: The VST RTSP streams
+        """
+        with self._lock:
+            now = time.monotonic()
+            if refresh or now >= self._expiration:
+                if self._vst is None:
+                    from mmj_utils.vst import VST
+
+                    self._vst = VST(self._vst_uri)
+
+                self._streams = self._vst.get_rtsp_streams()
+                self._expiration = now + self._ttl
+                logger.info(f"VST input streams: {self._streams}")
+
+            return self._streams
+
+    def find(self, name: str = None):
+        """
+        Find a stream by name, the list is queried again before giving up
+        in case the stream was added to VST after it was cached
+
+        Args:
+            name (str, optional): stream name or None to use the first stream
+
+        Returns:
+            dict: The requested stream or the first stream if it was not found
+        """
+        streams = self.streams()
+        if name and not any(stream['name'] == name for stream in streams):
+            streams = self.streams(refresh=True)
+
+        if len(streams) == 0:
+            raise RuntimeError("No valid input source in VST")
+
+        if name:
+            for stream in streams:
+                if stream['name'] == name:
+                    return stream
+
+            logger.warning(f"{name} not found in VST")
+
+        return streams[0]
+
+
+class SourceRequest(NamedTuple):
+    """
+    Request to open a stream
+    """
+    name: str
+    action: str
+    options: dict
+
+
+class OpenedSource(NamedTuple):
+    """
+    Stream opened in the background that already produced a frame
+    """
+    request: SourceRequest
+    source: Any
+    sensor_id: str
+    name: str
+
+
+class SourceManager:
+    """
+    Open video sources on a background thread.
+
+    Opening a source goes through the RTSP negotiation, which takes
+    seconds. Sources are opened and pre-warmed until their first frame
+    arrives, then handed over to the detection loop, which swaps them in
+    at once while the previous streams keep being processed meanwhile.
+    """
+
+    def __init__(self, open_source, release_source, first_frame_timeout: float = 10.0):
+        """
+        Args:
+            open_source (Callable[[str], Tuple[videoSource, str, str]]): opens the
+            source of a stream name and returns it with its sensor id and stream name
+            release_source (Callable[[videoSource], None]): releases a source that
+            is not handed over to the detection loop
+            first_frame_timeout (float, optional): Seconds to wait for the first
+            frame of a new source. Defaults to 10.0.
+        """
+        self._open_source = open_source
+        self._release_source = release_source
+        self._first_frame_timeout = first_frame_timeout
+        self._requests = Queue()
+        self._ready = Queue()
+        self._pending = set()
+        self._lock = Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        Start the opening thread
+        """
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the opening thread, sources being opened or not taken yet are
+        released
+        """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        for opened in self.ready():
+            self._release(opened.source)
+
+    def open(self, name: str, action: str, **options):
+        """
+        Request to open a stream in the background
+
+        Args:
+            name (str): stream name or None to use the first stream
+            action (str): what to do with the stream once it is ready
+            options: stream options given back with the opened source
+
+        Returns:
+            bool: False if the stream is already being opened
+        """
+        with self._lock:
+            if name in self._pending:
+                logger.info(f"Stream {name} is already being opened")
+                return False
+            self._pending.add(name)
+
+        self._requests.put(SourceRequest(name, action, options))
+        return True
+
+    def ready(self):
+        """
+        Get the sources that finished opening
+
+        Returns:
+            List[OpenedSource]: The opened sources in request order
+        """
+        opened = []
+        while not self._ready.empty():
+            opened.append(self._ready.get())
+        return opened
+
+    def _wait_first_frame(self, source):
+        deadline = time.monotonic() + self._first_frame_timeout
+        while self._running and time.monotonic() < deadline:
+            if source.Capture() is not None:
+                return True
+        return False
+
+    def _run(self):
+        while self._running:
+            try:
+                request = self._requests.get(timeout=0.5)
+            except Empty:
+                continue
+
+            source = None
+            try:
+                start = time.monotonic()
+                source, sensor_id, name = self._open_source(request.name)
+                if self._wait_first_frame(source):
+                    logger.info(
+                        f"Stream {name} ready in {time.monotonic() - start:.2f} seconds")
+                    self._ready.put(OpenedSource(request, source, sensor_id, name))
+                    source = None
+                elif self._running:
+                    logger.warning(f"No frames received from stream {name}")
+            except Exception as e:
+                logger.error(f"Failed to open stream {request.name}: {repr(e)}")
+            finally:
+                if source is not None:
+                    self._release(source)
+                with self._lock:
+                    self._pending.discard(request.name)
+
+    def _release(self, source):
+        try:
+            self._release_source(source)
+        except Exception as e:
+            logger.error(f"Failed to release source: {repr(e)}")
@@ -0,0 +1,129 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Startup stages and readiness of the detection
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger("detection")
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Startup:
+    """
+    Progress of the detection startup. Every initialization stage records
+    its state and how long it took, and the detection is ready once the
+    model is loaded, the streams are open and the warm-up inference ran.
+    """
+
+    def __init__(self, listener=None):
+        """
+        Args:
+            listener (Callable[[dict], None], optional): called with the report
+            every time a stage changes. Defaults to None.
+        """
+        self._listener = listener
+        self._lock = Lock()
+        self._started = time.monotonic()
+        self._stages = {}
+        self._ready_seconds = None
+
+    @property
+    def ready(self):
+        """
+        Whether the detection finished starting up
+        """
+        with self._lock:
+            return self._ready_seconds is not None
+
+    def reset(self):
+        """
+        Forget the stages of a previous startup
+        """
+        with self._lock:
+            self._started = time.monotonic()
+            self._stages = {}
+            self._ready_seconds = None
+        self._notify()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record the state and duration of an initialization stage, a stage
+        that raises is marked as failed and the exception propagates
+
+        Args:
+            name (str): stage name
+        """
+        start = time.monotonic()
+        self._set(name, {"state": RUNNING, "seconds": None, "error": None})
+        try:
+            yield
+        except Exception as e:
+            self._set(name, {"state": FAILED, "seconds": time.monotonic() - start,
+                             "error": repr(e)})
+            raise
+
+        seconds = time.monotonic() - start
+        self._set(name, {"state": DONE, "seconds": seconds, "error": None})
+        logger.info(f"Startup stage {name} done in {seconds:.2f} s")
+
+    def set_ready(self):
+        """
+        Mark the startup as finished
+        """
+        with self._lock:
+            self._ready_seconds = time.monotonic() - self._started
+            seconds = self._ready_seconds
+        logger.info(f"Detection ready {seconds:.2f} s after start")
+        self._notify()
+
+    def report(self):
+        """
+        Get the startup progress
+
+        Returns:
+            dict: Whether the detection is ready, the seconds it took to be ready
+            and the state, duration and error of each stage
+        """
+        with self._lock:
+            return {"ready": self._ready_seconds is not None,
+                    "seconds": self._ready_seconds,
+                    "stages": {name: dict(stage) for name, stage in self._stages.items()}}
+
+    def update(self, report):
+        """
+        Take the progress reported by another process, its stages are added
+        to the ones of this process
+
+        Args:
+            report (dict): startup report of the other process
+        """
+        with self._lock:
+            self._stages.update(
+                {name: dict(stage) for name, stage in report["stages"].items()})
+            self._ready_seconds = report["seconds"] if report["ready"] else None
+
+    def _set(self, name, stage):
+        with self._lock:
+            self._stages[name] = stage
+        self._notify()
+
+    def _notify(self):
+        if self._listener:
+            self._listener(self.report())
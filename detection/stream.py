@@ -0,0 +1,220 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Active video stream
+"""
+
+import logging
+import time
+
+from detection.pipeline import CaptureStage, Frame, FrameBuffer, FrameScaler
+
+logger = logging.getLogger("detection")
+
+
+class Stream:
+    """
+    Video stream being processed with its own schema generator
+    """
+
+    def __init__(self, name, source, sensor_id, schema_gen,
+                 buffer: FrameBuffer = None, metrics=None, scaler: FrameScaler = None):
+        """
+        Args:
+            name (str): VST stream name
+            source (videoSource): video source to capture frames from
+            sensor_id (str): VST sensor id of the stream
+            schema_gen (SchemaGenerator): generator to post the stream detections
+            buffer (FrameBuffer, optional): if given the frames are captured in a
+            dedicated thread into this buffer. Defaults to None to capture inline.
+            metrics (Metrics, optional): metrics registry. Defaults to None.
+            scaler (FrameScaler, optional): scaler to the inference resolution.
+            Defaults to None to run the model on the full resolution frames.
+        """
+        self.name = name
+        self.source = source
+        self.sensor_id = sensor_id
+        self.schema_gen = schema_gen
+        self.image_size = [0, 0]
+        self.input_size = [0, 0]
+        self.scale = (1.0, 1.0)
+        self.slice_size = None
+        self.gate = None
+        self.tracker = None
+        self.deltas = {}
+        self.mask = None
+        self.slicer = None
+        self.tiles = None
+        self.inference_size = None
+        self.quality_scale = 1.0
+        self.resizing = False
+        self.skipped = 0
+        self.last_predictions = None
+        self.next_inference = 0.0
+        self._dropped = 0
+        self._metrics = metrics
+        self._scaler = scaler
+        self._capture = None
+        if buffer:
+            self._capture = CaptureStage(source, buffer, name, metrics, scaler)
+
+    def capture_in_thread(self, buffer: FrameBuffer):
+        """
+        Move the capture of an inline stream to a dedicated thread
+
+        Args:
+            buffer (FrameBuffer): buffer the frames are captured into
+        """
+        self._capture = CaptureStage(self.source, buffer, self.name, self._metrics, self._scaler)
+        self._capture.start()
+
+    def start(self):
+        """
+        Start capturing frames
+        """
+        if self._capture:
+            self._capture.start()
+
+    def stop(self):
+        """
+        Stop capturing frames
+        """
+        if self._capture:
+            self._capture.stop()
+
+    def set_scaler(self, scaler: FrameScaler = None):
+        """
+        Change the inference resolution of the stream, the frames already
+        captured at the previous resolution are discarded
+
+        Args:
+            scaler (FrameScaler, optional): scaler to the new inference resolution,
+            or None to run the model on the full resolution frames
+        """
+        self._scaler = scaler
+        self.image_size = [0, 0]
+        self.resizing = True
+        if self.slicer:
+            self.slicer.reset()
+        if self.tiles:
+            self.tiles.reset()
+        if self._capture:
+            self._capture.set_scaler(scaler)
+
+    def fits(self, frame):
+        """
+        Check whether a frame has the inference size of the stream, after a
+        resolution change frames scaled before it may still arrive
+
+        Args:
+            frame (Frame): captured frame
+
+        Returns:
+            bool: True if the frame has the stream inference size
+        """
+        image = frame.image
+        if hasattr(image, "width"):
+            size = [image.width, image.height]
+        else:
+            size = [image.shape[1], image.shape[0]]
+
+        return size == list(self.input_size)
+
+    def capture(self, timeout: float = None):
+        """
+        Get the next frame of the stream
+
+        Args:
+            timeout (float, optional): Seconds to wait for a frame from the capture
+            buffer. Defaults to None to wait forever.
+
+        Returns:
+            Frame: The captured frame or None if no frame is available
+        """
+        if not self._capture:
+            image = self.source.Capture()
+            if image is None:
+                logger.warning(f"Capture timeout on {self.name}")
+                if self._metrics:
+                    self._metrics.capture_timeouts.inc(stream=self.name)
+                return None
+
+            timestamp = time.time()
+            if self._scaler:
+                image = self._scaler(image)
+            return Frame(image, timestamp)
+
+        buffer = self._capture.buffer
+        frame = buffer.get(timeout=timeout)
+        if buffer.dropped != self._dropped:
+            dropped = buffer.dropped - self._dropped
+            logger.debug(f"Dropped {dropped} stale frames on {self.name}")
+            if self._metrics:
+                self._metrics.frames.inc(dropped, step="dropped")
+            self._dropped = buffer.dropped
+
+        return frame
+
+    def reset_detections(self):
+        """
+        Discard the last detections so the next frame goes through the model
+        """
+        self.last_predictions = None
+        self.next_inference = 0.0
+        if self.gate:
+            self.gate.reset()
+        if self.tracker:
+            self.tracker.reset()
+        self.deltas.clear()
+        if self.slicer:
+            self.slicer.reset()
+        if self.tiles:
+            self.tiles.reset()
+
+    def update_image_size(self):
+        """
+        Update the image size from the video source once it is known
+
+        Returns:
+            bool: True if the image size changed
+        """
+        if self.image_size != [0, 0]:
+            return False
+
+        self.image_size = [self.source.GetWidth(), self.source.GetHeight()]
+        self.schema_gen.image_size = self.image_size
+
+        # Frames reach the model at the inference size, boxes are scaled back
+        self.input_size = list(self.image_size)
+        if self._scaler:
+            self.input_size = list(self._scaler.output_size(self.image_size))
+        self.scale = (self.image_size[0] / self.input_size[0],
+                      self.image_size[1] / self.input_size[1])
+        if self.scale != (1.0, 1.0):
+            logger.info(
+                f"{self.name} frames of {self.image_size[0]}x{self.image_size[1]} "
+                f"inferred at {self.input_size[0]}x{self.input_size[1]}")
+        return True
+
+    def to_image_coordinates(self, predictions):
+        """
+        Scale detections on the inference size frames back to the original image size
+
+        Args:
+            predictions (Predictions): detections on the model input frame
+
+        Returns:
+            Predictions: The detections in the original image coordinates
+        """
+        if self.scale == (1.0, 1.0):
+            return predictions
+
+        return predictions.scale(*self.scale)
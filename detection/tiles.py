@@ -0,0 +1,136 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Per tile change detection to reuse the results of static slices
+"""
+
+import time
+from typing import NamedTuple, Optional
+
+
+class TileConfig(NamedTuple):
+    """
+    Tile cache settings, the cache is disabled without a threshold. It only
+    applies to the native slicing backend, see TileCache
+    """
+    threshold: Optional[float] = None
+    max_staleness: float = 5.0
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and \
+        outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+class TileCache:
+    """
+    Embeddings and detections of each slice of the last frames of a
+    stream.
+
+    Every slice keeps a downscaled copy of the pixels it was encoded from,
+    and only the slices whose pixels changed past the threshold, or that
+    were not encoded for a while, go through the image encoder again. The
+    rest reuse their embeddings and detections. A slice containing a
+    changed one, like the full frame, is encoded again too, since a local
+    change barely moves its mean difference but its detections would be
+    merged with the fresh ones of the changed slice. The staleness of the
+    slices is spread over the staleness interval and a single stale slice
+    is refreshed per frame, so they do not all go through the encoder at once.
+    """
+
+    def __init__(self, threshold: float = 0.02, max_staleness: float = 5.0,
+                 step: int = 8):
+        """
+        Args:
+            threshold (float, optional): Mean absolute pixel difference, in the
+            0 to 1 range, above which a slice is considered changed. Defaults to 0.02.
+            max_staleness (float, optional): Maximum seconds without encoding a
+            slice. Defaults to 5.0.
+            step (int, optional): Pixel sampling step used to downscale the
+            frames. Defaults to 8.
+        """
+        self._threshold = threshold
+        self._max_staleness = max_staleness
+        self.step = step
+        self.rois = None
+        self.embeddings = []
+        self.predictions = []
+        self.prompt_version = None
+        self._references = []
+        self._encoded_at = []
+        self.encoded = 0
+        self.reused = 0
+
+    def reset(self):
+        """
+        Forget every slice so the next frame is fully encoded
+        """
+        self.rois = None
+        self.embeddings = []
+        self.predictions = []
+        self.prompt_version = None
+        self._references = []
+        self._encoded_at = []
+
+    def _crop(self, thumbnail, roi):
+        x0, y0, x1, y1 = roi
+        step = self.step
+        return thumbnail[y0 // step:-(-y1 // step), x0 // step:-(-x1 // step)]
+
+    def changed(self, thumbnail, rois):
+        """
+        Find the slices of a frame that must be encoded again, and take
+        their pixels as the new reference
+
+        Args:
+            thumbnail (torch.Tensor): downscaled grayscale frame in the 0 to 1 range,
+            sampled every step pixels
+            rois (List[List[int]]): x0, y0, x1, y1 of each slice
+
+        Returns:
+            List[int]: The indexes of the changed slices
+        """
+        import torch
+
+        now = time.monotonic()
+        crops = [self._crop(thumbnail, roi) for roi in rois]
+
+        if rois != self.rois:
+            # A new grid shares nothing with the cached one
+            self.reset()
+            self.rois = [list(roi) for roi in rois]
+            self.embeddings = [None] * len(rois)
+            self.predictions = [None] * len(rois)
+            self._references = crops
+            self._encoded_at = [now - self._max_staleness * i / len(rois)
+                                for i in range(len(rois))]
+            changed = list(range(len(rois)))
+        else:
+            # A single device to host transfer for all the slices
+            differences = torch.stack(
+                [(crop - reference).abs().mean()
+                 for crop, reference in zip(crops, self._references)]).tolist()
+            moved = [i for i, difference in enumerate(differences)
+                     if difference > self._threshold]
+            changed = {i for i, roi in enumerate(rois)
+                       if any(_contains(roi, rois[j]) for j in moved)}
+            stale = [i for i in range(len(rois)) if i not in changed
+                     and now - self._encoded_at[i] >= self._max_staleness]
+            if stale:
+                changed.add(min(stale, key=lambda i: self._encoded_at[i]))
+            changed = sorted(changed)
+            for i in changed:
+                self._references[i] = crops[i]
+                self._encoded_at[i] = now
+
+        self.encoded = len(changed)
+        self.reused = len(rois) - len(changed)
+        return changed
@@ -0,0 +1,222 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Lightweight multi-object tracker
+"""
+
+import logging
+from typing import List, NamedTuple
+
+import numpy as np
+
+from detection.predictions import Predictions, box_iou
+
+logger = logging.getLogger("detection")
+
+
+class Track:
+    """
+    Tracked object with a constant velocity motion model
+    """
+
+    def __init__(self, track_id: int, label: int, box, score: float, timestamp: float):
+        """
+        Args:
+            track_id (int): unique track identifier
+            label (int): label index in the prompt objects
+            box (np.ndarray): x0, y0, x1, y1 box
+            score (float): detection score
+            timestamp (float): detection time in seconds
+        """
+        self.id = track_id
+        self.label = label
+        self.box = box
+        self.score = score
+        self.timestamp = timestamp
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.hits = 1
+
+    def predict(self, timestamp: float):
+        """
+        Predict the box position at the given time
+
+        Args:
+            timestamp (float): time in seconds
+
+        Returns:
+            np.ndarray: The predicted x0, y0, x1, y1 box
+        """
+        return self.box + self.velocity * (timestamp - self.timestamp)
+
+    def update(self, box, score: float, timestamp: float, smoothing: float):
+        """
+        Update the track with a new detection
+
+        Args:
+            box (np.ndarray): x0, y0, x1, y1 detected box
+            score (float): detection score
+            timestamp (float): detection time in seconds
+            smoothing (float): weight of the new velocity measurement
+        """
+        elapsed = timestamp - self.timestamp
+        if elapsed > 0:
+            velocity = (box - self.box) / elapsed
+            self.velocity = smoothing * velocity + \
+                (1 - smoothing) * self.velocity
+
+        self.box = box
+        self.score = score
+        self.timestamp = timestamp
+        self.hits += 1
+
+
+class TrackerOutput(NamedTuple):
+    """
+    Tracker state after a step
+    """
+    tracks: List[Track]
+    boxes: np.ndarray
+    started: List[Track]
+    updated: List[Track]
+    ended: List[Track]
+
+
+class Tracker:
+    """
+    Associate detections between frames by IoU to assign stable track
+    identifiers, and predict the boxes on frames without detections
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: float = 1.0,
+                 smoothing: float = 0.5):
+        """
+        Args:
+            iou_threshold (float, optional): Minimum IoU between a predicted track
+            box and a detection to associate them. Defaults to 0.3.
+            max_age (float, optional): Seconds without detections before a track
+            ends. Defaults to 1.0.
+            smoothing (float, optional): Weight of each new velocity measurement.
+            Defaults to 0.5.
+        """
+        self._iou_threshold = iou_threshold
+        self._max_age = max_age
+        self._smoothing = smoothing
+        self._tracks = []
+        self._next_id = 0
+
+    def reset(self):
+        """
+        End all the tracks
+        """
+        self._tracks = []
+
+    def _predicted_boxes(self, tracks, timestamp):
+        if not tracks:
+            return np.zeros((0, 4), dtype=np.float32)
+
+        return np.stack([track.predict(timestamp) for track in tracks])
+
+    def _associate(self, boxes, predictions):
+        """
+        Greedily match tracks and detections with the highest IoU first
+        """
+        if len(boxes) == 0 or len(predictions) == 0:
+            return []
+
+        iou = box_iou(boxes, predictions.boxes)
+        labels = np.array([track.label for track in self._tracks])
+        iou[labels[:, None] != predictions.labels[None, :]] = 0
+
+        candidates = np.argwhere(iou >= self._iou_threshold)
+        order = np.argsort(-iou[candidates[:, 0], candidates[:, 1]],
+                           kind="stable")
+
+        matches = []
+        used_tracks = set()
+        used_detections = set()
+        for track_index, detection_index in candidates[order].tolist():
+            if track_index in used_tracks or detection_index in used_detections:
+                continue
+            used_tracks.add(track_index)
+            used_detections.add(detection_index)
+            matches.append((track_index, detection_index))
+
+        return matches
+
+    def _expire(self, timestamp):
+        ended = [track for track in self._tracks
+                 if timestamp - track.timestamp > self._max_age]
+        if ended:
+            self._tracks = [track for track in self._tracks
+                            if timestamp - track.timestamp <= self._max_age]
+
+        return ended
+
+    def update(self, predictions: Predictions, timestamp: float):
+        """
+        Update the tracks with the detections of a frame
+
+        Args:
+            predictions (Predictions): frame detections
+            timestamp (float): capture time in seconds
+
+        Returns:
+            TrackerOutput: The active tracks with their boxes and the
+            tracks started, updated and ended in this frame
+        """
+        boxes = self._predicted_boxes(self._tracks, timestamp)
+        matches = self._associate(boxes, predictions)
+
+        updated = []
+        matched = set()
+        for track_index, detection_index in matches:
+            track = self._tracks[track_index]
+            track.update(predictions.boxes[detection_index],
+                         float(predictions.scores[detection_index]),
+                         timestamp, self._smoothing)
+            updated.append(track)
+            matched.add(detection_index)
+
+        started = []
+        for i in range(len(predictions)):
+            if i in matched:
+                continue
+            track = Track(self._next_id, int(predictions.labels[i]),
+                          predictions.boxes[i], float(predictions.scores[i]),
+                          timestamp)
+            self._next_id += 1
+            self._tracks.append(track)
+            started.append(track)
+
+        ended = self._expire(timestamp)
+
+        return TrackerOutput(tracks=list(self._tracks),
+                             boxes=self._predicted_boxes(
+                                 self._tracks, timestamp),
+                             started=started, updated=updated, ended=ended)
+
+    def predict(self, timestamp: float):
+        """
+        Predict the tracks boxes on a frame without detections
+
+        Args:
+            timestamp (float): capture time in seconds
+
+        Returns:
+            TrackerOutput: The active tracks with their predicted boxes and
+            the tracks ended in this frame
+        """
+        ended = self._expire(timestamp)
+
+        return TrackerOutput(tracks=list(self._tracks),
+                             boxes=self._predicted_boxes(
+                                 self._tracks, timestamp),
+                             started=[], updated=[], ended=ended)
@@ -0,0 +1,651 @@
+#  Copyright (C) 2024 RidgeRun, LLC (http://www.ridgerun.com)
+#  All Rights Reserved.
+#
+#  The contents of this software are proprietary and confidential to RidgeRun,
+#  LLC.  No part of this program may be photocopied, reproduced or translated
+#  into another programming language without prior written consent of
+#  RidgeRun, LLC.  The user is free to modify the source code after obtaining
+#  a software license from RidgeRun.  All source code changes must be provided
+#  back to RidgeRun without any encumbrance.
+
+"""
+Capture and inference in worker processes, with the frames moved through
+shared memory
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from types import SimpleNamespace
+from typing import Any, NamedTuple
+
+from detection.detection import VIDEO_OPTIONS, Detection, emit_detections
+from detection.metrics import Metrics
+from detection.pipeline import Frame, FrameScaler
+from detection.publisher import Publisher, PublishConfig
+from detection.quality import QualityStatus
+from detection.shmring import FrameRing
+from detection.startup import Startup
+
+logger = logging.getLogger("detection")
+
+# Seconds between checks of the rings while no stream has a new frame
+POLL_INTERVAL = 0.002
+
+
+def capture_worker(url, options, ring_name, slots, max_size, parent_pid):
+    """
+    Capture the frames of a video source into a shared memory ring until
+    the parent process exits
+
+    Args:
+        url (str): video source uri
+        options (dict): videoSource options
+        ring_name (str): shared memory name of the ring
+        slots (int): amount of frames in the ring
+        max_size (Tuple[int, int]): maximum frame width and height of the ring
+        parent_pid (int): process id of the inference process
+    """
+    # The inference process stops its capture workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from jetson_utils import cudaDeviceSynchronize, cudaToNumpy, videoSource
+
+    ring = FrameRing(ring_name, slots, max_size)
+    source = videoSource(url, options=options)
+    scaler = None
+    try:
+        while os.getppid() == parent_pid:
+            image = source.Capture()
+            if image is None:
+                continue
+
+            timestamp = time.time()
+            original_size = (image.width, image.height)
+
+            # The reader may change the frame size at any time
+            if scaler is None or scaler.size != ring.frame_size:
+                scaler = FrameScaler(ring.frame_size, pool_size=1)
+            image = scaler(image)
+            cudaDeviceSynchronize()
+
+            ring.write(cudaToNumpy(image), timestamp, original_size)
+    finally:
+        source.Close()
+        ring.close()
+
+
+class RingSource:
+    """
+    Video source whose frames are captured by a worker process into a
+    shared memory ring. It exposes the videoSource methods used by the
+    detection, and restarts the capture worker if it dies.
+    """
+
+    def __init__(self, url, options=None, slots=4, max_size=(1920, 1080),
+                 context=None, restart_delay=2.0):
+        """
+        Args:
+            url (str): video source uri
+            options (dict, optional): videoSource options. Defaults to none.
+            slots (int, optional): Amount of frames in the ring. Defaults to 4.
+            max_size (Tuple[int, int], optional): Maximum frame width and height,
+            bigger frames are downscaled by the capture worker. Defaults to 1920x1080.
+            context (multiprocessing.context.BaseContext, optional): context to start
+            the capture worker. Defaults to the spawn context.
+            restart_delay (float, optional): Seconds to wait before restarting a
+            dead capture worker. Defaults to 2.0.
+        """
+        self._url = url
+        self._options = options or {}
+        self._context = context or multiprocessing.get_context("spawn")
+        self._restart_delay = restart_delay
+        self._ring = FrameRing(slots=slots, max_size=max_size, create=True)
+        self._count = 0
+        self._original_size = (0, 0)
+        self._restart_at = None
+        self._process = None
+        self._start()
+
+    def _start(self):
+        self._process = self._context.Process(
+            target=capture_worker, name=f"capture-{self._ring.name}", daemon=True,
+            args=(self._url, self._options, self._ring.name, self._ring.slots,
+                  self._ring.max_size, os.getpid()))
+        self._process.start()
+        self._restart_at = None
+
+    def _supervise(self):
+        if self._process.is_alive():
+            return
+
+        now = time.monotonic()
+        if self._restart_at is None:
+            logger.error(f"Capture worker of {self._url} exited with code "
+                         f"{self._process.exitcode}, restarting it")
+            self._restart_at = now + self._restart_delay
+        elif now >= self._restart_at:
+            self._start()
+
+    @property
+    def frame_size(self):
+        """
+        Maximum width and height of the captured frames
+        """
+        return self._ring.frame_size
+
+    @frame_size.setter
+    def frame_size(self, size):
+        self._ring.frame_size = size
+
+    def read(self, timeout: float = 0.0):
+        """
+        Get the newest frame if there is a new one
+
+        Args:
+            timeout (float, optional): Seconds to wait for a new frame. Defaults to
+            0 to return at once.
+
+        Returns:
+            Frame: The newest frame, a view of the shared memory valid until the
+            next read, or None if there is no new frame
+        """
+        self._supervise()
+        frame = self._ring.read(self._count, timeout)
+        if frame is None:
+            return None
+
+        self._count = frame.count
+        self._original_size = frame.original_size
+        return Frame(frame.image, frame.timestamp)
+
+    def Capture(self):  # pylint: disable=invalid-name
+        """
+        Wait up to a second for a new frame
+
+        Returns:
+            np.ndarray: The frame image or None on timeout
+        """
+        frame = self.read(timeout=1.0)
+        return frame.image if frame else None
+
+    def GetWidth(self):  # pylint: disable=invalid-name
+        """
+        Width of the frames before they are downscaled
+        """
+        return self._original_size[0]
+
+    def GetHeight(self):  # pylint: disable=invalid-name
+        """
+        Height of the frames before they are downscaled
+        """
+        return self._original_size[1]
+
+    def Close(self):  # pylint: disable=invalid-name
+        """
+        Stop the capture worker and release the ring
+        """
+        self._process.terminate()
+        self._process.join(timeout=5.0)
+        self._ring.close()
+
+
+class ResultsPublisher:
+    """
+    Publisher of the inference worker, it sends the detections to the main
+    process which publishes them to redis and the live detections subscribers
+    """
+
+    def __init__(self, results):
+        """
+        Args:
+            results (multiprocessing.Queue): queue read by the main process
+        """
+        self._results = results
+
+    def connect(self):
+        """
+        Nothing to connect, the main process owns the redis connection
+        """
+
+    def start(self):
+        """
+        Nothing to start, the main process owns the redis connection
+        """
+
+    def stop(self):
+        """
+        Nothing to stop, the main process owns the redis connection
+        """
+
+    def publish_detections(self, stream, text_labels, bboxes, scores, **fields):
+        """
+        Send the detections of a stream to the main process
+
+        Args:
+            stream (Stream): the stream the detections belong to
+            text_labels (List[str]): detections labels
+            bboxes (List[List[float]]): detections boxes
+            scores (List[float]): detections scores
+            fields: additional message fields
+        """
+        self._results.put(("detections", stream.name, stream.sensor_id,
+                           list(stream.image_size), text_labels, bboxes, scores, fields))
+
+    def publish_metrics(self, metrics):
+        """
+        Send the worker metrics to the main process
+
+        Args:
+            metrics (Metrics): the worker metrics
+        """
+        self._results.put(("metrics", metrics.snapshot()))
+
+
+class WorkerDetection(Detection):
+    """
+    Detection loop of the inference worker process. Every stream is
+    captured by its own worker process into a shared memory ring, and the
+    results are sent to the main process.
+    """
+
+    def __init__(self, results, search_queue, source_queue, ring_slots=4,
+                 ring_frame_size=(1920, 1080), metrics_interval=1.0, **kwargs):
+        """
+        Args:
+            results (multiprocessing.Queue): queue to send the results to the main process
+            search_queue (Queue): search updates
+            source_queue (Queue): source updates
+            ring_slots (int, optional): Frames in the ring of each stream. Defaults to 4.
+            ring_frame_size (Tuple[int, int], optional): Maximum width and height of
+            the frames in the rings. Defaults to 1920x1080.
+            metrics_interval (float, optional): Seconds between metrics reports.
+            Defaults to 1.0.
+            kwargs: Detection arguments
+        """
+        self._results = results
+        super().__init__(search_queue, source_queue,
+                         startup=Startup(self._report_startup),
+                         quality_status=QualityStatus(self._report_quality), **kwargs)
+        self._ring_slots = ring_slots
+        self._ring_frame_size = tuple(ring_frame_size)
+        self._metrics_interval = metrics_interval
+        self._next_metrics = 0.0
+        self._publisher = ResultsPublisher(results)
+        self._context = multiprocessing.get_context("spawn")
+
+        # The capture workers already decouple capture from inference
+        self._pipelined = False
+
+    def _capture_in_threads(self):
+        """
+        The capture workers already capture every stream on its own
+        """
+
+    def create_video_stream(self, stream_name=None):
+        """
+        Start the capture worker of the given sensor name or of the first
+        VST source available
+
+        Args:
+           stream_name(str): VST sensor name
+
+        Returns:
+           Tuple[RingSource, str, str]: A tuple of RingSource to read the
+           frames, its corresponding sensor id and stream name
+        """
+        input_stream = self.get_input_stream(stream_name)
+        logger.info(f"Get video from stream {input_stream} in a capture worker")
+
+        source = RingSource(input_stream['url'], VIDEO_OPTIONS, self._ring_slots,
+                            self._ring_frame_size, self._context)
+
+        return source, input_stream['streamID'], input_stream['name']
+
+    def release_video_stream(self, v_source):
+        """
+        Stop the capture worker of a source
+
+        Args:
+           v_source(RingSource): the released video source
+        """
+        v_source.Close()
+
+    def create_scaler(self, v_source, inference_size):
+        """
+        Set the size the capture worker downscales the frames to
+
+        Args:
+           v_source(RingSource): the stream video source
+           inference_size(Tuple[int, int]): maximum width and height of the
+           frames given to the model, or None to use the ring maximum frame size
+
+        Returns:
+           FrameScaler: A scaler matching the capture worker one, used to
+           scale the detections back
+        """
+        v_source.frame_size = inference_size or self._ring_frame_size
+
+        return FrameScaler(v_source.frame_size, pool_size=1)
+
+    def create_schema_generator(self, sensor_id, image_size):
+        """
+        The messages are generated by the main process, only the image size is
+        tracked here
+
+        Args:
+           sensor_id(str): VST sensor id of the stream
+           image_size(List[int]): image width and height
+
+        Returns:
+           SimpleNamespace: The stream sensor id and image size
+        """
+        return SimpleNamespace(sensor_id=sensor_id, image_size=image_size)
+
+    def create_publisher(self):
+        """
+        Create the publisher sending the results to the main process
+
+        Returns:
+           ResultsPublisher: The results publisher
+        """
+        return self._publisher
+
+    def _capture(self):
+        now = time.monotonic()
+        if now >= self._next_metrics:
+            self._publisher.publish_metrics(self._metrics)
+            self._next_metrics = now + self._metrics_interval
+
+        frames = []
+        for stream in self._streams.values():
+            frame = stream.source.read()
+            if frame is None:
+                continue
+
+            if self._update_image_size(stream, frame):
+                frames.append((stream, frame))
+
+        if not frames:
+            time.sleep(POLL_INTERVAL)
+
+        return frames
+
+    def _emit(self, publisher, stream, text_labels, bboxes, scores, **fields):
+        publisher.publish_detections(stream, text_labels, bboxes, scores, **fields)
+
+    def _reply(self, reply, result=None, error=None):
+        self._results.put(("query", reply, result, error))
+
+    def _connect_publisher(self):
+        # The main process connects to redis
+        return self.create_publisher()
+
+    def _report_startup(self, report):
+        self._results.put(("startup", report))
+
+    def _report_quality(self, report):
+        self._results.put(("quality", report))
+
+
+def run_inference_worker(results, queues, kwargs):
+    """
+    Run the detection loop of the inference worker process until it is
+    terminated
+
+    Args:
+        results (multiprocessing.Queue): queue to send the results to the main process
+        queues (Dict[str, multiprocessing.Queue]): search, source, stream, region
+        of interest, query and model updates
+        kwargs (dict): WorkerDetection arguments
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    detection = WorkerDetection(results, queues["search"], queues["source"],
+                                stream_queue=queues["stream"], roi_queue=queues["roi"],
+                                query_queue=queues["query"], model_queue=queues["model"],
+                                **kwargs)
+
+    # The main process stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: detection.stop())
+
+    detection.loop()
+
+
+class _RemoteStream(NamedTuple):
+    name: str
+    sensor_id: str
+    schema_gen: Any
+
+
+class InferenceSupervisor:
+    """
+    Run the detection in an inference worker process, publish its results
+    from the main process and restart it if it dies.
+
+    The search, source, stream, region and model updates are forwarded to
+    the worker and the latest state is replayed to a restarted worker, so it
+    resumes with the same streams, searches and model.
+    """
+
+    def __init__(self, search_queue, source_queue, stream_queue=None, roi_queue=None,
+                 query_queue=None, model_queue=None, broadcaster=None, recorders=None,
+                 startup=None, quality_status=None, metrics=None, restart_delay=2.0,
+                 **kwargs):
+        """
+        Args:
+            search_queue (Queue): search updates
+            source_queue (Queue): source updates
+            stream_queue (Queue, optional): stream set updates. Defaults to None.
+            roi_queue (Queue, optional): regions of interest updates. Defaults to None.
+            query_queue (Queue, optional): queries over the cached embeddings.
+            Defaults to None.
+            model_queue (Queue, optional): model changes. Defaults to None.
+            broadcaster (Broadcaster, optional): live detections subscribers.
+            Defaults to None.
+            recorders (List, optional): detection history and columnar log the
+            worker detections are kept in. Defaults to None.
+            startup (Startup, optional): progress the worker startup stages are
+            reported to. Defaults to None.
+            quality_status (QualityStatus, optional): status the worker model and
+            quality tier are reported to. Defaults to None.
+            metrics (Metrics, optional): registry the worker metrics are merged
+            into. Defaults to a new registry.
+            restart_delay (float, optional): Seconds to wait before restarting a
+            dead worker. Defaults to 2.0.
+            kwargs: WorkerDetection arguments
+        """
+        self._queues = {"search": search_queue, "source": source_queue,
+                        "stream": stream_queue, "roi": roi_queue, "query": query_queue,
+                        "model": model_queue}
+        self._broadcaster = broadcaster
+        self._recorders = list(recorders or [])
+        self._startup = startup if startup is not None else Startup()
+        self._quality_status = quality_status if quality_status is not None else QualityStatus()
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._restarts = self._metrics.counter(
+            "detection_worker_restarts_total", "Inference worker restarts")
+        self._restart_delay = restart_delay
+        self._kwargs = kwargs
+        publish = kwargs.get("publish", PublishConfig())
+        self._publisher = Publisher(kwargs.get("redis_host", "0.0.0.0"),
+                                    kwargs.get("redis_port", 6379),
+                                    kwargs.get("redis_stream", "detection"),
+                                    queue_size=publish.queue_size, policy=publish.policy,
+                                    batch_size=publish.batch_size, metrics=self._metrics)
+        self._context = multiprocessing.get_context("spawn")
+        self._worker = None
+        self._worker_queues = {}
+        self._results = None
+        self._schemas = {}
+        self._searches = {}
+        self._source = None
+        self._stream_updates = {}
+        self._rois = {}
+        self._model = None
+        self._queries = {}
+        self._next_query = 0
+        self._running = False
+
+    def _start_worker(self):
+        self._results = self._context.Queue()
+        self._worker_queues = {name: self._context.Queue() for name in self._queues}
+
+        # Replay the state to a restarted worker
+        if self._source is not None:
+            self._worker_queues["source"].put(self._source)
+        for update in self._stream_updates.values():
+            self._worker_queues["stream"].put(update)
+        for name, regions in self._rois.items():
+            self._worker_queues["roi"].put((name, regions))
+        for update in self._searches.values():
+            self._worker_queues["search"].put(update)
+        if self._model is not None:
+            self._worker_queues["model"].put(self._model)
+
+        self._worker = self._context.Process(
+            target=run_inference_worker, name="inference",
+            args=(self._results, self._worker_queues, self._kwargs))
+        self._worker.start()
+        logger.info(f"Inference worker started with pid {self._worker.pid}")
+
+    def _stop_worker(self):
+        if self._worker is None:
+            return
+
+        self._worker.terminate()
+        self._worker.join(timeout=10.0)
+        if self._worker.is_alive():
+            logger.warning("Inference worker did not stop, killing it")
+            self._worker.kill()
+            self._worker.join()
+
+    def _forward_updates(self):
+        for name, updates in self._queues.items():
+            while updates is not None and not updates.empty():
+                update = updates.get()
+                if name == "search":
+                    self._searches.pop(update[0], None)
+                    if update[2] is not None:
+                        self._searches[update[0]] = update
+                elif name == "source":
+                    # The source replaces every active stream
+                    self._source = update
+                    self._stream_updates = {}
+                elif name == "stream":
+                    # Only the last update of each stream is replayed, and the
+                    # removals only for the streams the worker starts with
+                    action, stream_name, _ = update
+                    startup = self._kwargs.get("streams")
+                    if action == "remove" and startup is not None and stream_name not in startup:
+                        self._stream_updates.pop(stream_name, None)
+                    else:
+                        self._stream_updates[stream_name] = update
+                elif name == "model":
+                    self._model = update
+                elif name == "query":
+                    # The answer is matched to the waiting request by its id
+                    query, reply = update
+                    self._next_query += 1
+                    self._queries[self._next_query] = reply
+                    update = (query, self._next_query)
+                elif update[1]:
+                    self._rois[update[0]] = update[1]
+                else:
+                    self._rois.pop(update[0], None)
+
+                self._worker_queues[name].put(update)
+
+    def _schema_generator(self, sensor_id, image_size):
+        schema_gen = self._schemas.get(sensor_id)
+        if schema_gen is None:
+            from rrmsutils.schemagenerator import SchemaGenerator
+
+            schema_gen = SchemaGenerator(sensor_id=sensor_id, image_size=image_size)
+            self._schemas[sensor_id] = schema_gen
+        schema_gen.image_size = image_size
+
+        return schema_gen
+
+    def _fail_queries(self):
+        for reply in self._queries.values():
+            reply.set_exception(RuntimeError("The inference worker restarted"))
+        self._queries = {}
+
+    def _handle(self, message):
+        if message[0] == "metrics":
+            self._metrics.merge_remote("inference", message[1])
+            return
+
+        if message[0] == "startup":
+            self._startup.update(message[1])
+            return
+
+        if message[0] == "quality":
+            self._quality_status.set(**{key: value for key, value in message[1].items()
+                                        if key != "models"})
+            return
+
+        if message[0] == "query":
+            _, query_id, result, error = message
+            reply = self._queries.pop(query_id, None)
+            if reply is None:
+                return
+            if error is not None:
+                reply.set_exception(error)
+            else:
+                reply.set_result(result)
+            return
+
+        _, name, sensor_id, image_size, text_labels, bboxes, scores, fields = message
+        stream = _RemoteStream(name, sensor_id,
+                               self._schema_generator(sensor_id, image_size))
+        emit_detections(self._publisher, self._broadcaster, stream, text_labels,
+                        bboxes, scores, self._recorders, **fields)
+
+    def stop(self):
+        """
+        Stop the supervisor loop
+        """
+        self._running = False
+
+    def loop(self):
+        """
+        Start the inference worker and publish its results until stopped
+        """
+        self._publisher.start()
+        self._running = True
+        try:
+            self._start_worker()
+
+            # Connect to redis while the worker loads the model
+            try:
+                with self._startup.stage("redis"):
+                    self._publisher.connect()
+            except Exception as e:
+                logger.warning(f"Redis is not reachable yet: {e}")
+            while self._running:
+                if not self._worker.is_alive():
+                    logger.error(f"Inference worker exited with code "
+                                 f"{self._worker.exitcode}, restarting it")
+                    self._restarts.inc()
+                    self._fail_queries()
+                    self._startup.reset()
+                    time.sleep(self._restart_delay)
+                    self._start_worker()
+
+                self._forward_updates()
+                try:
+                    message = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                self._handle(message)
+        finally:
+            self._stop_worker()
+            self._fail_queries()
+            self._publisher.stop()
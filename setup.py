@@ -37,11 +37,17 @@ setuptools.setup(
         'sphinx',
         'sphinx_rtd_theme',
         'sphinx-mdinclude',
-        'sahi'
+        'sahi',
+        'redis'
     ],
+    extras_require={
+        'async': ['uvicorn[standard]', 'asgiref'],
+        'opencv': ['opencv-python-headless'],
+    },
     entry_points={
         'console_scripts': [
             'detection=detection.main:main',
+            'detection-bench=detection.bench:main',
         ],
     },
 )